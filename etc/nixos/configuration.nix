@@ -4,6 +4,7 @@ let
     pyaudio
 	openai
 	pyttsx3
+	numpy
     # other python packages
     #(
     #  buildPythonPackage rec {
@@ -0,0 +1,159 @@
+import os
+import glob
+import queue
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import pyaudio
+
+from ttspipeline import Segment
+
+logger = logging.getLogger(__name__)
+
+
+class AudioOutput:
+    """
+    @brief Long-lived audio output engine.
+
+    Keeps PyAudio and one output stream per sample format open for the lifetime of the application,
+    holds the sound cues decoded in memory and plays them on a dedicated thread.
+    """
+    FRAMES_PER_WRITE = 1024
+
+    _shared: Optional["AudioOutput"] = None
+
+    def __init__(self, device_index: Optional[int] = None):
+        """
+        @param device_index: PyAudio index of the output device, None for the default device.
+        """
+        self.audio = pyaudio.PyAudio()
+        self.device_index = device_index if device_index else None
+        if self.device_index is not None:
+            logger.debug("Playing audio using {}".format(self.audio.get_device_info_by_index(self.device_index)))
+
+        self._streams: Dict[Tuple[int, int, int], pyaudio.Stream] = {}
+        self._cues: Dict[str, Segment] = {}
+        self._jobs: queue.Queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run, name="audio-out", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def shared(cls, device_index: Optional[int] = None) -> "AudioOutput":
+        """
+        @brief Returns the process wide output engine, creating it on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls(device_index)
+        return cls._shared
+
+    def load_cue(self, filename: str) -> Segment:
+        """
+        @brief Decodes a WAV file into memory and opens an output stream for its format.
+
+        @param filename: The path to the WAV file, used as name of the cue.
+
+        @return The decoded cue.
+        """
+        with open(filename, 'rb') as wav_file:
+            cue = Segment(os.path.basename(filename))
+            cue.load_wav(wav_file.read())
+
+        self._cues[filename] = cue
+        self._stream(cue)
+        logger.debug("Loaded sound cue {} ({:.2f}s)".format(filename, cue.duration))
+        return cue
+
+    def load_cues(self, directory: str) -> None:
+        """
+        @brief Preloads all WAV files of a directory.
+        """
+        for filename in sorted(glob.glob(os.path.join(directory, "*.wav"))):
+            self.load_cue(filename)
+
+    def play_file(self, filename: str, block: bool = False) -> threading.Event:
+        """
+        @brief Plays a WAV file, decoding it only on first use.
+
+        @param filename: The path to the WAV file that should be played.
+        @param block: Wait until the playback has finished.
+
+        @return Event set when the playback has finished.
+        """
+        cue = self._cues.get(filename) or self.load_cue(filename)
+        return self.play(cue, block)
+
+    def play(self, segment: Segment, block: bool = False) -> threading.Event:
+        """
+        @brief Queues PCM audio for playback.
+
+        @param segment: The audio to be played.
+        @param block: Wait until the playback has finished.
+
+        @return Event set when the playback has finished.
+        """
+        done = threading.Event()
+        self._jobs.put((segment, done))
+        if block:
+            done.wait()
+        return done
+
+    def stop(self) -> None:
+        """
+        @brief Aborts the current playback and discards all queued audio.
+        """
+        while True:
+            try:
+                _, done = self._jobs.get_nowait()
+                done.set()
+            except queue.Empty:
+                break
+        self._stop_event.set()
+
+    def close(self) -> None:
+        self.stop()
+        self._jobs.put(None)
+        self._thread.join(timeout=2)
+        with self._lock:
+            for stream in self._streams.values():
+                stream.close()
+            self._streams.clear()
+        self.audio.terminate()
+
+    def _stream(self, segment: Segment) -> pyaudio.Stream:
+        key = (segment.sample_width, segment.channels, segment.sample_rate)
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                logger.debug("Opening output stream {}".format(key))
+                stream = self.audio.open(format=self.audio.get_format_from_width(segment.sample_width),
+                                         channels=segment.channels,
+                                         rate=segment.sample_rate,
+                                         output=True,
+                                         output_device_index=self.device_index)
+                self._streams[key] = stream
+            return stream
+
+    def _run(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            segment, done = job
+            self._stop_event.clear()
+            try:
+                stream = self._stream(segment)
+                step = self.FRAMES_PER_WRITE * segment.sample_width * segment.channels
+                pcm = memoryview(segment.pcm)
+                for pos in range(0, len(pcm), step):
+                    if self._stop_event.is_set():
+                        break
+                    stream.write(bytes(pcm[pos:pos + step]))
+            except Exception as e:
+                logger.error("Playback of {} failed: {}".format(segment.text, e))
+            finally:
+                done.set()
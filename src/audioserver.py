@@ -0,0 +1,246 @@
+import time
+import socket
+import struct
+import logging
+import threading
+import itertools
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+
+from ttspipeline import Segment
+
+logger = logging.getLogger(__name__)
+
+
+def wav_header(sample_rate: int, sample_width: int, channels: int, data_size: Optional[int] = None) -> bytes:
+    """
+    @brief Creates the header of a PCM WAV file.
+
+    @param data_size: Size of the PCM data, None for a stream of unknown length.
+    """
+    if data_size is None:
+        data_size = 0xFFFFFFFF - 36
+    block_align = sample_width * channels
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE', b'fmt ', 16, 1, channels,
+                       sample_rate, sample_rate * block_align, block_align, sample_width * 8, b'data', data_size)
+
+
+def local_ip(target: str) -> str:
+    """
+    @brief The address of the local interface used to reach the given host.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.connect((target, 1400))
+        return sock.getsockname()[0]
+
+
+class Clip:
+    """
+    @brief In-memory audio clip that can be served while it is still being synthesized.
+    """
+
+    def __init__(self, clip_id: str, sample_rate: int, sample_width: int = 2, channels: int = 1):
+        self.clip_id = clip_id
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.size = 0
+        self.complete = False
+
+        self._chunks = []
+        self._cond = threading.Condition()
+
+    def append(self, pcm: bytes) -> None:
+        with self._cond:
+            self._chunks.append(pcm)
+            self.size += len(pcm)
+            self._cond.notify_all()
+
+    def finish(self) -> None:
+        with self._cond:
+            self.complete = True
+            self._cond.notify_all()
+
+    def header(self) -> bytes:
+        return wav_header(self.sample_rate, self.sample_width, self.channels, self.size if self.complete else None)
+
+    def stream(self, timeout: float = 30.0) -> Iterator[bytes]:
+        """
+        @brief Yields the PCM data, waiting for further data until the clip is complete.
+
+        @param timeout: Maximum time to wait for more data.
+        """
+        index = 0
+        while True:
+            with self._cond:
+                if not self._cond.wait_for(lambda: index < len(self._chunks) or self.complete, timeout):
+                    return
+                chunks = self._chunks[index:]
+                complete = self.complete
+            index += len(chunks)
+            yield from chunks
+            if complete and index >= len(self._chunks):
+                return
+
+
+class _ClipHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "AudioServer"
+
+    def _clip(self) -> Optional[Clip]:
+        clip_id = self.path.rsplit("/", 1)[-1].split(".")[0]
+        clip = self.server.get_clip(clip_id)
+        if clip is None:
+            self.send_error(404)
+        return clip
+
+    def _send_headers(self, clip: Clip) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/wav")
+        if clip.complete:
+            self.send_header("Content-Length", str(44 + clip.size))
+        else:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def do_HEAD(self):
+        clip = self._clip()
+        if clip:
+            self._send_headers(clip)
+
+    def do_GET(self):
+        clip = self._clip()
+        if clip is None:
+            return
+
+        chunked = not clip.complete
+        self._send_headers(clip)
+        try:
+            for data in itertools.chain([clip.header()], clip.stream()):
+                if chunked:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                else:
+                    self.wfile.write(data)
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("Client closed the connection to clip {}".format(clip.clip_id))
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+
+class AudioServer(ThreadingHTTPServer):
+    """
+    @brief Lightweight HTTP server serving synthesized audio from memory, e.g. to DLNA renderers.
+
+    Clips still being synthesized are streamed with chunked transfer encoding. Served clips are kept
+    in an LRU cache limited by memory size.
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 0, max_bytes: int = 8 * 1024 * 1024,
+                 advertised_host: Optional[str] = None):
+        """
+        @param host: Address to listen on.
+        @param port: Port to listen on, 0 for any free port.
+        @param max_bytes: Memory limit of the clips kept.
+        @param advertised_host: Address of this host as used in the URLs, e.g. from local_ip().
+        """
+        super().__init__((host, port), _ClipHandler)
+        self.max_bytes = max_bytes
+        self.advertised_host = advertised_host or socket.gethostbyname(socket.gethostname())
+        self._clips: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._thread = threading.Thread(target=self.serve_forever, name="audio-server", daemon=True)
+
+    def start(self) -> "AudioServer":
+        self._thread.start()
+        logger.info("Serving audio on port {}".format(self.server_port))
+        return self
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def url(self, clip: Clip) -> str:
+        return "http://{}:{}/clips/{}.wav".format(self.advertised_host, self.server_port, clip.clip_id)
+
+    def create_clip(self, sample_rate: int, sample_width: int = 2, channels: int = 1) -> Clip:
+        clip = Clip("{}-{}".format(int(time.time()), next(self._ids)), sample_rate, sample_width, channels)
+        with self._lock:
+            self._clips[clip.clip_id] = clip
+        return clip
+
+    def publish(self, segment: Segment) -> str:
+        """
+        @brief Serves the audio of a rendered segment.
+
+        @return The URL of the clip.
+        """
+        clip = self.create_clip(segment.sample_rate, segment.sample_width, segment.channels)
+        clip.append(segment.pcm)
+        clip.finish()
+        self.evict()
+        return self.url(clip)
+
+    def get_clip(self, clip_id: str) -> Optional[Clip]:
+        with self._lock:
+            clip = self._clips.get(clip_id)
+            if clip:
+                self._clips.move_to_end(clip_id)
+            return clip
+
+    def memory(self) -> int:
+        return sum(clip.size for clip in self._clips.values())
+
+    def evict(self) -> None:
+        """
+        @brief Drops the least recently used complete clips until the memory limit is kept.
+        """
+        with self._lock:
+            size = self.memory()
+            for clip_id in list(self._clips):
+                if size <= self.max_bytes:
+                    break
+                clip = self._clips[clip_id]
+                if clip.complete:
+                    size -= clip.size
+                    del self._clips[clip_id]
+                    logger.debug("Evicted clip {}".format(clip_id))
+
+
+class DlnaPlayer:
+    """
+    @brief Player for the TtsPipeline sending the segments of a reply as one stream to a DLNA renderer.
+
+    The renderer is started with the first segment of a reply and fetches the following ones while they
+    are synthesized. finish() has to be called at the end of each reply.
+    """
+
+    def __init__(self, server: AudioServer, dlna):
+        """
+        @param server: The server providing the audio.
+        @param dlna: DlnaHelper of the target renderer.
+        """
+        self.server = server
+        self.dlna = dlna
+        self.clip: Optional[Clip] = None
+
+    def __call__(self, segment: Segment) -> None:
+        if self.clip is None:
+            self.clip = self.server.create_clip(segment.sample_rate, segment.sample_width, segment.channels)
+            self.clip.append(segment.pcm)
+            self.dlna.play_uri(self.server.url(self.clip))
+        else:
+            self.clip.append(segment.pcm)
+        self.server.evict()
+        # keep the pipeline in step with the playback on the renderer
+        time.sleep(segment.duration)
+
+    def finish(self) -> None:
+        if self.clip:
+            self.clip.finish()
+            self.clip = None
@@ -0,0 +1,137 @@
+import time
+import logging
+from collections import deque
+from typing import Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SPEED_OF_SOUND = 343.0
+
+
+class Beamformer:
+    """
+    @brief Frequency domain delay-and-sum beamformer with SRP-PHAT direction of arrival estimation
+           for a circular microphone array like the Seeed/ReSpeaker 6-mic array.
+
+    Takes interleaved 16 bit multi-channel chunks as delivered by PyAudio and returns one enhanced
+    mono channel steered to the estimated direction of the speaker.
+    """
+
+    def __init__(self, sample_rate: int, channels: int = 8, mic_channels: Sequence[int] = range(6),
+                 radius: float = 0.0463, mic_angles: Optional[Sequence[float]] = None, resolution: int = 5,
+                 band: Sequence[float] = (300.0, 4000.0), bin_step: int = 2, min_rms: float = 200.0):
+        """
+        @param sample_rate: Sample rate of the captured audio.
+        @param channels: Number of interleaved channels delivered by the device.
+        @param mic_channels: Channels carrying the array microphones, the others (e.g. playback loopback) are ignored.
+        @param radius: Radius of the microphone circle in meters.
+        @param mic_angles: Angle of each microphone in degrees, evenly spaced if not given.
+        @param resolution: Step in degrees of the direction search.
+        @param band: Frequency band in Hz used for the direction estimation.
+        @param bin_step: Use only every n-th frequency bin of the band for the direction estimation.
+        @param min_rms: Minimum chunk RMS for the direction estimate to be updated.
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.mic_channels = list(mic_channels)
+        num_mics = len(self.mic_channels)
+        # adjacent channels are selected by a slice, a view, instead of indexing by a list, which copies
+        first = self.mic_channels[0]
+        if self.mic_channels == list(range(first, first + num_mics)):
+            self._mic_select = slice(first, first + num_mics)
+        else:
+            self._mic_select = self.mic_channels
+        if mic_angles is None:
+            mic_angles = [360.0 * m / num_mics for m in range(num_mics)]
+        self.mic_angles = np.radians(np.asarray(mic_angles, dtype=np.float64))
+        self.radius = radius
+        self.min_rms = min_rms
+
+        self.angles = np.arange(0, 360, resolution, dtype=np.float64)
+        # arrival time at every microphone relative to the array center for a plane wave from each direction
+        arrival = -radius / SPEED_OF_SOUND * np.cos(np.radians(self.angles)[:, None] - self.mic_angles[None, :])
+        # compensating delays, shifted to be non-negative so the alignment only delays the signals
+        self.delays = radius / SPEED_OF_SOUND - arrival
+        self.band = band
+        self.bin_step = bin_step
+
+        self._num_frames = 0
+        self._power = np.zeros(len(self.angles))
+        self._carry = np.zeros(0, dtype=np.float32)
+        self.direction_index = 0
+        self.timings: deque = deque(maxlen=200)
+
+    @property
+    def doa(self) -> float:
+        """
+        @brief Estimated direction of arrival in degrees.
+        """
+        return float(self.angles[self.direction_index])
+
+    def _prepare(self, num_frames: int) -> None:
+        self._num_frames = num_frames
+        max_delay = int(np.ceil(self.delays.max() * self.sample_rate)) + 1
+        self.nfft = 1 << int(np.ceil(np.log2(num_frames + max_delay)))
+        freqs = np.fft.rfftfreq(self.nfft, 1.0 / self.sample_rate)
+        self.band_bins = np.flatnonzero((freqs >= self.band[0]) & (freqs <= self.band[1]))[::self.bin_step]
+        # steering[a, m, f]: phase shift aligning microphone m for direction a
+        self.steering = np.exp(-2j * np.pi * freqs[None, None, :] * self.delays[:, :, None]).astype(np.complex64)
+        # same for the band bins only, ordered [f, a, m] for a batched matrix product
+        self.band_steering = np.ascontiguousarray(self.steering[:, :, self.band_bins].transpose(2, 0, 1))
+        self._carry = np.zeros(self.nfft - num_frames, dtype=np.float32)
+
+    def process(self, data: bytes) -> bytes:
+        """
+        @brief Beamforms a chunk of interleaved multi-channel audio.
+
+        @param data: Interleaved 16 bit PCM bytes with `channels` channels.
+
+        @return 16 bit mono PCM bytes with the same number of frames.
+        """
+        start = time.perf_counter()
+        # zero-copy view on the PyAudio buffer, one row per frame
+        frames = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+        num_frames = len(frames)
+        if num_frames != self._num_frames:
+            self._prepare(num_frames)
+
+        # the conversion to float is the only copy of the samples
+        mics = frames[:, self._mic_select].T.astype(np.float32)
+        spectra = np.fft.rfft(mics, n=self.nfft, axis=1)
+
+        if np.sqrt(np.mean(mics[0] * mics[0])) > self.min_rms:
+            self._update_direction(spectra)
+
+        aligned = spectra * self.steering[self.direction_index]
+        output = np.fft.irfft(aligned.mean(axis=0), n=self.nfft).astype(np.float32)
+
+        # overlap-add the tail of the previous chunk
+        output[:len(self._carry)] += self._carry
+        self._carry = output[num_frames:].copy()
+        result = np.clip(np.rint(output[:num_frames]), -32768, 32767).astype(np.int16).tobytes()
+
+        self.timings.append(time.perf_counter() - start)
+        return result
+
+    def _update_direction(self, spectra: np.ndarray) -> None:
+        band = spectra[:, self.band_bins].astype(np.complex64)
+        phat = band / np.maximum(np.abs(band), 1e-9)
+        steered = np.matmul(self.band_steering, phat.T[:, :, None])[:, :, 0]
+        power = np.sum(steered.real ** 2 + steered.imag ** 2, axis=0)
+        self._power = 0.7 * self._power + 0.3 * power / max(power.max(), 1e-9)
+        self.direction_index = int(np.argmax(self._power))
+
+    def stats(self) -> dict:
+        """
+        @brief Processing time per chunk and the share of real time it takes.
+        """
+        if not self.timings:
+            return {}
+        timings = sorted(self.timings)
+        mean = sum(timings) / len(timings)
+        return {"doa": self.doa,
+                "mean_ms": round(mean * 1000, 3),
+                "max_ms": round(timings[-1] * 1000, 3),
+                "cpu_load": round(mean / (self._num_frames / self.sample_rate), 4)}
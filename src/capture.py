@@ -0,0 +1,204 @@
+import logging
+import threading
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AudioRingBuffer:
+    """
+    @brief Bounded, preallocated ring buffer for PCM audio.
+
+    Written by the capture thread and read by the recognition thread. If the reader falls behind, the
+    oldest audio is overwritten and accounted as overflow instead of blocking the audio device.
+    All writes and reads have to be multiples of the frame size.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        @param capacity: Size of the buffer in bytes.
+        """
+        self.capacity = capacity
+        self._buf = bytearray(capacity)
+        self._read_pos = 0
+        self._fill = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.overflow_count = 0
+        self.overflow_bytes = 0
+        self.high_water_mark = 0
+
+    def __len__(self) -> int:
+        return self._fill
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def write(self, data: bytes, block: bool = False) -> None:
+        """
+        @brief Appends PCM data, dropping the oldest audio if the buffer is full.
+
+        @param data: Raw PCM bytes.
+        @param block: Wait for free space instead of dropping audio.
+        """
+        view = memoryview(data)
+        size = len(view)
+        if size == 0:
+            return
+
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: self.capacity - self._fill >= min(size, self.capacity) or self._closed)
+
+            if size > self.capacity:
+                self._count_overflow(size - self.capacity)
+                view = view[size - self.capacity:]
+                size = self.capacity
+
+            free = self.capacity - self._fill
+            if size > free:
+                dropped = size - free
+                self._count_overflow(dropped)
+                self._read_pos = (self._read_pos + dropped) % self.capacity
+                self._fill -= dropped
+
+            write_pos = (self._read_pos + self._fill) % self.capacity
+            first = min(size, self.capacity - write_pos)
+            self._buf[write_pos:write_pos + first] = view[:first]
+            if first < size:
+                self._buf[:size - first] = view[first:]
+
+            self._fill += size
+            self.high_water_mark = max(self.high_water_mark, self._fill)
+            self._cond.notify_all()
+
+    def read(self, size: int, timeout: Optional[float] = None) -> bytes:
+        """
+        @brief Removes and returns exactly size bytes, waiting until enough audio is available.
+
+        @param size: Number of bytes to read.
+        @param timeout: Maximum time in seconds to wait, None to wait forever.
+
+        @return The PCM bytes. Less than size bytes only if the buffer was closed or the timeout expired.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._fill >= size or self._closed, timeout)
+            size = min(size, self._fill)
+
+            first = min(size, self.capacity - self._read_pos)
+            data = bytes(self._buf[self._read_pos:self._read_pos + first])
+            if first < size:
+                data += bytes(self._buf[:size - first])
+
+            self._read_pos = (self._read_pos + size) % self.capacity
+            self._fill -= size
+            self._cond.notify_all()
+            return data
+
+    def clear(self) -> None:
+        with self._cond:
+            self._read_pos = 0
+            self._fill = 0
+            # writers waiting for free space
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """
+        @brief Wakes up all readers. Remaining data can still be read.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {"fill": self._fill,
+                "capacity": self.capacity,
+                "high_water_mark": self.high_water_mark,
+                "overflow_count": self.overflow_count,
+                "overflow_bytes": self.overflow_bytes}
+
+    def _count_overflow(self, dropped: int) -> None:
+        self.overflow_count += 1
+        self.overflow_bytes += dropped
+
+
+class FedAudio:
+    """
+    @brief The most recent audio fed to a recognizer, addressed by its position in the stream of the recognizer.
+
+    Vosk counts the times of the words from the creation of the recognizer, Reset() does not rebase them.
+    So the positions count all audio fed so far and are never reset.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        @param capacity: Number of bytes of the most recent audio kept.
+        """
+        self.capacity = capacity
+        self.fed_bytes = 0
+        self._chunks: deque = deque()
+
+    def append(self, chunk: bytes) -> None:
+        self._chunks.append((self.fed_bytes, chunk))
+        self.fed_bytes += len(chunk)
+        while self.fed_bytes - self._chunks[0][0] > self.capacity:
+            self._chunks.popleft()
+
+    def take_after(self, position: int) -> bytes:
+        """
+        @brief Returns the audio kept after the given position and forgets all audio kept.
+
+        @param position: Byte position in the stream of the recognizer, e.g. the end of a word.
+        """
+        tail = b"".join(chunk[max(0, position - offset):] for offset, chunk in self._chunks
+                        if offset + len(chunk) > position)
+        self._chunks.clear()
+        return tail
+
+
+class CaptureThread(threading.Thread):
+    """
+    @brief Reads the PyAudio input stream continuously and feeds an AudioRingBuffer.
+
+    Keeps the PortAudio input drained while the recognition thread is busy decoding,
+    speaking or playing sounds.
+    """
+
+    def __init__(self, stream, buffer: AudioRingBuffer, chunk_size: int, lossless: bool = False,
+                 process: Optional[Callable[[bytes], bytes]] = None):
+        """
+        @param stream: PyAudio input stream (or any object providing read(frames, exception_on_overflow)).
+        @param buffer: Ring buffer receiving the captured audio.
+        @param chunk_size: Number of frames to read per call.
+        @param lossless: Wait for the reader if the buffer is full instead of dropping audio.
+        @param process: Optional processing stage applied to each chunk before buffering, e.g. resampling.
+        """
+        super().__init__(name="audio-capture", daemon=True)
+        self.stream = stream
+        self.buffer = buffer
+        self.chunk_size = chunk_size
+        self.lossless = lossless
+        self.process = process
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        logger.debug("Capture thread started")
+        try:
+            while not self._stop_event.is_set():
+                data = self.stream.read(self.chunk_size, False)
+                if not data:
+                    break
+                if self.process:
+                    data = self.process(data)
+                self.buffer.write(data, self.lossless)
+        except Exception as e:
+            logger.error("Capture thread failed: {}".format(e))
+        finally:
+            self.buffer.close()
+            logger.debug("Capture thread stopped, {}".format(self.buffer.stats()))
+
+    def stop(self) -> None:
+        self._stop_event.set()
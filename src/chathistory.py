@@ -0,0 +1,159 @@
+import math
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Tokens the chat format adds per message
+MESSAGE_OVERHEAD = 4
+
+
+def _create_token_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        return lambda text: len(encoding.encode(text))
+    except Exception:
+        # Without tiktoken, estimate conservatively: German text has roughly 3.5 characters per token
+        return lambda text: math.ceil(len(text) / 3.5)
+
+
+class ChatHistory:
+    """
+    @brief Conversation history limited to a token budget.
+
+    Tokens are counted once per message when it is added and kept as a running total, so checking
+    the budget costs nothing per request. If the budget is exceeded, the oldest messages are evicted.
+    Optionally, evicted messages are condensed into a summary on a background thread, which is sent
+    in front of the remaining history.
+    """
+
+    def __init__(self, max_tokens: int = 1500, summarize: Optional[Callable[[str, List[Dict]], str]] = None,
+                 count_tokens: Optional[Callable[[str], int]] = None):
+        """
+        @param max_tokens: Token budget of the history including the summary.
+        @param summarize: Optional callable condensing the previous summary and the evicted messages to a new summary.
+        @param count_tokens: Callable returning the number of tokens of a text, tiktoken or an estimate if not given.
+        """
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self.count_tokens = count_tokens or _create_token_counter()
+
+        self._messages: deque = deque()
+        self._tokens = 0
+        self._summary = ""
+        self._summary_tokens = 0
+        self._lock = threading.Lock()
+        self._summarizing = False
+        # evicted messages waiting for the summary, and the generation of the history, counting the clears
+        self._pending: List[Dict] = []
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self):
+        return (message for message, _ in list(self._messages))
+
+    def __getitem__(self, index: int) -> Dict:
+        return self._messages[index][0]
+
+    @property
+    def tokens(self) -> int:
+        return self._tokens + self._summary_tokens
+
+    @property
+    def summary(self) -> str:
+        return self._summary
+
+    def append(self, message: Dict) -> None:
+        """
+        @brief Adds a message and evicts the oldest ones if the token budget is exceeded.
+
+        @param message: Chat message with role and content.
+        """
+        tokens = self.count_tokens(str(message["content"])) + MESSAGE_OVERHEAD
+        with self._lock:
+            self._messages.append((message, tokens))
+            self._tokens += tokens
+            evicted = self._evict()
+
+        if evicted:
+            logger.debug("Evicted {} messages from the history, {} tokens left".format(len(evicted), self.tokens))
+            if self.summarize:
+                self._queue_summary(evicted)
+
+    def messages(self) -> List[Dict]:
+        """
+        @brief The messages to send, the summary of evicted messages first.
+        """
+        with self._lock:
+            messages = [message for message, _ in self._messages]
+            if self._summary:
+                messages.insert(0, {"role": "system",
+                                    "content": "Bisheriger Gesprächsverlauf: {}".format(self._summary)})
+            return messages
+
+    def clear(self) -> None:
+        with self._lock:
+            # a summary still running belongs to the previous conversation
+            self._generation += 1
+            self._pending.clear()
+            self._messages.clear()
+            self._tokens = 0
+            self._summary = ""
+            self._summary_tokens = 0
+
+    def _evict(self) -> List[Dict]:
+        evicted = []
+        # always keep the latest message
+        while len(self._messages) > 1 and self.tokens > self.max_tokens:
+            message, tokens = self._messages.popleft()
+            self._tokens -= tokens
+            evicted.append(message)
+
+        # do not start the history with an answer
+        while len(self._messages) > 1 and self._messages[0][0]["role"] == "assistant":
+            message, tokens = self._messages.popleft()
+            self._tokens -= tokens
+            evicted.append(message)
+
+        return evicted
+
+    def _queue_summary(self, evicted: List[Dict]) -> None:
+        with self._lock:
+            self._pending += evicted
+            if self._summarizing:
+                # summarized as soon as the running summary is done
+                return
+            self._summarizing = True
+        threading.Thread(target=self._summarize_pending, name="history-summary", daemon=True).start()
+
+    def _summarize_pending(self) -> None:
+        while True:
+            with self._lock:
+                evicted, self._pending = self._pending, []
+                if not evicted:
+                    self._summarizing = False
+                    return
+                previous = self._summary
+                generation = self._generation
+
+            try:
+                summary = self.summarize(previous, evicted)
+            except Exception as e:
+                logger.error("Summarizing the history failed: {}".format(e))
+                with self._lock:
+                    self._summarizing = False
+                return
+
+            with self._lock:
+                if generation != self._generation:
+                    logger.debug("Discarding the summary of a cleared history")
+                    continue
+                self._summary = summary
+                self._summary_tokens = self.count_tokens(summary) + MESSAGE_OVERHEAD
+                self._pending += self._evict()
+            logger.debug("History summary: {}".format(summary))
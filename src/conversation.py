@@ -0,0 +1,495 @@
+import json
+import time
+import enum
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from endpointer import Endpointer
+from metrics import Metrics
+from recorder import SessionRecorder
+from leds import Animation, direction, pulse, solid, spinner
+from ttspipeline import Segment
+from vad import EnergyVad
+
+logger = logging.getLogger(__name__)
+
+
+class State(enum.Enum):
+    IDLE = "idle"
+    LISTENING = "listening"
+    THINKING = "thinking"
+    SPEAKING = "speaking"
+    STOPPED = "stopped"
+
+
+# LED color per state, None switches the LEDs off
+STATE_COLORS = {State.IDLE: None,
+                State.LISTENING: (1, 1, 0),
+                State.THINKING: (1, 0, 0),
+                State.SPEAKING: (0, 0, 1),
+                State.STOPPED: None}
+
+
+class Turn:
+    """
+    @brief A question of the user and the reply spoken for it.
+    """
+
+    def __init__(self, text: str, final_time: float):
+        self.text = text
+        # time.time() of the final recognizer result, the reference for the turn latency
+        self.final_time = final_time
+        self.cached = None
+        self.cancelled = False
+        self.segments: List[Segment] = []
+
+    @property
+    def latency(self) -> Optional[float]:
+        """
+        @brief Seconds from the final recognizer result to the start of the playback of the reply.
+        """
+        if not self.segments or not self.segments[0].play_delay:
+            return None
+        first = self.segments[0]
+        return first.queued_at + first.play_delay - self.final_time
+
+
+class Conversation:
+    """
+    @brief The conversation loop of the chatbot as an asyncio state machine.
+
+    Capture, recognition, the AI request and speech output run as separate tasks connected by bounded
+    queues. Blocking calls run in executors, the recognizers on a single dedicated thread. The LEDs are
+    animated by their own thread, state changes only switch the animation.
+    While the reply is being generated or spoken, the wake word recognizer keeps listening: the
+    trigger phrase interrupts the reply (barge-in). The quit phrase is ignored while the reply is
+    spoken, as the reply itself may contain it; while it is generated, the quit phrase cancels it.
+
+    The components are taken from the phases of a Startup, so listening can begin before the
+    deferred phases are done.
+    """
+
+    def __init__(self, startup, trigger_phrase: str, quit_phrase: str, leds=None,
+                 sounds: Optional[Dict[str, str]] = None, stream_reply: bool = True, listen_timeout: float = 15.0,
+                 barge_in_vad: bool = False, barge_in_time: float = 0.4, queue_size: int = 32,
+                 metrics: Optional[Metrics] = None, endpointer: Optional[Endpointer] = None,
+                 recorder: Optional[SessionRecorder] = None):
+        """
+        @param startup: Startup providing the phases stt_handler, wake_recognizer, recognizer, audio_out,
+                        tts (the TtsPipeline and its optional player) and ask_ai.
+        @param trigger_phrase: Phrase starting the conversation and interrupting a reply.
+        @param quit_phrase: Phrase ending the program.
+        @param leds: Optional LedAnimator showing the state.
+        @param sounds: Sound files played on state changes, keys "waiting", "trigger" and "quit".
+        @param stream_reply: Speak the reply sentence by sentence while it is generated.
+        @param listen_timeout: Seconds without speech after which the conversation ends, unless an
+                               endpointer is given.
+        @param barge_in_vad: Also interrupt the reply if speech is detected while speaking. Without echo
+                             cancellation, this needs the speaker to be far from the microphone.
+        @param barge_in_time: Seconds of continuous speech needed for a VAD barge-in.
+        @param queue_size: Number of audio chunks queued between capture and recognition.
+        @param metrics: Metrics receiving the turn traces, the shared ones if not given.
+        @param endpointer: Endpointing of the questions, by default after 0.6s of trailing silence.
+        @param recorder: Optional recorder of the session, receiving the events of the pipeline.
+        """
+        self.startup = startup
+        self.trigger_phrase = trigger_phrase
+        self.quit_phrase = quit_phrase
+        self.leds = leds
+        self.sounds = sounds or {}
+        self.stream_reply = stream_reply
+        self.listen_timeout = listen_timeout
+        self.barge_in_vad = barge_in_vad
+        self.barge_in_time = barge_in_time
+        self.queue_size = queue_size
+        self.metrics = metrics or Metrics.shared()
+        self.endpointer = endpointer
+        self.recorder = recorder
+
+        self.state = State.IDLE
+        self.interruptions = 0
+        self.turns: deque = deque(maxlen=50)
+
+        self._components: Dict[str, object] = {}
+        self._recognition = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recognition")
+        self._io = ThreadPoolExecutor(max_workers=4, thread_name_prefix="conversation")
+        self._turn: Optional[Turn] = None
+        self._reply_task: Optional[asyncio.Task] = None
+
+        # owned by the recognition thread, requested by the state machine
+        self._dictating = False
+        self._reset_pending = False
+        self._partial = ""
+
+    async def run(self) -> None:
+        """
+        @brief Runs the conversation until the quit phrase is spoken or the audio stream ends.
+        """
+        self._audio: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._events: asyncio.Queue = asyncio.Queue()
+        self._sentences: asyncio.Queue = asyncio.Queue(8)
+
+        self.stt = await self._get("stt_handler")
+        self.wake_recognizer = await self._get("wake_recognizer")
+        self.audio_out = await self._get("audio_out")
+        if self.endpointer is None:
+            self.endpointer = Endpointer(self.stt.sample_rate, no_speech_timeout=self.listen_timeout,
+                                         metrics=self.metrics)
+
+        tasks = [asyncio.create_task(self._capture(), name="capture"),
+                 asyncio.create_task(self._recognize(), name="recognize"),
+                 asyncio.create_task(self._speak(), name="speak")]
+        for task in tasks:
+            task.add_done_callback(self._task_done)
+        self._play_sound("waiting")
+        self._set_state(State.IDLE)
+        logger.info("Entering loop...")
+
+        try:
+            await self._control()
+        finally:
+            await self._interrupt()
+            self._set_state(State.STOPPED)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info("End.")
+            if "quit" in self.sounds:
+                await self._run(self._io, self.audio_out.play_file, self.sounds["quit"], True)
+            self._recognition.shutdown(wait=False)
+            self._io.shutdown(wait=False)
+
+    async def _control(self) -> None:
+        """
+        @brief The state machine, processing the events of the other tasks.
+        """
+        while True:
+            event, value = await self._events.get()
+            logger.debug("Event {} {} in state {}".format(event, value, self.state.value))
+
+            if event in ("eof", "failed"):
+                return
+
+            if event == "wake":
+                if value == self.quit_phrase and self.state == State.SPEAKING:
+                    # without echo cancellation, the phrase may be part of the reply being spoken
+                    logger.debug("Ignoring the quit phrase while {}".format(self.state.value))
+                    continue
+                self.metrics.inc("wake_words")
+                if value == self.quit_phrase:
+                    return
+                await self._interrupt()
+                # the recognition thread is dictating already, with the audio following the wake word
+                self._set_state(State.LISTENING)
+                self._play_sound("trigger")
+                logger.info("Trigger detected. Listening...")
+
+            elif event == "barge_in":
+                await self._interrupt()
+                self._set_state(State.LISTENING)
+                self._listen()
+
+            elif event == "utterance" and self.state == State.LISTENING:
+                text, final_time, speech_end = value
+                logger.info(f"> {text}")
+                if self.quit_phrase.lower() in text.lower():
+                    return
+                if text.count(" ") > 2:
+                    self._spot()
+                    self._set_state(State.THINKING)
+                    self._turn = Turn(text, final_time)
+                    self.metrics.begin_turn(text)
+                    self.metrics.mark("speech_end", speech_end)
+                    self.metrics.mark("final_result", final_time)
+                    self._reply_task = asyncio.create_task(self._reply(self._turn), name="reply")
+
+            elif event == "spoken" and value is self._turn:
+                self._log_turn(value)
+                self._turn = None
+                self._set_state(State.LISTENING)
+                self._listen()
+
+            elif event == "timeout" and self.state == State.LISTENING:
+                self.metrics.inc("listen_timeouts")
+                ask_ai = await self._get("ask_ai")
+                ask_ai.reset_chat()
+                self._set_state(State.IDLE)
+                self._play_sound("waiting")
+                if ask_ai.cache:
+                    logger.info("Response cache: {}".format(ask_ai.cache.stats()))
+                    await self._run(self._io, ask_ai.cache.save)
+
+    async def _interrupt(self) -> None:
+        """
+        @brief Cancels the reply currently generated or spoken.
+        """
+        if self._turn is None:
+            return
+
+        logger.info("Interrupting the reply to '{}'".format(self._turn.text))
+        self._record("tts_stop", "interrupted")
+        self.interruptions += 1
+        self.metrics.inc("interruptions")
+        self.metrics.end_turn("interrupted")
+        self._turn.cancelled = True
+        self._turn = None
+        if self._reply_task:
+            self._reply_task.cancel()
+            self._reply_task = None
+        while not self._sentences.empty():
+            self._sentences.get_nowait()
+
+        if "tts" in self._components:
+            tts, player = self._components["tts"]
+            tts.cancel()
+            if player:
+                player.finish()
+        self.audio_out.stop()
+
+    async def _capture(self) -> None:
+        while True:
+            data = await self._run(self._io, self.stt.read_captured, 0.5)
+            if data is None:
+                await self._audio.put(None)
+                return
+            if data:
+                await self._audio.put(data)
+
+    async def _recognize(self) -> None:
+        vad = EnergyVad(self.stt.sample_rate) if self.barge_in_vad else None
+        speech_time = 0.0
+
+        while True:
+            data = await self._audio.get()
+            if data is None:
+                await self._events.put(("eof", None))
+                return
+
+            step = self._dictation_step if self._dictating else self._wake_step
+            for event in await self._run(self._recognition, step, data):
+                await self._events.put(event)
+
+            if vad and self.state == State.SPEAKING:
+                if vad.is_speech(data):
+                    speech_time += len(data) / self.stt.sample_width / self.stt.sample_rate
+                else:
+                    speech_time = 0.0
+                if speech_time >= self.barge_in_time:
+                    speech_time = 0.0
+                    await self._events.put(("barge_in", None))
+
+    def _wake_step(self, data: bytes) -> List[Tuple[str, object]]:
+        phrase = self.stt.spot_wake_word(self.wake_recognizer, data, [self.trigger_phrase, self.quit_phrase])
+        if phrase is None:
+            return []
+
+        self._record("wake", phrase)
+        events = [("wake", phrase)]
+        if phrase == self.trigger_phrase:
+            self._listen()
+            for chunk in self.stt.take_replay():
+                events += self._dictation_step(chunk)
+        return events
+
+    def _dictation_step(self, data: bytes) -> List[Tuple[str, object]]:
+        recognizer = self.startup.result("recognizer")
+        if self._reset_pending:
+            self._reset_pending = False
+            recognizer.Reset()
+            self.endpointer.start()
+            self._partial = ""
+
+        event = self.endpointer.process(data)
+        if recognizer.AcceptWaveform(data):
+            text = json.loads(recognizer.Result())["text"]
+            if text:
+                return [self._utterance(text, early=False)]
+        elif event == Endpointer.ENDPOINT:
+            # the trailing silence ends the question before the recognizer would
+            text = json.loads(recognizer.FinalResult())["text"]
+            if text:
+                return [self._utterance(text, early=True)]
+            self.endpointer.discard()
+        elif self.recorder:
+            self._record_partial(recognizer)
+
+        if event == Endpointer.TIMEOUT:
+            self._spot()
+            self._record("timeout")
+            return [("timeout", None)]
+        return []
+
+    def _record_partial(self, recognizer) -> None:
+        partial = json.loads(recognizer.PartialResult())["partial"]
+        if partial and partial != self._partial:
+            self._record("partial", partial)
+        self._partial = partial
+
+    def _utterance(self, text: str, early: bool) -> Tuple[str, object]:
+        now = time.time()
+        speech_end = self.endpointer.speech_end_time or now
+        self.endpointer.end_utterance(early)
+        self._record("final", {"text": text, "early": early})
+        self._partial = ""
+        return "utterance", (text, now, speech_end)
+
+    def _listen(self) -> None:
+        """
+        @brief Lets the recognition thread transcribe with the full recognizer.
+        """
+        self._reset_pending = True
+        self._dictating = True
+
+    def _spot(self) -> None:
+        """
+        @brief Lets the recognition thread listen for the wake word only.
+        """
+        self._dictating = False
+        if self.stt.vad:
+            self.stt.vad.reset()
+
+    async def _reply(self, turn: Turn) -> None:
+        """
+        @brief Asks the AI and passes the reply sentence by sentence to the speak task.
+        """
+        ask_ai = await self._get("ask_ai")
+        await self._get("tts")
+        loop = asyncio.get_running_loop()
+
+        self.metrics.mark("llm_request")
+        self._record("llm_request", turn.text)
+        turn.cached = ask_ai.cached_reply(turn.text)
+        if turn.cached:
+            self.metrics.inc("cached_replies")
+            self.metrics.mark("llm_done")
+            logger.info("< (cached) {}".format(turn.cached.answer.replace("\n", "")))
+            self._record("llm_response", {"text": turn.cached.answer, "cached": True})
+            for item in turn.cached.segments() if turn.cached.audio else [turn.cached.answer]:
+                await self._sentences.put((turn, item))
+            await self._sentences.put((turn, None))
+            return
+
+        def ask():
+            yield ask_ai.ask_ai(turn.text)
+
+        def generate():
+            reply = ask_ai.ask_ai_stream(turn.text) if self.stream_reply else ask()
+            try:
+                for sentence in reply:
+                    if turn.cancelled:
+                        break
+                    self.metrics.mark("llm_first_sentence")
+                    logger.info("< {}".format(sentence.replace("\n", "")))
+                    self._record("llm_response", {"text": sentence, "cached": False})
+                    put = asyncio.run_coroutine_threadsafe(self._sentences.put((turn, sentence)), loop)
+                    while not turn.cancelled:
+                        try:
+                            put.result(0.5)
+                            break
+                        except TimeoutError:
+                            pass
+                    if turn.cancelled:
+                        put.cancel()
+                        break
+            finally:
+                reply.close()
+            self.metrics.mark("llm_done")
+
+        try:
+            await self._run(self._io, generate)
+        except asyncio.CancelledError:
+            turn.cancelled = True
+            raise
+        await self._sentences.put((turn, None))
+
+    async def _speak(self) -> None:
+        """
+        @brief Passes the sentences of the replies to the TtsPipeline, reports when a reply has been spoken.
+        """
+        while True:
+            turn, item = await self._sentences.get()
+            if turn.cancelled:
+                continue
+            tts, player = self._components["tts"]
+
+            if item is None:
+                await self._run(self._io, tts.wait)
+                if turn.cancelled:
+                    continue
+                if player:
+                    player.finish()
+                self._record("tts_stop", "spoken")
+                ask_ai = self._components["ask_ai"]
+                if ask_ai.cache and not (turn.cached and turn.cached.audio):
+                    ask_ai.cache.set_audio(turn.text, turn.segments)
+                await self._events.put(("spoken", turn))
+                continue
+
+            turn.segments.append(tts.play(item) if isinstance(item, Segment) else tts.say(item))
+            self._record("tts_start", turn.segments[-1].text)
+            if self.state == State.THINKING:
+                self._set_state(State.SPEAKING)
+
+    def _animation(self, state: State) -> Optional[Animation]:
+        color = STATE_COLORS[state]
+        if color is None:
+            return None
+        if state == State.LISTENING:
+            if self.stt.beamformer:
+                return direction(color, lambda: self.stt.beamformer.doa)
+            return solid(color)
+        if state == State.THINKING:
+            return spinner(color)
+        return pulse(color)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            logger.error("Task {} failed: {!r}".format(task.get_name(), task.exception()))
+            self._events.put_nowait(("failed", task.get_name()))
+
+    def _set_state(self, state: State) -> None:
+        if state != self.state:
+            logger.debug("State {} -> {}".format(self.state.value, state.value))
+            self._record("state", state.value)
+        self.state = state
+        if self.leds:
+            self.leds.play(self._animation(state))
+
+    def _record(self, name: str, value=None) -> None:
+        if self.recorder:
+            self.recorder.event(name, value)
+
+    def _play_sound(self, name: str) -> None:
+        if name in self.sounds:
+            self.audio_out.play_file(self.sounds[name])
+
+    def _log_turn(self, turn: Turn) -> None:
+        self.turns.append(turn)
+        if turn.segments:
+            first, last = turn.segments[0], turn.segments[-1]
+            self.metrics.mark("tts_synth_start", first.synth_started)
+            self.metrics.mark("tts_synth_end", first.synth_started + first.synth_time)
+            self.metrics.mark("playback_start", first.queued_at + first.play_delay)
+            self.metrics.mark("playback_end", last.queued_at + last.play_delay + last.play_time)
+        for segment in turn.segments:
+            self.metrics.observe("tts_synthesis_seconds", segment.synth_time)
+        self.metrics.end_turn()
+        latency = turn.latency
+        logger.info("Turn latency {}s for '{}'".format(round(latency, 3) if latency is not None else None,
+                                                       turn.text))
+        logger.debug("TTS timings: {}".format([segment.timings() for segment in turn.segments]))
+
+    async def _get(self, name: str):
+        """
+        @brief The result of a startup phase, waiting for it without blocking the event loop.
+        """
+        if name not in self._components:
+            self._components[name] = await self._run(self._io, self.startup.result, name)
+        return self._components[name]
+
+    @staticmethod
+    async def _run(executor, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
@@ -0,0 +1,194 @@
+import time
+import asyncio
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+import xml.etree.ElementTree as ET
+
+import requests
+
+from dlnahelper import DlnaHelper, AV_TRANSPORT, RENDERING_CONTROL
+
+logger = logging.getLogger(__name__)
+
+SSDP_ADDRESS = ("239.255.255.250", 1900)
+MEDIA_RENDERER = "urn:schemas-upnp-org:device:MediaRenderer:1"
+DEVICE_NS = {"d": "urn:schemas-upnp-org:device-1-0"}
+
+Renderer = namedtuple("Renderer", ["usn", "name", "host", "port", "av_transport_path", "rendering_control_path"])
+
+
+class _SsdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.responses: Dict[str, Dict[str, str]] = {}
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        lines = data.decode("utf-8", errors="replace").split("\r\n")
+        if not lines[0].startswith("HTTP/1.1 200"):
+            return
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(":")
+            if value:
+                headers[key.strip().upper()] = value.strip()
+        if "LOCATION" in headers:
+            self.responses[headers.get("USN", headers["LOCATION"])] = headers
+
+
+def parse_description(location: str, xml: str) -> Optional[Renderer]:
+    """
+    @brief Extracts name and control URLs of a media renderer from its UPnP device description.
+
+    @param location: URL the description was loaded from, control URLs are relative to it.
+    @param xml: The device description.
+
+    @return The renderer, or None if it lacks the AVTransport or RenderingControl service.
+    """
+    root = ET.fromstring(xml)
+    base = root.findtext("d:URLBase", default=location, namespaces=DEVICE_NS)
+    controls = {}
+    for service in root.iter("{urn:schemas-upnp-org:device-1-0}service"):
+        service_type = service.findtext("d:serviceType", default="", namespaces=DEVICE_NS)
+        control_url = service.findtext("d:controlURL", default="", namespaces=DEVICE_NS)
+        for known in (AV_TRANSPORT, RENDERING_CONTROL):
+            if service_type == known and known not in controls:
+                controls[known] = urlparse(urljoin(base, control_url)).path
+
+    if len(controls) < 2:
+        return None
+
+    url = urlparse(location)
+    name = root.findtext(".//d:friendlyName", default=url.hostname, namespaces=DEVICE_NS)
+    udn = root.findtext(".//d:UDN", default=location, namespaces=DEVICE_NS)
+    return Renderer(udn, name, url.hostname, url.port or 80, controls[AV_TRANSPORT], controls[RENDERING_CONTROL])
+
+
+class DlnaController:
+    """
+    @brief Discovers DLNA media renderers via SSDP and plays audio on many of them in parallel.
+
+    Discovered renderers are cached with a TTL. Commands are fanned out with bounded concurrency and a
+    timeout per device, reusing one pooled DlnaHelper per renderer.
+    """
+
+    def __init__(self, volume: int = 25, ttl: float = 1800.0, max_concurrency: int = 8, timeout: float = 3.0,
+                 ssdp_address: Tuple[str, int] = SSDP_ADDRESS):
+        """
+        @param volume: Volume level (0 to 100) set when playing.
+        @param ttl: Seconds a discovered renderer is cached, unless the device announces a shorter max-age.
+        @param max_concurrency: Maximum number of devices addressed at the same time.
+        @param timeout: Timeout per device in seconds.
+        @param ssdp_address: Address M-SEARCH requests are sent to.
+        """
+        self.volume = volume
+        self.ttl = ttl
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.ssdp_address = ssdp_address
+
+        self._cache: Dict[str, Tuple[Renderer, float]] = {}
+        self._helpers: Dict[str, DlnaHelper] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="dlna-fanout")
+
+    def close(self) -> None:
+        for helper in self._helpers.values():
+            helper.close()
+        self._helpers.clear()
+        self._executor.shutdown(wait=False)
+
+    def cached(self) -> List[Renderer]:
+        now = time.monotonic()
+        return [renderer for renderer, expires in self._cache.values() if expires > now]
+
+    async def discover(self, wait: float = 2.0, force: bool = False) -> List[Renderer]:
+        """
+        @brief Returns the media renderers in the network, from the cache if it is still valid.
+
+        @param wait: Seconds to wait for SSDP responses.
+        @param force: Ignore the cache.
+
+        @return The discovered renderers.
+        """
+        renderers = self.cached()
+        if renderers and not force:
+            return renderers
+
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(_SsdpProtocol, local_addr=("0.0.0.0", 0))
+        try:
+            request = "\r\n".join(["M-SEARCH * HTTP/1.1",
+                                   "HOST: {}:{}".format(*SSDP_ADDRESS),
+                                   'MAN: "ssdp:discover"',
+                                   "MX: {}".format(max(1, int(wait))),
+                                   "ST: {}".format(MEDIA_RENDERER),
+                                   "", ""]).encode()
+            transport.sendto(request, self.ssdp_address)
+            await asyncio.sleep(wait)
+        finally:
+            transport.close()
+
+        start = time.monotonic()
+        results = await asyncio.gather(*(self._describe(headers) for headers in protocol.responses.values()),
+                                       return_exceptions=True)
+        for headers, renderer in zip(protocol.responses.values(), results):
+            if isinstance(renderer, Exception) or renderer is None:
+                logger.warning("Ignoring device at {}: {}".format(headers["LOCATION"], renderer))
+                continue
+            self._cache[renderer.usn] = (renderer, start + self._max_age(headers))
+
+        renderers = self.cached()
+        logger.debug("Discovered {}".format(renderers))
+        return renderers
+
+    def _max_age(self, headers: Dict[str, str]) -> float:
+        for directive in headers.get("CACHE-CONTROL", "").split(","):
+            key, _, value = directive.partition("=")
+            if key.strip().lower() == "max-age" and value.strip().isdigit():
+                return min(self.ttl, float(value))
+        return self.ttl
+
+    async def _describe(self, headers: Dict[str, str]) -> Optional[Renderer]:
+        location = headers["LOCATION"]
+        loop = asyncio.get_running_loop()
+        response = await asyncio.wait_for(
+            loop.run_in_executor(self._executor, lambda: requests.get(location, timeout=self.timeout)),
+            self.timeout)
+        response.raise_for_status()
+        return parse_description(location, response.text)
+
+    def _helper(self, renderer: Renderer) -> DlnaHelper:
+        helper = self._helpers.get(renderer.usn)
+        if helper is None:
+            helper = DlnaHelper(renderer.host, self.volume, renderer.port, self.timeout,
+                                renderer.av_transport_path, renderer.rendering_control_path)
+            self._helpers[renderer.usn] = helper
+        return helper
+
+    async def play_uri(self, url: str, renderers: Optional[List[Renderer]] = None,
+                       volume: Optional[int] = None) -> Dict[Renderer, object]:
+        """
+        @brief Plays the URL on all given renderers at the same time.
+
+        @param url: URL of the audio to be played.
+        @param renderers: Target renderers, all discovered ones if not given.
+        @param volume: Volume level, the default volume of the controller if not given.
+
+        @return Per renderer the list of ActionResults, or the exception if the device failed.
+        """
+        if renderers is None:
+            renderers = await self.discover()
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+
+        async def play(renderer: Renderer):
+            helper = self._helper(renderer)
+            async with semaphore:
+                # SetAVTransportURI/SetVolume and Play are two round trips, each bounded by the timeout
+                return await asyncio.wait_for(loop.run_in_executor(self._executor, helper.play_uri, url, volume),
+                                              2 * self.timeout)
+
+        results = await asyncio.gather(*(play(renderer) for renderer in renderers), return_exceptions=True)
+        return dict(zip(renderers, results))
@@ -1,80 +1,141 @@
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+from typing import List
+from xml.sax.saxutils import escape
+
 import requests
-import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Result of a single SOAP action, latency in seconds
+ActionResult = namedtuple("ActionResult", ["action", "status", "latency", "ok"])
+
+AV_TRANSPORT = "urn:schemas-upnp-org:service:AVTransport:1"
+RENDERING_CONTROL = "urn:schemas-upnp-org:service:RenderingControl:1"
+
+SOAP_ENVELOPE = """<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
+    <s:Body>
+        {body}
+    </s:Body>
+</s:Envelope>"""
+
+# SOAP request to set the volume
+SET_VOLUME_SOAP_REQUEST = Template(SOAP_ENVELOPE.format(body=f"""<u:SetVolume xmlns:u="{RENDERING_CONTROL}">
+            <InstanceID>0</InstanceID>
+            <Channel>Master</Channel>
+            <DesiredVolume>$volume</DesiredVolume>
+        </u:SetVolume>"""))
+
+# SOAP request to tell the Sonos to play the audio file
+SET_URI_SOAP_REQUEST = Template(SOAP_ENVELOPE.format(body=f"""<u:SetAVTransportURI xmlns:u="{AV_TRANSPORT}">
+            <InstanceID>0</InstanceID>
+            <CurrentURI>$uri</CurrentURI>
+            <CurrentURIMetaData></CurrentURIMetaData>
+        </u:SetAVTransportURI>"""))
+
+# SOAP request to tell the Sonos to start playing
+PLAY_SOAP_REQUEST = SOAP_ENVELOPE.format(body=f"""<u:Play xmlns:u="{AV_TRANSPORT}">
+            <InstanceID>0</InstanceID>
+            <Speed>1</Speed>
+        </u:Play>""")
 
 
 class DlnaHelper:
+    """
+    @brief Controls a single DLNA/UPnP media renderer like a Sonos speaker.
+
+    Keeps a pooled keep-alive HTTP session to the speaker and sends independent actions concurrently.
+    """
+    AV_TRANSPORT_PATH = "/MediaRenderer/AVTransport/Control"
+    RENDERING_CONTROL_PATH = "/MediaRenderer/RenderingControl/Control"
 
-    def __init__(self, ip: str, vol=25):
+    def __init__(self, ip: str, vol=25, port: int = 1400, timeout: float = 5.0,
+                 av_transport_path: str = AV_TRANSPORT_PATH, rendering_control_path: str = RENDERING_CONTROL_PATH):
+        """
+        @param ip: IP address of the speaker.
+        @param vol: Desired volume level (0 to 100).
+        @param port: Port of the UPnP control interface.
+        @param timeout: Timeout of a single action in seconds.
+        @param av_transport_path: Control URL path of the AVTransport service, as announced by the device.
+        @param rendering_control_path: Control URL path of the RenderingControl service.
+        """
         self.sonos_ip = ip
+        self.port = port
+        self.timeout = timeout
+        self.av_transport_path = av_transport_path
+        self.rendering_control_path = rendering_control_path
 
         # Desired volume level (0 to 100)
         self.volume_level = vol
 
-    def play_uri(self, url: str):
-        # SOAP request to set the volume
-        set_volume_soap_request = f"""<?xml version="1.0" encoding="utf-8"?>
-        <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
-            <s:Body>
-                <u:SetVolume xmlns:u="urn:schemas-upnp-org:service:RenderingControl:1">
-                    <InstanceID>0</InstanceID>
-                    <Channel>Master</Channel>
-                    <DesiredVolume>{self.volume_level}</DesiredVolume>
-                </u:SetVolume>
-            </s:Body>
-        </s:Envelope>"""
-
-        # SOAP request to tell the Sonos to play the audio file
-        set_uri_soap_request = f"""<?xml version="1.0" encoding="utf-8"?>
-        <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
-            <s:Body>
-                <u:SetAVTransportURI xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">
-                    <InstanceID>0</InstanceID>
-                    <CurrentURI>{url}</CurrentURI>
-                    <CurrentURIMetaData></CurrentURIMetaData>
-                </u:SetAVTransportURI>
-            </s:Body>
-        </s:Envelope>"""
-
-        # SOAP request to tell the Sonos to start playing
-        play_soap_request = """<?xml version="1.0" encoding="utf-8"?>
-        <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
-            <s:Body>
-                <u:Play xmlns:u="urn:schemas-upnp-org:service:AVTransport:1">
-                    <InstanceID>0</InstanceID>
-                    <Speed>1</Speed>
-                </u:Play>
-            </s:Body>
-        </s:Envelope>"""
-
-        # Send the SOAP request to the Sonos speaker
-        # Headers for sending the SOAP requests
-        headers = {
-            'Content-Type': 'text/xml',
-        }
-
-        # Send the SOAP request to set the AVTransportURI
-        set_uri_response = requests.post(
-            f'http://{self.sonos_ip}:1400/MediaRenderer/AVTransport/Control',
-            headers={**headers, 'SOAPACTION': '"urn:schemas-upnp-org:service:AVTransport:1#SetAVTransportURI"'},
-            data=set_uri_soap_request
-        )
-
-        # Send the SOAP request to set the volume
-        set_volume_response = requests.post(
-            f'http://{self.sonos_ip}:1400/MediaRenderer/RenderingControl/Control',
-            headers={**headers, 'SOAPACTION': '"urn:schemas-upnp-org:service:RenderingControl:1#SetVolume"'},
-            data=set_volume_soap_request
-        )
-
-        # Send the SOAP request to start the playback
-        play_response = requests.post(
-            f'http://{self.sonos_ip}:1400/MediaRenderer/AVTransport/Control',
-            headers={**headers, 'SOAPACTION': '"urn:schemas-upnp-org:service:AVTransport:1#Play"'},
-            data=play_soap_request
-        )
-
-        # Check if the request was successful
-        if play_response.status_code == 200:
-            print('Audio is playing on the Sonos speaker')
+        self.base_url = f"http://{ip}:{port}"
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.headers.update({'Content-Type': 'text/xml; charset="utf-8"'})
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="dlna")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def _post(self, path: str, service: str, action: str, body: str) -> ActionResult:
+        start = time.perf_counter()
+        try:
+            response = self.session.post(self.base_url + path,
+                                         headers={'SOAPACTION': f'"{service}#{action}"'},
+                                         data=body.encode("utf-8"),
+                                         timeout=self.timeout)
+            status = response.status_code
+        except requests.RequestException as e:
+            logger.error(f"{action} on {self.sonos_ip} failed: {e}")
+            status = 0
+
+        result = ActionResult(action, status, time.perf_counter() - start, status == 200)
+        logger.debug(result)
+        return result
+
+    def set_volume(self, vol=None) -> ActionResult:
+        if vol is not None:
+            self.volume_level = vol
+        return self._send_volume(self.volume_level)
+
+    def _send_volume(self, vol) -> ActionResult:
+        return self._post(self.rendering_control_path, RENDERING_CONTROL, "SetVolume",
+                          SET_VOLUME_SOAP_REQUEST.substitute(volume=int(vol)))
+
+    def set_uri(self, url: str) -> ActionResult:
+        return self._post(self.av_transport_path, AV_TRANSPORT, "SetAVTransportURI",
+                          SET_URI_SOAP_REQUEST.substitute(uri=escape(url)))
+
+    def play(self) -> ActionResult:
+        return self._post(self.av_transport_path, AV_TRANSPORT, "Play", PLAY_SOAP_REQUEST)
+
+    def play_uri(self, url: str, volume=None) -> List[ActionResult]:
+        """
+        @brief Plays the given URL on the speaker with the configured volume.
+
+        SetAVTransportURI and SetVolume are sent concurrently, Play after the URI has been set.
+
+        @param url: URL of the audio to be played.
+        @param volume: Volume level (0 to 100) of this call only, the configured volume if not given.
+
+        @return The results of the actions sent.
+        """
+        set_uri = self._executor.submit(self.set_uri, url)
+        set_volume = self._executor.submit(self._send_volume, self.volume_level if volume is None else volume)
+        results = [set_uri.result(), set_volume.result()]
+
+        if results[0].ok:
+            results.append(self.play())
+
+        if all(result.ok for result in results) and len(results) == 3:
+            logger.info(f"Audio is playing on {self.sonos_ip}")
         else:
-            print('Failed to play audio on the Sonos speaker')
+            logger.warning(f"Failed to play audio on {self.sonos_ip}: {results}")
+
+        return results
@@ -0,0 +1,183 @@
+import time
+import logging
+from collections import deque
+from typing import Optional
+
+from metrics import Metrics
+from vad import EnergyVad
+
+logger = logging.getLogger(__name__)
+
+
+class Endpointer:
+    """
+    @brief Decides when an utterance has ended and when to give up waiting for one.
+
+    The end of an utterance is detected from the trailing silence after speech, so the caller can
+    take the FinalResult early instead of waiting for the endpointing of the recognizer. The time
+    waited for speech to begin adapts to how quickly the user has started speaking in previous turns.
+    To measure the time saved, every few utterances are left to the recognizer to end, which gives
+    the silence it needs.
+
+    All durations are measured in audio time, so recorded audio processed faster than real time is
+    endpointed like live audio.
+    """
+    ENDPOINT = "endpoint"
+    TIMEOUT = "timeout"
+
+    def __init__(self, sample_rate: int, trailing_silence: float = 0.6, min_speech: float = 0.2,
+                 no_speech_timeout: float = 15.0, min_no_speech_timeout: float = 5.0, adaptive: bool = True,
+                 recognizer_delay: float = 1.0, max_utterance: float = 30.0, calibrate_every: int = 10,
+                 max_recognizer_delay: float = 3.0, metrics: Optional[Metrics] = None, **kwargs):
+        """
+        @param sample_rate: Sample rate of the 16 bit mono PCM data.
+        @param trailing_silence: Seconds of silence after speech ending the utterance, 0 to leave the
+                                 endpointing to the recognizer.
+        @param min_speech: Seconds of speech an utterance needs before it can be ended early.
+        @param no_speech_timeout: Maximum seconds to wait for speech to begin.
+        @param min_no_speech_timeout: Minimum seconds to wait for speech to begin when adapting.
+        @param adaptive: Shorten the no-speech timeout to what the previous onsets of speech need.
+        @param recognizer_delay: Initial estimate of the seconds of silence the recognizer needs to end an
+                                 utterance, replaced by the measurement whenever it ends one by itself.
+        @param max_utterance: Maximum seconds of listening after the no-speech timeout, a hard limit in case
+                              the speech never ends, e.g. because noise is taken for speech.
+        @param calibrate_every: Leave every n-th utterance to the recognizer to measure its delay, 0 never to.
+        @param max_recognizer_delay: Seconds of silence after which an utterance left to the recognizer is
+                                     ended anyway.
+        @param metrics: Metrics receiving the endpoints and the time saved, the shared ones if not given.
+        @param kwargs: Parameters of the EnergyVad.
+        """
+        self.vad = EnergyVad(sample_rate, **kwargs)
+        self.sample_rate = sample_rate
+        self.trailing_silence = trailing_silence
+        self.min_speech = min_speech
+        self.max_timeout = no_speech_timeout
+        self.min_timeout = min(min_no_speech_timeout, no_speech_timeout)
+        self.adaptive = adaptive
+        self.recognizer_delay = recognizer_delay
+        self.max_utterance = max_utterance
+        self.calibrate_every = calibrate_every
+        self.max_recognizer_delay = max_recognizer_delay
+        self.metrics = metrics or Metrics.shared()
+        self.utterances = 0
+        self.delay_measurements = 0
+        self.calibrating = False
+
+        self.onsets: deque = deque(maxlen=20)
+        self.timeout = no_speech_timeout
+        # audio time of the stream, of the start of listening, and of the first and last speech of the utterance
+        self.position = 0.0
+        self._start = 0.0
+        self._speech_start: Optional[float] = None
+        self._last_speech: Optional[float] = None
+        self._speech = 0.0
+        # time.time() of the last speech, the reference of the endpointing latency
+        self.speech_end_time = 0.0
+
+    def start(self) -> None:
+        """
+        @brief Starts waiting for an utterance.
+        """
+        self._start = self.position
+        self._speech_start = None
+        self._last_speech = None
+        self._speech = 0.0
+        self.speech_end_time = 0.0
+        self.timeout = self._timeout()
+        self.calibrating = bool(self.trailing_silence and self.calibrate_every and
+                                self.utterances % self.calibrate_every == self.calibrate_every - 1)
+
+    def process(self, data: bytes) -> Optional[str]:
+        """
+        @brief Classifies the next chunk of the stream.
+
+        @return ENDPOINT if the utterance has ended, TIMEOUT if no speech began in time or the
+                utterance did not end in time, else None.
+        """
+        duration = len(data) / (2 * self.sample_rate)
+        self.position += duration
+        if self.position - self._start > self.timeout + self.max_utterance:
+            self.metrics.inc("max_utterance_timeouts")
+            logger.warning("No end of the utterance within {:.1f}s".format(self.timeout + self.max_utterance))
+            return self.TIMEOUT
+        if self.vad.is_speech(data):
+            if self._speech_start is None:
+                self._speech_start = self.position - duration
+            self._last_speech = self.position
+            self._speech += duration
+            self.speech_end_time = time.time()
+            return None
+
+        if self._last_speech is None:
+            if self.position - self._start > self.timeout:
+                self.metrics.inc("no_speech_timeouts")
+                logger.debug("No speech within {:.1f}s".format(self.timeout))
+                return self.TIMEOUT
+            return None
+
+        silence = self.position - self._last_speech
+        if self.calibrating:
+            trailing_silence = self.max_recognizer_delay
+        else:
+            trailing_silence = self.trailing_silence or self.recognizer_delay
+        if silence < trailing_silence:
+            return None
+        if self._speech < self.min_speech:
+            # too short for speech, keep waiting for the utterance
+            self.discard()
+            return None
+        return self.ENDPOINT if self.trailing_silence else None
+
+    def end_utterance(self, early: bool) -> float:
+        """
+        @brief Records an utterance ended by this endpointer or by the recognizer and waits for the next one.
+
+        @param early: The FinalResult was taken because of the trailing silence.
+
+        @return Seconds the utterance ended earlier than the recognizer would have ended it, based on the
+                measured delay of the recognizer. 0 as long as the delay has not been measured.
+        """
+        saved = 0.0
+        if self._speech_start is not None:
+            self.onsets.append(self._speech_start - self._start)
+        if self._last_speech is not None:
+            silence = self.position - self._last_speech
+            if early and self.delay_measurements and not self.calibrating:
+                saved = max(0.0, self.recognizer_delay - silence)
+                self.metrics.inc("endpoints_early")
+                self.metrics.observe("endpoint_saved_seconds", saved)
+                logger.info("Endpoint after {:.2f}s of silence, {:.2f}s earlier than the recognizer, which needs "
+                            "{:.2f}s".format(silence, saved, self.recognizer_delay))
+            elif early:
+                self.metrics.inc("endpoints_early")
+                logger.info("Endpoint after {:.2f}s of silence".format(silence))
+            else:
+                # measured how long the recognizer waits
+                if self.delay_measurements:
+                    self.recognizer_delay = 0.8 * self.recognizer_delay + 0.2 * silence
+                else:
+                    self.recognizer_delay = silence
+                self.delay_measurements += 1
+                self.metrics.inc("endpoints_recognizer")
+                self.metrics.observe("endpoint_recognizer_delay_seconds", silence)
+                logger.debug("The recognizer ended the utterance after {:.2f}s of silence".format(silence))
+            self.utterances += 1
+        self.start()
+        return saved
+
+    def discard(self) -> None:
+        """
+        @brief Forgets speech which has not been recognized as words, e.g. a noise, and keeps waiting.
+        """
+        start = self._start
+        self.start()
+        self._start = start
+
+    def _timeout(self) -> float:
+        if not self.adaptive or len(self.onsets) < 3:
+            return self.max_timeout
+        onsets = sorted(self.onsets)
+        slowest = onsets[min(len(onsets) - 1, int(0.9 * len(onsets)))]
+        timeout = min(self.max_timeout, max(self.min_timeout, 1.5 * slowest + 1.0))
+        self.metrics.set_gauge("no_speech_timeout_seconds", round(timeout, 2))
+        return timeout
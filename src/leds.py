@@ -0,0 +1,179 @@
+import math
+import time
+import logging
+import threading
+from array import array
+from typing import Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+Color = Tuple[float, float, float]
+# An animation returns the color of each pixel, channels from 0 to 1, at a time in seconds since its start
+Animation = Callable[[float, int], Sequence[Color]]
+
+OFF: Color = (0, 0, 0)
+
+
+def solid(color: Color) -> Animation:
+    """
+    @brief All pixels in the given color.
+    """
+    return lambda t, num_led: [color] * num_led
+
+
+def progress(color: Color, fraction: float) -> Animation:
+    """
+    @brief Lights a share of the pixels, e.g. the startup phases done.
+
+    @param fraction: Share of the pixels lit, from 0 to 1.
+    """
+    return lambda t, num_led: [color if n < round(fraction * num_led) else OFF for n in range(num_led)]
+
+
+def spinner(color: Color, period: float = 1.0, tail: int = 4) -> Animation:
+    """
+    @brief A pixel circling the ring with a fading tail.
+
+    @param period: Seconds per revolution.
+    @param tail: Number of pixels fading out behind the head.
+    """
+    def frame(t: float, num_led: int) -> List[Color]:
+        head = int(t / period * num_led) % num_led
+        pixels = [OFF] * num_led
+        for n in range(tail + 1):
+            level = 1 - n / (tail + 1)
+            pixels[(head - n) % num_led] = _scale(color, level)
+        return pixels
+
+    return frame
+
+
+def pulse(color: Color, period: float = 1.5, low: float = 0.2) -> Animation:
+    """
+    @brief All pixels slowly fading between a low and the full level.
+
+    @param period: Seconds of a fade cycle.
+    @param low: Lowest level, from 0 to 1.
+    """
+    def frame(t: float, num_led: int) -> List[Color]:
+        level = low + (1 - low) * (0.5 - 0.5 * math.cos(2 * math.pi * t / period))
+        return [_scale(color, level)] * num_led
+
+    return frame
+
+
+def direction(color: Color, angle: Callable[[], Optional[float]], background: float = 0.25) -> Animation:
+    """
+    @brief All pixels dimmed except the one pointing in a direction, which is read on every frame.
+
+    @param angle: Returns the direction in degrees, counted like the microphone angles of the array,
+                  or None if it is unknown.
+    @param background: Level of the other pixels, from 0 to 1.
+    """
+    def frame(t: float, num_led: int) -> List[Color]:
+        pixels = [_scale(color, background)] * num_led
+        doa = angle()
+        if doa is not None:
+            pixels[int(round(doa / 360 * num_led)) % num_led] = color
+        return pixels
+
+    return frame
+
+
+def _scale(color: Color, level: float) -> Color:
+    return color[0] * level, color[1] * level, color[2] * level
+
+
+class LedAnimator(threading.Thread):
+    """
+    @brief Renders LED animations on an own thread at a capped frame rate.
+
+    Each frame is composed in a byte buffer and sent to the strip with a single show(), i.e. one SPI
+    transfer. Frames equal to the previous one are not sent, so static animations cost nothing.
+    Switching the animation only stores it, callers never wait for the LEDs.
+    """
+
+    def __init__(self, driver, num_led: int = 12, fps: float = 30.0, max_value: int = 8):
+        """
+        @param driver: APA102 driver (or any object providing set_pixel(n, r, g, b), show() and clear_strip()).
+        @param num_led: Number of pixels of the strip.
+        @param fps: Maximum number of frames per second.
+        @param max_value: Value of a channel at full level, from 1 to 255.
+        """
+        super().__init__(name="leds", daemon=True)
+        self.driver = driver
+        self.num_led = num_led
+        self.frame_time = 1 / fps
+        self.max_value = max_value
+        self.frames = 0
+        self.skipped = 0
+
+        self._frame = array('B', bytes(3 * num_led))
+        self._shown: Optional[array] = None
+        self._animation: Optional[Animation] = None
+        self._animation_start = 0.0
+        self._changed = threading.Event()
+        self._stop_event = threading.Event()
+
+    def play(self, animation: Optional[Animation]) -> None:
+        """
+        @brief Replaces the running animation, None switches the LEDs off.
+        """
+        self._animation_start = time.monotonic()
+        self._animation = animation
+        self._changed.set()
+
+    def run(self) -> None:
+        logger.debug("LED thread started")
+        try:
+            next_frame = time.monotonic()
+            while not self._stop_event.is_set():
+                animation = self._animation
+                if animation is None:
+                    self._compose([OFF] * self.num_led)
+                else:
+                    self._compose(animation(time.monotonic() - self._animation_start, self.num_led))
+                self._push()
+
+                if animation is None:
+                    # nothing moves until the next animation
+                    self._changed.wait()
+                    self._changed.clear()
+                    next_frame = time.monotonic()
+                    continue
+                next_frame = max(next_frame + self.frame_time, time.monotonic())
+                if self._changed.wait(next_frame - time.monotonic()):
+                    self._changed.clear()
+        except Exception as e:
+            logger.error("LED thread failed: {}".format(e))
+        finally:
+            logger.debug("LED thread stopped, {} frames shown, {} unchanged".format(self.frames, self.skipped))
+
+    def close(self) -> None:
+        """
+        @brief Stops the thread and switches the LEDs off.
+        """
+        self._stop_event.set()
+        self._changed.set()
+        if self.is_alive():
+            self.join(1.0)
+        self.driver.clear_strip()
+
+    def _compose(self, pixels: Sequence[Color]) -> None:
+        frame = self._frame
+        scale = self.max_value
+        for n, (r, g, b) in enumerate(pixels[:self.num_led]):
+            frame[3 * n] = min(255, max(0, int(round(r * scale))))
+            frame[3 * n + 1] = min(255, max(0, int(round(g * scale))))
+            frame[3 * n + 2] = min(255, max(0, int(round(b * scale))))
+
+    def _push(self) -> None:
+        if self._shown is not None and self._frame == self._shown:
+            self.skipped += 1
+            return
+        frame = self._frame
+        for n in range(self.num_led):
+            self.driver.set_pixel(n, frame[3 * n], frame[3 * n + 1], frame[3 * n + 2])
+        self.driver.show()
+        self._shown = array('B', frame)
+        self.frames += 1
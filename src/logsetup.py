@@ -0,0 +1,98 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from typing import Dict, Tuple
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    @brief QueueHandler which never blocks: if the queue is full, the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    @brief Lets at most one record per message template and interval pass, e.g. for partial results.
+
+    The number of suppressed records is appended to the next record passed.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        """
+        @param interval: Minimum time in seconds between two records with the same template.
+        """
+        super().__init__()
+        self.interval = interval
+        self._last: Dict[Tuple[str, str], Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._last.get(key, (0.0, 0))
+            if now - last < self.interval:
+                self._last[key] = (last, suppressed + 1)
+                return False
+            self._last[key] = (now, 0)
+
+        if suppressed:
+            record.msg = "{} ({} suppressed)".format(record.msg, suppressed)
+        return True
+
+
+def setup_logging(filename: str = "log.log", level: str = "DEBUG", max_bytes: int = 1024 * 1024,
+                  backups: int = 3, queue_size: int = 10000) -> logging.handlers.QueueListener:
+    """
+    @brief Routes all logging through a bounded queue to a size rotated log file written by a background thread.
+
+    Logging calls in the audio path then only format the record and put it into the queue, disk stalls
+    no longer block them.
+
+    @param filename: The log file.
+    @param level: Name of the level of the root logger, e.g. INFO.
+    @param max_bytes: Size at which the log file is rotated.
+    @param backups: Number of rotated log files kept.
+    @param queue_size: Maximum number of records waiting to be written, further records are dropped.
+
+    @return The running listener, stopped automatically on exit.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups,
+                                                        encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue: queue.Queue = queue.Queue(queue_size)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(logging.getLevelName(level.upper()) if isinstance(level, str) else level)
+
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    # The listener may already have been stopped by its owner
+    if listener._thread is not None:
+        listener.stop()
+
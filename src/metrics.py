@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import itertools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histograms in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0)
+
+# Spans of a turn, each from the first to the second mark
+TURN_SPANS = {"endpointing": ("speech_end", "final_result"),
+              "llm_first_token": ("llm_request", "llm_first_token"),
+              "llm_first_sentence": ("llm_request", "llm_first_sentence"),
+              "llm_total": ("llm_request", "llm_done"),
+              "tts_first_synthesis": ("tts_synth_start", "tts_synth_end"),
+              "response": ("final_result", "playback_start"),
+              "response_from_speech_end": ("speech_end", "playback_start"),
+              "playback": ("playback_start", "playback_end")}
+
+
+class TurnTrace:
+    """
+    @brief Timestamps of the stages of a conversational turn.
+    """
+
+    def __init__(self, turn_id: int, text: str):
+        self.turn_id = turn_id
+        self.text = text
+        self.marks: Dict[str, float] = {}
+        self.outcome = "spoken"
+
+    def mark(self, name: str, at: Optional[float] = None) -> None:
+        """
+        @brief Records the time of a stage, only its first occurrence counts.
+
+        @param at: time.time() of the stage, now if not given.
+        """
+        self.marks.setdefault(name, at if at is not None else time.time())
+
+    def spans(self) -> Dict[str, float]:
+        return {name: self.marks[end] - self.marks[start] for name, (start, end) in TURN_SPANS.items()
+                if start in self.marks and end in self.marks}
+
+    def to_dict(self) -> dict:
+        start = min(self.marks.values(), default=time.time())
+        return {"turn": self.turn_id,
+                "time": round(start, 3),
+                "text": self.text,
+                "outcome": self.outcome,
+                "marks": {name: round(at - start, 3) for name, at in sorted(self.marks.items(), key=lambda m: m[1])},
+                "spans": {name: round(duration, 3) for name, duration in self.spans().items()}}
+
+
+def _labeled(name: str, labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return name
+    return "{}{{{}}}".format(name, ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                                           for key, value in sorted(labels.items())))
+
+
+class _Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    @brief Counters, gauges and latency histograms of the chatbot, plus a trace of each turn.
+
+    Rendered in the Prometheus text format. Finished turns are appended to a JSONL file which is
+    rotated when it exceeds its size limit.
+    """
+    PREFIX = "chatbot_"
+    _shared: Optional["Metrics"] = None
+
+    def __init__(self, trace_path: Optional[str] = None, max_trace_bytes: int = 1024 * 1024, backups: int = 3):
+        """
+        @param trace_path: JSONL file the turns are written to, None to keep no trace.
+        @param max_trace_bytes: Size at which the trace file is rotated.
+        @param backups: Number of rotated trace files kept.
+        """
+        self.trace_path = trace_path
+        self.max_trace_bytes = max_trace_bytes
+        self.backups = backups
+
+        self.counters: Dict[str, float] = {}
+        self.gauges: Dict[str, float] = {}
+        self.histograms: Dict[str, _Histogram] = {}
+        self.turn: Optional[TurnTrace] = None
+        self._turn_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> "Metrics":
+        """
+        @brief Returns the process wide metrics, creating them on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        """
+        @param labels: Optional labels of the gauge, e.g. the room of a session.
+        """
+        self.gauges[_labeled(name, labels)] = value
+
+    def remove_gauge(self, name: str, labels: Optional[Dict[str, str]] = None) -> None:
+        self.gauges.pop(_labeled(name, labels), None)
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.histograms.setdefault(name, _Histogram()).observe(seconds)
+
+    def begin_turn(self, text: str) -> TurnTrace:
+        """
+        @brief Starts the trace of a turn, the current turn is finished first.
+        """
+        if self.turn:
+            self.end_turn("superseded")
+        self.turn = TurnTrace(next(self._turn_ids), text)
+        return self.turn
+
+    def mark(self, name: str, at: Optional[float] = None) -> None:
+        """
+        @brief Records a stage of the current turn, ignored if there is none.
+        """
+        turn = self.turn
+        if turn:
+            turn.mark(name, at)
+
+    def end_turn(self, outcome: str = "spoken") -> Optional[TurnTrace]:
+        """
+        @brief Finishes the current turn, records its spans and writes it to the trace.
+
+        @param outcome: How the turn ended, e.g. spoken or interrupted.
+        """
+        turn, self.turn = self.turn, None
+        if turn is None:
+            return None
+
+        turn.outcome = outcome
+        self.inc("turns_total")
+        if outcome == "spoken":
+            for name, duration in turn.spans().items():
+                self.observe("turn_{}_seconds".format(name), duration)
+        self._write_trace(turn.to_dict())
+        return turn
+
+    def render(self) -> str:
+        """
+        @brief The metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                name = self.PREFIX + (name if name.endswith("_total") else name + "_total")
+                lines += ["# TYPE {} counter".format(name), "{} {}".format(name, value)]
+            typed = set()
+            for name, value in sorted(self.gauges.items(), key=lambda gauge: (gauge[0].split("{")[0], gauge[0])):
+                base = name.split("{")[0]
+                if base not in typed:
+                    typed.add(base)
+                    lines.append("# TYPE {} gauge".format(self.PREFIX + base))
+                lines.append("{} {}".format(self.PREFIX + name, value))
+            for name, histogram in sorted(self.histograms.items()):
+                name = self.PREFIX + name
+                lines.append("# TYPE {} histogram".format(name))
+                for bound, count in zip(histogram.buckets + ("+Inf",), itertools.accumulate(histogram.counts)):
+                    lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, count))
+                lines += ["{}_sum {}".format(name, round(histogram.sum, 6)),
+                          "{}_count {}".format(name, histogram.count)]
+        return "\n".join(lines) + "\n"
+
+    def _write_trace(self, entry: dict) -> None:
+        if not self.trace_path:
+            return
+        try:
+            with self._lock:
+                if os.path.exists(self.trace_path) and os.path.getsize(self.trace_path) > self.max_trace_bytes:
+                    self._rotate()
+                with open(self.trace_path, 'a', encoding="utf-8") as trace_file:
+                    trace_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning("Could not write the turn trace: {}".format(e))
+
+    def _rotate(self) -> None:
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists("{}.{}".format(self.trace_path, n)):
+                os.replace("{}.{}".format(self.trace_path, n), "{}.{}".format(self.trace_path, n + 1))
+        if self.backups:
+            os.replace(self.trace_path, self.trace_path + ".1")
+        else:
+            os.remove(self.trace_path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server: "MetricsServer"
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s" % (self.address_string(), format % args))
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    @brief Serves the metrics on /metrics for a Prometheus scraper.
+    """
+    daemon_threads = True
+
+    def __init__(self, metrics: Metrics, host: str = "127.0.0.1", port: int = 9101):
+        super().__init__((host, port), _MetricsHandler)
+        self.metrics = metrics
+        self._thread = threading.Thread(target=self.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self) -> "MetricsServer":
+        self._thread.start()
+        logger.info("Serving metrics on port {}".format(self.server_port))
+        return self
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,210 @@
+import os
+import mmap
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Set, Tuple
+
+from ttspipeline import Segment
+
+logger = logging.getLogger(__name__)
+
+# magic, sample rate, sample width, channels
+HEADER = struct.Struct('<4sIHH')
+MAGIC = b'PCM1'
+
+
+def phrase_key(text: str, voice: str, rate: int, engine: str) -> str:
+    """
+    @brief Content address of the audio of a phrase.
+    """
+    return hashlib.sha1("\0".join([engine, str(voice), str(rate), text.strip()]).encode("utf-8")).hexdigest()
+
+
+class PhraseCache:
+    """
+    @brief Two tier cache of rendered phrases: an LRU in memory and a size limited directory on disk.
+
+    Each phrase is stored as one file with a small header followed by the raw PCM data. A phrase read
+    from disk is a memoryview of the mapped file, its pages are only read when the audio is played.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 32 * 1024 * 1024, memory_items: int = 64):
+        """
+        @param directory: Directory of the disk tier, created if missing.
+        @param max_bytes: Size limit of the disk tier.
+        @param memory_items: Number of phrases kept in memory.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._files: OrderedDict = OrderedDict()
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith(".pcm")]
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            self._files[entry.name[:-4]] = entry.stat().st_size
+        self._disk_bytes = sum(self._files.values())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._memory or key in self._files
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pcm")
+
+    def get(self, key: str) -> Optional[Tuple[bytes, int, int, int]]:
+        """
+        @brief Looks up a phrase, memory first, then disk.
+
+        @return (pcm, sample_rate, sample_width, channels), None on a miss. The pcm is bytes-like,
+                a memoryview if read from disk.
+        """
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return audio
+
+            if key not in self._files:
+                self.misses += 1
+                return None
+
+            try:
+                audio = self._read(key)
+            except (OSError, ValueError) as e:
+                logger.warning("Dropping unreadable cache file {}: {}".format(key, e))
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._files.move_to_end(key)
+            os.utime(self._path(key))
+            self._remember(key, audio)
+            self.hits += 1
+            self.disk_hits += 1
+            return audio
+
+    def put(self, key: str, segment: Segment) -> None:
+        if not segment.pcm:
+            return
+        audio = (segment.pcm, segment.sample_rate, segment.sample_width, segment.channels)
+        header = HEADER.pack(MAGIC, segment.sample_rate, segment.sample_width, segment.channels)
+
+        with self._lock:
+            self._remember(key, audio)
+            temp_path = self._path(key) + ".tmp"
+            try:
+                with open(temp_path, 'wb') as pcm_file:
+                    pcm_file.write(header)
+                    pcm_file.write(segment.pcm)
+                os.replace(temp_path, self._path(key))
+            except OSError as e:
+                logger.warning("Could not store phrase {}: {}".format(key, e))
+                return
+
+            self._disk_bytes += HEADER.size + len(segment.pcm) - self._files.pop(key, 0)
+            self._files[key] = HEADER.size + len(segment.pcm)
+            while self._disk_bytes > self.max_bytes and len(self._files) > 1:
+                self._remove(next(iter(self._files)))
+
+    def stats(self) -> dict:
+        return {"memory_items": len(self._memory),
+                "disk_items": len(self._files),
+                "disk_bytes": self._disk_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses}
+
+    def _read(self, key: str) -> Tuple[memoryview, int, int, int]:
+        with open(self._path(key), 'rb') as pcm_file:
+            mapped = mmap.mmap(pcm_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, sample_rate, sample_width, channels = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            mapped.close()
+            raise ValueError("invalid header")
+        # no copy, the mapping stays open as long as the view is referenced
+        return memoryview(mapped)[HEADER.size:], sample_rate, sample_width, channels
+
+    def _remember(self, key: str, audio: Tuple[bytes, int, int, int]) -> None:
+        self._memory[key] = audio
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _remove(self, key: str) -> None:
+        self._disk_bytes -= self._files.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class CachedRenderer:
+    """
+    @brief Renderer for the TtsPipeline looking up phrases in a PhraseCache before rendering them.
+
+    Only the prewarmed phrases are stored by default. Most sentences of the AI replies are never
+    spoken again, storing them would only wear out the SD card.
+    """
+
+    def __init__(self, renderer, cache: PhraseCache, voice: str, rate: int, engine: Optional[str] = None,
+                 cache_all: bool = False):
+        """
+        @param renderer: The renderer used on a cache miss.
+        @param cache: The phrase cache.
+        @param voice: Voice id the renderer uses, part of the cache key.
+        @param rate: Speech rate the renderer uses, part of the cache key.
+        @param engine: Name of the TTS engine, the class name of the renderer if not given.
+        @param cache_all: Store every rendered phrase, not only the prewarmed ones.
+        """
+        self.renderer = renderer
+        self.cache = cache
+        self.voice = voice
+        self.rate = rate
+        self.engine = engine or type(renderer).__name__
+        self.cache_all = cache_all
+        self._phrases: Set[str] = set()
+        # renderers like pyttsx3 must not be used by several threads at once
+        self._render_lock = threading.Lock()
+
+    def render(self, segment: Segment) -> None:
+        key = phrase_key(segment.text, self.voice, self.rate, self.engine)
+        audio = self.cache.get(key) if self.cache_all or key in self.cache else None
+        if audio:
+            segment.pcm, segment.sample_rate, segment.sample_width, segment.channels = audio
+            return
+
+        with self._render_lock:
+            self.renderer.render(segment)
+        if self.cache_all or key in self._phrases:
+            self.cache.put(key, segment)
+
+    def prewarm(self, phrases: Iterable[str]) -> int:
+        """
+        @brief Renders the phrases not cached yet and keeps them cached.
+
+        @return The number of phrases rendered.
+        """
+        rendered = 0
+        for text in phrases:
+            key = phrase_key(text, self.voice, self.rate, self.engine)
+            self._phrases.add(key)
+            if not text.strip() or key in self.cache:
+                continue
+            try:
+                self.render(Segment(text))
+                rendered += 1
+            except Exception as e:
+                logger.error("Prewarming '{}' failed: {}".format(text, e))
+
+        logger.debug("Prewarmed {} phrases, {}".format(rendered, self.cache.stats()))
+        return rendered
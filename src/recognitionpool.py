@@ -0,0 +1,285 @@
+import os
+import json
+import queue
+import logging
+import itertools
+import threading
+import multiprocessing
+import multiprocessing.connection
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _work(model, recognizer_factory: Callable, shm: shared_memory.SharedMemory, slot_bytes: int,
+          tasks, results) -> None:
+    """
+    @brief Loop of a worker process: owns the recognizers of the streams assigned to it.
+
+    The model was loaded by the parent before the fork and is shared copy-on-write.
+    """
+    recognizers: Dict[int, object] = {}
+    while True:
+        message = tasks.get()
+        if message is None:
+            break
+        request_id, command, stream_id, args = message
+        slot = None
+        try:
+            if command == "chunk":
+                slot, size = args
+                data = bytes(shm.buf[slot * slot_bytes:slot * slot_bytes + size])
+                recognizer = recognizers[stream_id]
+                if recognizer.AcceptWaveform(data):
+                    value = (True, recognizer.Result())
+                else:
+                    value = (False, recognizer.PartialResult())
+            elif command == "open":
+                sample_rate, grammar = args
+                recognizers[stream_id] = recognizer_factory(model, sample_rate, grammar)
+                value = os.getpid()
+            elif command == "close":
+                value = recognizers.pop(stream_id, None) is not None
+            else:
+                value = getattr(recognizers[stream_id], command)(*args)
+            results.put((request_id, slot, True, value))
+        except Exception as e:
+            results.put((request_id, slot, False, repr(e)))
+    shm.close()
+
+
+class RecognitionPool:
+    """
+    @brief Recognition on several processes sharing one loaded model.
+
+    The model is loaded once, the worker processes are forked afterwards and share its memory
+    copy-on-write. Each stream gets its own recognizer, pinned to the least busy worker. The audio
+    chunks are handed over through a block of shared memory divided into slots, only the slot
+    number passes the pipe. When all slots are in use, callers wait, which bounds the memory.
+    If a worker dies, e.g. killed for lack of memory, the pending requests of its streams fail and
+    new streams are assigned to the remaining workers.
+
+    The pool should be created before other threads are started, as it forks the process.
+    """
+
+    def __init__(self, model_loader: Callable[[], object],
+                 recognizer_factory: Callable[[object, int, Optional[str]], object],
+                 processes: Optional[int] = None, slots: int = 64, slot_bytes: int = 64 * 1024):
+        """
+        @param model_loader: Loads the model, e.g. lambda: Model(path).
+        @param recognizer_factory: Creates the recognizer of a stream from the model, the sample rate and an
+                                   optional grammar, e.g. a KaldiRecognizer.
+        @param processes: Number of worker processes, the number of cores if not given.
+        @param slots: Number of chunks in flight over all streams.
+        @param slot_bytes: Maximum size of a chunk.
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.slot_bytes = slot_bytes
+        self.model = model_loader()
+
+        context = multiprocessing.get_context("fork")
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self._free_slots: queue.Queue = queue.Queue()
+        for slot in range(slots):
+            self._free_slots.put(slot)
+        self._tasks = [context.SimpleQueue() for _ in range(self.processes)]
+        self._results = context.SimpleQueue()
+        self._workers = [context.Process(target=_work, name="recognition-{}".format(n), daemon=True,
+                                         args=(self.model, recognizer_factory, self._shm, slot_bytes,
+                                               self._tasks[n], self._results))
+                         for n in range(self.processes)]
+        for worker in self._workers:
+            worker.start()
+
+        # request id -> future, worker and slot of the request
+        self._futures: Dict[int, Tuple[Future, int, Optional[int]]] = {}
+        self._streams: Dict[int, int] = {}
+        self._load: List[int] = [0] * self.processes
+        self._dead: Set[int] = set()
+        self._closing = False
+        self._request_ids = itertools.count(1)
+        self._stream_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_results, name="recognition-results", daemon=True)
+        self._reader.start()
+        self._watcher = threading.Thread(target=self._watch, name="recognition-watcher", daemon=True)
+        self._watcher.start()
+        logger.info("Recognition pool with {} processes started".format(self.processes))
+
+    def open_stream(self, sample_rate: int, grammar: Optional[str] = None) -> int:
+        """
+        @brief Creates a recognizer on the least busy worker.
+
+        @param grammar: Optional JSON list of the phrases to recognize.
+
+        @return The id of the stream.
+        """
+        with self._lock:
+            live = [n for n in range(self.processes) if n not in self._dead]
+            if not live:
+                raise RuntimeError("All recognition workers died")
+            stream_id = next(self._stream_ids)
+            worker = min(live, key=lambda n: self._load[n])
+            self._load[worker] += 1
+            self._streams[stream_id] = worker
+        self._request(stream_id, "open", (sample_rate, grammar))
+        return stream_id
+
+    def close_stream(self, stream_id: int) -> None:
+        with self._lock:
+            worker = self._streams.pop(stream_id, None)
+            if worker is None:
+                return
+            self._load[worker] -= 1
+        self._send(worker, stream_id, "close", ())
+
+    def accept(self, stream_id: int, data: bytes) -> Future:
+        """
+        @brief Passes a chunk of audio to the recognizer of a stream.
+
+        @return Future of the flag of AcceptWaveform and the Result (if set) or else the PartialResult.
+        """
+        if len(data) > self.slot_bytes:
+            raise ValueError("Chunk of {} bytes exceeds the slot size {}".format(len(data), self.slot_bytes))
+        slot = self._free_slots.get()
+        self._shm.buf[slot * self.slot_bytes:slot * self.slot_bytes + len(data)] = data
+        try:
+            return self._request(stream_id, "chunk", (slot, len(data)), slot)
+        except Exception:
+            self._free_slots.put(slot)
+            raise
+
+    def call(self, stream_id: int, method: str, *args) -> Future:
+        """
+        @brief Calls another method of the recognizer of a stream, e.g. FinalResult or Reset.
+        """
+        return self._request(stream_id, method, args)
+
+    def recognizer(self, sample_rate: int, grammar: Optional[str] = None) -> "PooledRecognizer":
+        return PooledRecognizer(self, sample_rate, grammar)
+
+    def stats(self) -> dict:
+        return {"processes": self.processes,
+                "streams": list(self._load),
+                "free_slots": self._free_slots.qsize(),
+                "pending": len(self._futures),
+                "dead_workers": len(self._dead)}
+
+    def close(self) -> None:
+        self._closing = True
+        for tasks in self._tasks:
+            tasks.put(None)
+        for worker in self._workers:
+            worker.join(5)
+        self._results.put(None)
+        self._reader.join(5)
+        self._watcher.join(5)
+        with self._lock:
+            for future, _, _ in self._futures.values():
+                future.set_exception(RuntimeError("Recognition pool closed"))
+            self._futures.clear()
+        self._shm.close()
+        self._shm.unlink()
+        logger.info("Recognition pool closed")
+
+    def _request(self, stream_id: int, command: str, args: Tuple, slot: Optional[int] = None) -> Future:
+        with self._lock:
+            worker = self._streams.get(stream_id)
+            if worker is None:
+                raise KeyError("Unknown stream {}".format(stream_id))
+        return self._send(worker, stream_id, command, args, slot)
+
+    def _send(self, worker: int, stream_id: int, command: str, args: Tuple, slot: Optional[int] = None) -> Future:
+        future: Future = Future()
+        request_id = next(self._request_ids)
+        with self._lock:
+            if worker in self._dead:
+                raise RuntimeError("Recognition worker {} died".format(worker))
+            self._futures[request_id] = (future, worker, slot)
+        self._tasks[worker].put((request_id, command, stream_id, args))
+        return future
+
+    def _read_results(self) -> None:
+        while True:
+            message = self._results.get()
+            if message is None:
+                return
+            request_id, _, ok, value = message
+            with self._lock:
+                entry = self._futures.pop(request_id, None)
+            if entry is None:
+                # failed already, its worker died
+                continue
+            future, _, slot = entry
+            if slot is not None:
+                self._free_slots.put(slot)
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(RuntimeError(value))
+
+    def _watch(self) -> None:
+        """
+        @brief Fails the pending requests of a worker if it dies.
+        """
+        sentinels = {worker.sentinel: n for n, worker in enumerate(self._workers)}
+        while sentinels and not self._closing:
+            for sentinel in multiprocessing.connection.wait(list(sentinels), timeout=1.0):
+                worker = sentinels.pop(sentinel)
+                if not self._closing:
+                    self._worker_died(worker)
+
+    def _worker_died(self, worker: int) -> None:
+        logger.error("Recognition worker {} died with exit code {}".format(worker, self._workers[worker].exitcode))
+        error = RuntimeError("Recognition worker {} died".format(worker))
+        with self._lock:
+            self._dead.add(worker)
+            failed = [request_id for request_id, (_, owner, _) in self._futures.items() if owner == worker]
+            entries = [self._futures.pop(request_id) for request_id in failed]
+        for future, _, slot in entries:
+            if slot is not None:
+                self._free_slots.put(slot)
+            future.set_exception(error)
+
+
+class PooledRecognizer:
+    """
+    @brief Stand-in for a KaldiRecognizer running on a RecognitionPool, e.g. for SttHandler or the RoomServer.
+    """
+
+    def __init__(self, pool: RecognitionPool, sample_rate: int, grammar: Optional[str] = None):
+        self.pool = pool
+        self.stream_id = pool.open_stream(sample_rate, grammar)
+        self._result = json.dumps({"text": ""})
+        self._partial = json.dumps({"partial": ""})
+
+    def AcceptWaveform(self, data: bytes) -> bool:
+        accepted, value = self.pool.accept(self.stream_id, data).result()
+        if accepted:
+            self._result = value
+        else:
+            self._partial = value
+        return accepted
+
+    def Result(self) -> str:
+        return self._result
+
+    def PartialResult(self) -> str:
+        return self._partial
+
+    def FinalResult(self) -> str:
+        return self.pool.call(self.stream_id, "FinalResult").result()
+
+    def Reset(self) -> None:
+        self.pool.call(self.stream_id, "Reset").result()
+
+    def SetWords(self, enable: bool) -> None:
+        self.pool.call(self.stream_id, "SetWords", enable).result()
+
+    def SetPartialWords(self, enable: bool) -> None:
+        self.pool.call(self.stream_id, "SetPartialWords", enable).result()
+
+    def close(self) -> None:
+        self.pool.close_stream(self.stream_id)
@@ -0,0 +1,361 @@
+"""
+Recording of sessions for debugging: the captured audio and the events of the pipeline.
+
+A recording is an append-only binary file. After a file header, every record has a 9 byte header
+(type, milliseconds since the start of the session, payload size) followed by its payload: raw PCM
+for audio, a JSON array [name, value] for events. Closing the recorder appends an index of the file
+offsets per second of audio and a trailer pointing to it. A file cut off by a crash is still
+readable, the index is rebuilt by scanning it.
+
+Example: python recorder.py session.rec --wav session.wav
+"""
+import os
+import json
+import time
+import wave
+import queue
+import struct
+import logging
+import argparse
+import threading
+from typing import Any, Iterator, List, Optional, Tuple
+
+from metrics import Metrics
+from logsetup import LOG_FORMAT
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"STTREC\0\0"
+VERSION = 1
+# magic, version, sample rate, sample width, time.time() of the start
+FILE_HEADER = struct.Struct('<8sHIBd')
+# type, milliseconds since the start, payload size
+RECORD_HEADER = struct.Struct('<BII')
+# offset of the index record, magic
+TRAILER = struct.Struct('<Q8s')
+TRAILER_MAGIC = b"STTRIDX\0"
+INDEX_ENTRY = struct.Struct('<II')
+
+AUDIO = 1
+EVENT = 2
+INDEX = 3
+
+
+class SessionRecorder(threading.Thread):
+    """
+    @brief Writes the audio and the events of a session to a recording on its own thread.
+
+    audio() and event() only put the record into a bounded queue, so they can be called from the
+    capture thread. If the writer falls behind, records are dropped and counted instead of growing
+    the memory or blocking the caller.
+    """
+
+    def __init__(self, path: str, sample_rate: int, sample_width: int = 2, queue_size: int = 256,
+                 index_interval: float = 1.0, metrics: Optional[Metrics] = None):
+        """
+        @param path: File the recording is written to, an existing file is replaced.
+        @param sample_rate: Sample rate of the recorded audio.
+        @param sample_width: Bytes per sample of the recorded audio.
+        @param queue_size: Maximum number of records waiting to be written.
+        @param index_interval: Seconds of audio between two entries of the index.
+        @param metrics: Metrics counting the dropped records, the shared ones if not given.
+        """
+        super().__init__(name="recorder", daemon=True)
+        self.path = path
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.index_interval = index_interval
+        self.metrics = metrics or Metrics.shared()
+        self.start_time = time.time()
+        self.dropped = 0
+        self.written = 0
+
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'wb', buffering=64 * 1024)
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, sample_rate, sample_width, self.start_time))
+        self._index: List[Tuple[int, int]] = []
+        self._audio_bytes = 0
+
+    def audio(self, data: bytes) -> None:
+        """
+        @brief Records a chunk of captured PCM audio.
+        """
+        self._put(AUDIO, bytes(data))
+
+    def event(self, name: str, value: Any = None) -> None:
+        """
+        @brief Records an event of the pipeline, e.g. a recognizer result.
+
+        @param value: Anything JSON serializable.
+        """
+        self._put(EVENT, (name, value))
+
+    def _put(self, record_type: int, payload) -> None:
+        try:
+            self._queue.put_nowait((record_type, time.time(), payload))
+        except queue.Full:
+            self.dropped += 1
+            self.metrics.inc("recorder_dropped")
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                logger.warning("Recorder falling behind, {} records dropped".format(self.dropped))
+
+    def run(self) -> None:
+        logger.debug("Recording to {}".format(self.path))
+        last_flush = time.monotonic()
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+                if item:
+                    self._write(*item)
+                if time.monotonic() - last_flush >= 1.0:
+                    self._file.flush()
+                    last_flush = time.monotonic()
+        except (OSError, ValueError) as e:
+            logger.error("Recording failed: {}".format(e))
+        finally:
+            self._finish()
+
+    def _write(self, record_type: int, at: float, payload) -> None:
+        if record_type == AUDIO:
+            if self._audio_bytes >= len(self._index) * self.index_interval * self.sample_rate * self.sample_width:
+                self._index.append((self._audio_bytes // self.sample_width, self._file.tell()))
+            self._audio_bytes += len(payload)
+        else:
+            payload = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        self._file.write(RECORD_HEADER.pack(record_type, max(0, int((at - self.start_time) * 1000)), len(payload)))
+        self._file.write(payload)
+        self.written += 1
+
+    def _finish(self) -> None:
+        try:
+            offset = self._file.tell()
+            payload = b"".join(INDEX_ENTRY.pack(frame, position) for frame, position in self._index)
+            self._file.write(RECORD_HEADER.pack(INDEX, int((time.time() - self.start_time) * 1000), len(payload)))
+            self._file.write(payload)
+            self._file.write(TRAILER.pack(offset, TRAILER_MAGIC))
+        except (OSError, ValueError) as e:
+            logger.error("Could not write the index of {}: {}".format(self.path, e))
+        finally:
+            self._file.close()
+        logger.info("Recorded {} records to {}, {} dropped".format(self.written, self.path, self.dropped))
+
+    def close(self) -> None:
+        """
+        @brief Writes the records still queued and the index, then closes the file.
+        """
+        if self.is_alive():
+            self._queue.put(None)
+            self.join()
+        elif not self._file.closed:
+            self._finish()
+
+
+class SessionReader:
+    """
+    @brief Reads a recording written by a SessionRecorder.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        header = self._file.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or header[:8] != MAGIC:
+            self._file.close()
+            raise ValueError("{} is not a recording".format(path))
+        _, self.version, self.sample_rate, self.sample_width, self.start_time = FILE_HEADER.unpack(header)
+        if self.version != VERSION:
+            self._file.close()
+            raise ValueError("Unsupported version {} of {}".format(self.version, path))
+
+        # offset of the index record, None if the recorder did not close the file
+        self._end: Optional[int] = None
+        # (first audio frame, file offset) per index interval
+        self.index: List[Tuple[int, int]] = self._read_index()
+        self.complete = self._end is not None
+
+    def _read_index(self) -> List[Tuple[int, int]]:
+        self._file.seek(0, 2)
+        size = self._file.tell()
+        if size >= FILE_HEADER.size + TRAILER.size:
+            self._file.seek(size - TRAILER.size)
+            offset, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+            if magic == TRAILER_MAGIC:
+                self._end = offset
+                self._file.seek(offset + RECORD_HEADER.size)
+                payload = self._file.read(size - TRAILER.size - offset - RECORD_HEADER.size)
+                return [entry for entry in INDEX_ENTRY.iter_unpack(payload)]
+
+        logger.warning("{} was not closed, rebuilding its index".format(self.path))
+        index = []
+        frames = 0
+        for record_type, _, payload, offset in self._scan(FILE_HEADER.size):
+            if record_type == AUDIO:
+                if frames >= len(index) * self.sample_rate:
+                    index.append((frames, offset))
+                frames += len(payload) // self.sample_width
+        return index
+
+    def _scan(self, offset: int) -> Iterator[Tuple[int, int, bytes, int]]:
+        """
+        @brief Yields type, milliseconds, payload and offset of the records from the given offset on.
+        """
+        self._file.seek(offset)
+        while self._end is None or offset < self._end:
+            header = self._file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            record_type, ms, size = RECORD_HEADER.unpack(header)
+            payload = self._file.read(size)
+            if len(payload) < size or record_type == INDEX:
+                # cut off by a crash, or the end of the records
+                return
+            yield record_type, ms, payload, offset
+            offset += RECORD_HEADER.size + size
+
+    def seek(self, start: float) -> Tuple[int, int]:
+        """
+        @brief Looks up the last entry of the index at or before the given second of audio.
+
+        @return The file offset and the audio frame of the entry.
+        """
+        offset, first_frame = FILE_HEADER.size, 0
+        if start > 0:
+            for frame, position in self.index:
+                if frame > start * self.sample_rate:
+                    break
+                offset, first_frame = position, frame
+        return offset, first_frame
+
+    def records(self, start: float = 0.0) -> Iterator[Tuple[int, float, Any]]:
+        """
+        @brief Yields the type, the time in seconds and the content of the records.
+
+        @param start: Seconds of audio to skip, the records begin at the entry of the index before it.
+
+        @return Audio records have the PCM bytes as content, events a tuple of name and value.
+        """
+        offset, _ = self.seek(start)
+        for record_type, ms, payload, _ in self._scan(offset):
+            if record_type == EVENT:
+                yield record_type, ms / 1000, tuple(json.loads(payload))
+            else:
+                yield record_type, ms / 1000, payload
+
+    def events(self) -> List[Tuple[float, str, Any]]:
+        return [(at, *content) for record_type, at, content in self.records() if record_type == EVENT]
+
+    def audio(self) -> Iterator[bytes]:
+        return (content for record_type, _, content in self.records() if record_type == AUDIO)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class RecordingStream:
+    """
+    @brief Recording backed stand-in for a PyAudio input stream, used to replay a session through SttHandler.
+
+    The recorded events are logged when the audio reaches them, so the log of the replay can be compared
+    with what happened in the recorded session.
+    """
+
+    def __init__(self, path: str, realtime: bool = False, start: float = 0.0):
+        """
+        @param path: Path of the recording.
+        @param realtime: Deliver the audio not faster than a microphone would.
+        @param start: Seconds of the recorded audio to skip.
+        """
+        self.reader = SessionReader(path)
+        if self.reader.sample_width != 2:
+            raise ValueError("{} is not recorded in 16 bit".format(path))
+        self.sample_rate = self.reader.sample_rate
+        self.realtime = realtime
+        self.frames_read = 0
+        self._records = self.reader.records(start)
+        _, frame = self.reader.seek(start)
+        # audio between the entry of the index and the start
+        self._skip = max(0, int(start * self.sample_rate) - frame) * 2
+        self._pending = b""
+        self._start = None
+
+    @property
+    def position(self) -> float:
+        """
+        @brief Time in seconds of the audio delivered so far.
+        """
+        return self.frames_read / self.sample_rate
+
+    def read(self, num_frames: int, exception_on_overflow: bool = True) -> bytes:
+        if self._start is None:
+            self._start = time.time()
+
+        size = num_frames * 2
+        chunks = [self._pending]
+        available = len(self._pending)
+        for record_type, at, content in self._records:
+            if record_type == EVENT:
+                logger.info("Recorded at {:.2f}s: {} {}".format(at, *content))
+                continue
+            if self._skip:
+                skipped = min(self._skip, len(content))
+                content = content[skipped:]
+                self._skip -= skipped
+            chunks.append(content)
+            available += len(content)
+            if available >= size:
+                break
+        data = b"".join(chunks)
+        data, self._pending = data[:size], data[size:]
+        self.frames_read += len(data) // 2
+
+        if self.realtime:
+            delay = self._start + self.position - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        return data
+
+    def stop_stream(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.reader.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="Recording of a session")
+    parser.add_argument("--wav", help="Export the audio to this WAV file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    reader = SessionReader(args.recording)
+    print("Recorded at {} with {} Hz{}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(reader.start_time)),
+                                              reader.sample_rate, "" if reader.complete else ", not closed"))
+    frames = 0
+    for record_type, at, content in reader.records():
+        if record_type == AUDIO:
+            frames += len(content) // reader.sample_width
+        else:
+            print("{:9.3f}s (audio {:8.2f}s) {}: {}".format(at, frames / reader.sample_rate, *content))
+    print("{:.1f}s of audio".format(frames / reader.sample_rate))
+
+    if args.wav:
+        with wave.open(args.wav, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(reader.sample_width)
+            wf.setframerate(reader.sample_rate)
+            for data in reader.audio():
+                wf.writeframes(data)
+    reader.close()
+
+
+if __name__ == "__main__":
+    main()
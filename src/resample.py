@@ -0,0 +1,88 @@
+import logging
+from math import gcd
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Resampler:
+    """
+    @brief Streaming polyphase resampler for 16 bit mono PCM data.
+
+    Converts by the rational factor up/down using a Kaiser windowed sinc low pass filter.
+    Filter state is kept between calls, so consecutive chunks are resampled without seams.
+    """
+
+    def __init__(self, rate_in: int, rate_out: int, taps_per_phase: int = 16, beta: float = 8.0):
+        """
+        @param rate_in: Sample rate of the input data.
+        @param rate_out: Sample rate of the output data.
+        @param taps_per_phase: Filter length in samples of the lower of the two rates, trading quality for CPU time.
+        @param beta: Kaiser window parameter.
+        """
+        self.rate_in = rate_in
+        self.rate_out = rate_out
+        divisor = gcd(rate_in, rate_out)
+        self.up = rate_out // divisor
+        self.down = rate_in // divisor
+        # the transition band is narrow at the lower rate, so the filter length scales with the
+        # decimation too, rounded up to a multiple of the number of phases
+        num_taps = taps_per_phase * max(self.up, self.down)
+        num_taps = -(-num_taps // self.up) * self.up
+        self.taps = num_taps // self.up
+
+        cutoff = 0.45 / max(self.up, self.down)
+        n = np.arange(num_taps) - (num_taps - 1) / 2
+        prototype = 2 * cutoff * self.up * np.sinc(2 * cutoff * n) * np.kaiser(num_taps, beta)
+        # phases[p, j] = prototype[p + j * up]
+        self.phases = prototype.reshape(self.taps, self.up).T.astype(np.float32)
+
+        self.reset()
+
+    @property
+    def passthrough(self) -> bool:
+        return self.up == self.down
+
+    def reset(self) -> None:
+        self._history = np.zeros(self.taps - 1, dtype=np.float32)
+        self._consumed = 0
+        self._produced = 0
+
+    def output_frames(self, input_frames: int) -> int:
+        """
+        @brief Approximate number of output frames for the given number of input frames.
+        """
+        return input_frames * self.up // self.down
+
+    def process(self, data: bytes) -> bytes:
+        """
+        @brief Resamples the next chunk of the stream.
+
+        @param data: Raw PCM bytes at rate_in.
+
+        @return Raw PCM bytes at rate_out.
+        """
+        if self.passthrough:
+            return data
+
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        signal = np.concatenate((self._history, samples))
+        # global index of signal[0]
+        origin = self._consumed - len(self._history)
+        self._consumed += len(samples)
+
+        # outputs whose newest input sample is already available
+        last = (self._consumed * self.up - 1) // self.down
+        outputs = np.arange(self._produced, last + 1, dtype=np.int64)
+        self._produced = last + 1
+
+        positions = outputs * self.down
+        newest = positions // self.up - origin
+        phase = positions % self.up
+
+        indices = newest[:, None] - np.arange(self.taps)[None, :]
+        result = np.einsum('ij,ij->i', signal[np.maximum(indices, 0)], self.phases[phase])
+
+        self._history = signal[len(signal) - (self.taps - 1):]
+        return np.clip(np.rint(result), -32768, 32767).astype(np.int16).tobytes()
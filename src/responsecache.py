@@ -0,0 +1,195 @@
+import os
+import re
+import gzip
+import time
+import pickle
+import difflib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from ttspipeline import Segment
+
+logger = logging.getLogger(__name__)
+
+# Words not changing the meaning of a spoken question
+FILLER_WORDS = {"äh", "ähm", "hm", "bitte", "mal", "doch", "denn", "eigentlich", "computer"}
+# Words a similar question may add or leave out, all others have to be the same for a fuzzy hit
+FUNCTION_WORDS = {"der", "die", "das", "den", "dem", "des", "ein", "eine", "einen", "einem", "einer", "eines",
+                  "mir", "mich", "dir", "uns"}
+
+
+def normalize(text: str) -> str:
+    """
+    @brief Normalizes a transcript to a cache key, the way Vosk tokenizes: lower case words without punctuation.
+
+    @param text: The transcribed question.
+
+    @return The normalized question.
+    """
+    words = re.sub(r"[^\w\s]", " ", text.lower()).split()
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+class CacheEntry:
+    """
+    @brief Cached answer to a question, optionally with the rendered TTS audio of the answer.
+    """
+
+    def __init__(self, question: str, answer: str):
+        self.question = question
+        self.answer = answer
+        self.created = time.time()
+        # (text, pcm, sample_rate, sample_width, channels) per segment
+        self.audio: List[tuple] = []
+
+    def segments(self) -> List[Segment]:
+        segments = []
+        for text, pcm, sample_rate, sample_width, channels in self.audio:
+            segment = Segment(text)
+            segment.pcm, segment.sample_rate, segment.sample_width, segment.channels = \
+                pcm, sample_rate, sample_width, channels
+            segments.append(segment)
+        return segments
+
+
+class ResponseCache:
+    """
+    @brief LRU cache of AI answers keyed by the normalized question, with TTL and optional fuzzy lookup.
+
+    Persisted as a gzip compressed pickle, written atomically on save().
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 200, ttl: float = 24 * 3600,
+                 fuzzy: float = 0.0):
+        """
+        @param path: File the cache is loaded from and saved to, None for a memory only cache.
+        @param max_entries: Maximum number of cached answers.
+        @param ttl: Seconds an answer stays valid.
+        @param fuzzy: Minimum similarity (0 to 1) of the words of a cached question to count as a hit, 0 for exact
+                      matches only. Only function words may differ, the other words have to be the same.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fuzzy = fuzzy
+
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, question: str) -> Optional[CacheEntry]:
+        """
+        @brief Looks up the answer to a question and counts the hit or miss.
+
+        @param question: The transcribed question.
+
+        @return The cache entry, None on a miss.
+        """
+        key = normalize(question)
+        with self._lock:
+            self._expire()
+            entry_key = key if key in self._entries else self._similar(key)
+            if entry_key is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(entry_key)
+            entry = self._entries[entry_key]
+
+        logger.debug("Cache hit for '{}': '{}'".format(question, entry.question))
+        return entry
+
+    def put(self, question: str, answer: str) -> CacheEntry:
+        entry = CacheEntry(question, answer)
+        with self._lock:
+            self._entries[normalize(question)] = entry
+            self._entries.move_to_end(normalize(question))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        return entry
+
+    def set_audio(self, question: str, segments: List[Segment]) -> None:
+        """
+        @brief Stores the rendered audio of the answer to a cached question.
+
+        Ignored if the segments do not belong to the cached answer, e.g. a follow-up question with the same text.
+        """
+        entry = self._entries.get(normalize(question))
+        if entry is None or not segments or not all(segment.pcm for segment in segments):
+            return
+        if " ".join(segment.text for segment in segments) != entry.answer:
+            return
+        entry.audio = [(segment.text, bytes(segment.pcm), segment.sample_rate, segment.sample_width, segment.channels)
+                       for segment in segments]
+        self._dirty = True
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+    def load(self) -> None:
+        try:
+            with gzip.open(self.path, 'rb') as cache_file:
+                entries = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning("Could not load response cache {}: {}".format(self.path, e))
+            return
+
+        with self._lock:
+            self._entries = OrderedDict(entries)
+            self._expire()
+        logger.debug("Loaded {} cached responses".format(len(self._entries)))
+
+    def save(self) -> None:
+        """
+        @brief Writes the cache to disk if it has changed.
+        """
+        if not self.path or not self._dirty:
+            return
+
+        with self._lock:
+            entries = list(self._entries.items())
+            self._dirty = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with gzip.open(temp_path, 'wb') as cache_file:
+            pickle.dump(entries, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+    def _expire(self) -> None:
+        deadline = time.time() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry.created < deadline]:
+            del self._entries[key]
+            self._dirty = True
+
+    def _similar(self, key: str) -> Optional[str]:
+        if not self.fuzzy or not key:
+            return None
+        # similar spelling does not mean similar meaning, e.g. "zwei plus zwei" and "zwei plus drei"
+        words = key.split()
+        content = [word for word in words if word not in FUNCTION_WORDS]
+        best, best_ratio = None, self.fuzzy
+        for candidate in self._entries:
+            candidate_words = candidate.split()
+            if [word for word in candidate_words if word not in FUNCTION_WORDS] != content:
+                continue
+            ratio = difflib.SequenceMatcher(None, words, candidate_words).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = candidate, ratio
+        return best
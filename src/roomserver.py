@@ -0,0 +1,516 @@
+import json
+import time
+import queue
+import socket
+import struct
+import logging
+import threading
+import itertools
+import socketserver
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from metrics import Metrics
+from ttspipeline import Segment
+from wavstream import WavStream
+
+logger = logging.getLogger(__name__)
+
+# A frame is its type, the length of the payload and the payload.
+# Audio is raw PCM, all other payloads are JSON objects.
+FRAME_HEADER = struct.Struct('<BI')
+MAX_PAYLOAD = 1024 * 1024
+
+# client to server
+HELLO = 1        # {"room", "sample_rate", "sample_width", "channels", "partials"}
+AUDIO = 2        # PCM of the microphone
+END = 3          # end of the audio stream, answered with BYE when all results and replies are sent
+# server to client
+ACCEPT = 16      # {"session"}
+REJECT = 17      # {"reason"}
+PARTIAL = 18     # {"partial"}
+RESULT = 19      # {"text", "final"}
+TTS_START = 20   # {"text", "sample_rate", "sample_width", "channels"}
+TTS_AUDIO = 21   # PCM of the reply
+TTS_END = 22     # {}
+BYE = 23         # {}
+
+TTS_CHUNK = 32 * 1024
+
+
+def send_frame(sock: socket.socket, kind: int, payload=b"") -> None:
+    """
+    @param payload: Raw bytes, or a dict sent as JSON.
+    """
+    if isinstance(payload, dict):
+        payload = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    sock.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def recv_frame(rfile) -> Optional[Tuple[int, bytes]]:
+    """
+    @brief Reads a frame from a buffered socket file.
+
+    @return Type and payload of the frame, None at the end of the stream.
+    """
+    header = rfile.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    kind, size = FRAME_HEADER.unpack(header)
+    if size > MAX_PAYLOAD:
+        raise ValueError("Frame of {} bytes exceeds the limit".format(size))
+    payload = rfile.read(size)
+    if len(payload) < size:
+        return None
+    return kind, payload
+
+
+class Session:
+    """
+    @brief The audio stream of a client, decoded by one worker at a time in the order received.
+    """
+
+    def __init__(self, session_id: int, room: str, sample_rate: int, recognizer, sock: socket.socket,
+                 max_queue: int, partials: bool = False,
+                 responder: Optional[Callable[[str], Optional[Iterable[str]]]] = None):
+        self.session_id = session_id
+        self.room = room
+        self.sample_rate = sample_rate
+        self.recognizer = recognizer
+        self.responder = responder
+        self.partials = partials
+        self.labels = {"room": room, "session": str(session_id)}
+
+        # chunks and the time they were received, None marks the end of the stream
+        self.chunks: queue.Queue = queue.Queue(max_queue)
+        self.max_depth = 0
+        self.audio_bytes = 0
+        self.decode_time = 0.0
+        self.results = 0
+        self.decoded = threading.Event()
+
+        self.scheduled = False
+        self.replying = False
+        self.pending_replies: Deque[str] = deque()
+        self.replies_done = threading.Event()
+        self.replies_done.set()
+        self.last_partial = ""
+
+        self._sock = sock
+        self._send_lock = threading.Lock()
+        self.lock = threading.Lock()
+
+    def send(self, kind: int, payload=b"") -> bool:
+        """
+        @return False if the client is gone.
+        """
+        try:
+            with self._send_lock:
+                send_frame(self._sock, kind, payload)
+            return True
+        except OSError:
+            return False
+
+    def stats(self) -> dict:
+        audio_time = self.audio_bytes / (2 * self.sample_rate)
+        return {"session": self.session_id,
+                "room": self.room,
+                "audio_time": round(audio_time, 2),
+                "rtf": round(self.decode_time / max(audio_time, 1e-6), 4),
+                "max_queue_depth": self.max_depth,
+                "results": self.results}
+
+
+class _SessionHandler(socketserver.StreamRequestHandler):
+    server: "RoomServer"
+
+    def handle(self):
+        frame = recv_frame(self.rfile)
+        if frame is None or frame[0] != HELLO:
+            return
+        session = self.server.admit(json.loads(frame[1]), self.request)
+        if session is None:
+            return
+
+        try:
+            while True:
+                frame = recv_frame(self.rfile)
+                if frame is None:
+                    logger.info("Room {}: connection lost".format(session.room))
+                    break
+                kind, payload = frame
+                if kind == AUDIO:
+                    self.server.feed(session, payload)
+                elif kind == END:
+                    break
+            self.server.feed(session, None)
+            session.decoded.wait()
+            session.replies_done.wait()
+            session.send(BYE, {})
+        except (OSError, ValueError) as e:
+            logger.warning("Room {}: {}".format(session.room, e))
+            self.server.feed(session, None)
+        finally:
+            self.server.release(session)
+
+
+class RoomServer(socketserver.ThreadingTCPServer):
+    """
+    @brief Recognition host for several rooms: thin clients stream their microphone over TCP, the
+    results and the spoken replies are streamed back.
+
+    All sessions share one model, each has its own recognizer. A pool of worker threads decodes the
+    sessions with pending audio, one worker per session at a time so the chunks stay in order. Vosk
+    releases the GIL while decoding, so the workers use all cores. A client waits when the queue of
+    its session is full instead of losing audio. New sessions are rejected when all slots are taken
+    or the workers are behind.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, recognizer_factory: Callable[[int], object], host: str = "0.0.0.0", port: int = 9200,
+                 workers: int = 4, max_sessions: int = 8, max_queue: int = 64, max_backlog: Optional[int] = None,
+                 responder_factory: Optional[Callable[[str], Callable[[str], Optional[Iterable[str]]]]] = None,
+                 renderer=None, metrics: Optional[Metrics] = None):
+        """
+        @param recognizer_factory: Creates a recognizer for a sample rate, e.g. a KaldiRecognizer of the shared model.
+        @param host: Address to listen on.
+        @param port: Port to listen on, 0 for any free port.
+        @param workers: Number of recognition threads, e.g. the number of cores.
+        @param max_sessions: Maximum number of clients served at the same time.
+        @param max_queue: Maximum number of chunks queued per session.
+        @param max_backlog: Chunks queued over all sessions above which new sessions are rejected,
+                            half of the queue capacity of all slots if not given.
+        @param responder_factory: Optional, creates the responder of a session for its room. The responder
+                                  returns the sentences of the reply to a result, None for no reply.
+        @param renderer: Renders the reply sentences for the client, e.g. an EspeakRenderer.
+        @param metrics: Metrics receiving the session statistics, the shared ones if not given.
+        """
+        super().__init__((host, port), _SessionHandler)
+        self.server_port = self.server_address[1]
+        self.recognizer_factory = recognizer_factory
+        self.max_sessions = max_sessions
+        self.max_queue = max_queue
+        self.max_backlog = max_backlog if max_backlog is not None else max_sessions * max_queue // 2
+        self.responder_factory = responder_factory
+        self.renderer = renderer
+        self.metrics = metrics or Metrics.shared()
+
+        self.sessions: Dict[int, Session] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._ready: queue.Queue = queue.Queue()
+        self._workers = [threading.Thread(target=self._work, name="recognition-{}".format(n), daemon=True)
+                         for n in range(workers)]
+        self._thread = threading.Thread(target=self.serve_forever, name="room-server", daemon=True)
+
+    def start(self) -> "RoomServer":
+        for worker in self._workers:
+            worker.start()
+        self._thread.start()
+        logger.info("Serving rooms on port {} with {} workers".format(self.server_port, len(self._workers)))
+        return self
+
+    def join(self) -> None:
+        """
+        @brief Waits until the server is closed.
+        """
+        self._thread.join()
+
+    def close(self) -> None:
+        self.shutdown()
+        self.server_close()
+        for _ in self._workers:
+            self._ready.put(None)
+
+    def backlog(self) -> int:
+        """
+        @brief Number of chunks waiting to be decoded over all sessions.
+        """
+        return sum(session.chunks.qsize() for session in list(self.sessions.values()))
+
+    def admit(self, hello: dict, sock: socket.socket) -> Optional[Session]:
+        """
+        @brief Creates the session of a new client or rejects it.
+        """
+        room = str(hello.get("room", "?"))
+        reason = None
+        if hello.get("sample_width", 2) != 2 or hello.get("channels", 1) != 1:
+            reason = "format"
+        elif len(self.sessions) >= self.max_sessions:
+            reason = "full"
+        elif self.backlog() > self.max_backlog:
+            reason = "overloaded"
+
+        if reason is None:
+            sample_rate = int(hello.get("sample_rate", 16000))
+            with self._lock:
+                if len(self.sessions) < self.max_sessions:
+                    session = Session(next(self._ids), room, sample_rate, self.recognizer_factory(sample_rate), sock,
+                                      self.max_queue, bool(hello.get("partials", False)),
+                                      self.responder_factory(room) if self.responder_factory else None)
+                    self.sessions[session.session_id] = session
+                else:
+                    reason = "full"
+
+        if reason:
+            logger.info("Rejected room {}: {}".format(room, reason))
+            self.metrics.inc("server_sessions_rejected")
+            send_frame(sock, REJECT, {"reason": reason})
+            return None
+
+        logger.info("Room {}: session {} started".format(room, session.session_id))
+        self.metrics.inc("server_sessions_accepted")
+        self.metrics.set_gauge("server_sessions", len(self.sessions))
+        self.metrics.set_gauge("session_queue_depth", 0, session.labels)
+        session.send(ACCEPT, {"session": session.session_id})
+        return session
+
+    def feed(self, session: Session, data: Optional[bytes]) -> None:
+        """
+        @brief Queues a chunk of a session, waiting while its queue is full.
+
+        @param data: PCM, None for the end of the stream.
+        """
+        while True:
+            try:
+                session.chunks.put((data, time.time()), timeout=1.0)
+                break
+            except queue.Full:
+                # nobody is decoding any more if the recognition failed
+                if session.decoded.is_set():
+                    return
+        depth = session.chunks.qsize()
+        session.max_depth = max(session.max_depth, depth)
+        self.metrics.set_gauge("session_queue_depth", depth, session.labels)
+        with session.lock:
+            if session.scheduled:
+                return
+            session.scheduled = True
+        self._ready.put(session)
+
+    def release(self, session: Session) -> None:
+        with self._lock:
+            self.sessions.pop(session.session_id, None)
+        self.metrics.set_gauge("server_sessions", len(self.sessions))
+        self.metrics.remove_gauge("session_queue_depth", session.labels)
+        # recognizers of a RecognitionPool hold a stream on a worker process
+        if hasattr(session.recognizer, "close"):
+            session.recognizer.close()
+        logger.info("Room {}: session ended, {}".format(session.room, session.stats()))
+
+    def _work(self) -> None:
+        while True:
+            session = self._ready.get()
+            if session is None:
+                return
+            try:
+                self._decode(session)
+            except Exception as e:
+                logger.error("Room {}: recognition failed: {!r}".format(session.room, e))
+                session.decoded.set()
+                continue
+
+            with session.lock:
+                if session.chunks.empty() or session.decoded.is_set():
+                    session.scheduled = False
+                    continue
+            self._ready.put(session)
+
+    def _decode(self, session: Session, batch: int = 8) -> None:
+        """
+        @brief Decodes up to a batch of queued chunks, then the worker turns to the next session.
+        """
+        for _ in range(batch):
+            try:
+                data, received = session.chunks.get_nowait()
+            except queue.Empty:
+                return
+            self.metrics.set_gauge("session_queue_depth", session.chunks.qsize(), session.labels)
+
+            start = time.perf_counter()
+            if data is None:
+                text = json.loads(session.recognizer.FinalResult()).get("text", "")
+                session.decode_time += time.perf_counter() - start
+                if text:
+                    self._result(session, text, True)
+                session.decoded.set()
+                return
+
+            session.audio_bytes += len(data)
+            if session.recognizer.AcceptWaveform(data):
+                text = json.loads(session.recognizer.Result()).get("text", "")
+                session.decode_time += time.perf_counter() - start
+                if text:
+                    self._result(session, text, False)
+            else:
+                session.decode_time += time.perf_counter() - start
+                if session.partials:
+                    partial = json.loads(session.recognizer.PartialResult()).get("partial", "")
+                    if partial and partial != session.last_partial:
+                        session.last_partial = partial
+                        session.send(PARTIAL, {"partial": partial})
+            self.metrics.observe("server_chunk_wait_seconds", time.time() - received)
+            self.metrics.inc("server_audio_seconds", len(data) / (2 * session.sample_rate))
+
+    def _result(self, session: Session, text: str, final: bool) -> None:
+        session.results += 1
+        session.last_partial = ""
+        self.metrics.inc("server_results")
+        logger.debug("Room {}: '{}'".format(session.room, text))
+        session.send(RESULT, {"text": text, "final": final})
+
+        if session.responder is None:
+            return
+        with session.lock:
+            session.pending_replies.append(text)
+            if session.replying:
+                return
+            session.replying = True
+            session.replies_done.clear()
+        threading.Thread(target=self._reply, args=(session,), name="reply-{}".format(session.room),
+                         daemon=True).start()
+
+    def _reply(self, session: Session) -> None:
+        """
+        @brief Answers the results of a session in turn, off the recognition workers.
+        """
+        while True:
+            with session.lock:
+                if not session.pending_replies:
+                    session.replying = False
+                    session.replies_done.set()
+                    return
+                text = session.pending_replies.popleft()
+            try:
+                for sentence in session.responder(text) or []:
+                    if not self._speak(session, sentence):
+                        break
+            except Exception as e:
+                logger.error("Room {}: reply failed: {!r}".format(session.room, e))
+
+    def _speak(self, session: Session, sentence: str) -> bool:
+        segment = Segment(sentence)
+        if self.renderer:
+            self.renderer.render(segment)
+        if not session.send(TTS_START, {"text": sentence, "sample_rate": segment.sample_rate,
+                                        "sample_width": segment.sample_width, "channels": segment.channels}):
+            return False
+        for offset in range(0, len(segment.pcm), TTS_CHUNK):
+            if not session.send(TTS_AUDIO, segment.pcm[offset:offset + TTS_CHUNK]):
+                return False
+        return session.send(TTS_END, {})
+
+
+class RoomClient:
+    """
+    @brief Thin client of a RoomServer: streams audio and collects the results and replies.
+
+    Also used to replay WAV files against a server over loopback.
+    """
+
+    def __init__(self, host: str, port: int, room: str, sample_rate: int = 16000, partials: bool = False,
+                 on_result: Optional[Callable[[str, bool], None]] = None,
+                 on_reply: Optional[Callable[[Segment], None]] = None):
+        """
+        @param room: Name of the room, used in the logs and metrics of the server.
+        @param partials: Also receive the partial results.
+        @param on_result: Called with the text and the final flag of each result.
+        @param on_reply: Called with each reply sentence and its audio, e.g. to play it.
+        """
+        self.room = room
+        self.sample_rate = sample_rate
+        self.on_result = on_result
+        self.on_reply = on_reply
+        self.session_id = None
+        self.results: List[str] = []
+        self.partials: List[str] = []
+        self.replies: List[Segment] = []
+
+        self._sock = socket.create_connection((host, port))
+        self._rfile = self._sock.makefile('rb')
+        send_frame(self._sock, HELLO, {"room": room, "sample_rate": sample_rate, "sample_width": 2, "channels": 1,
+                                       "partials": partials})
+        frame = recv_frame(self._rfile)
+        if frame is None or frame[0] != ACCEPT:
+            reason = json.loads(frame[1]).get("reason") if frame else "closed"
+            self.close()
+            raise ConnectionRefusedError("Room server rejected {}: {}".format(room, reason))
+        self.session_id = json.loads(frame[1])["session"]
+
+        self._done = threading.Event()
+        self._reader = threading.Thread(target=self._read, name="room-client-{}".format(room), daemon=True)
+        self._reader.start()
+
+    def send(self, pcm: bytes) -> None:
+        send_frame(self._sock, AUDIO, pcm)
+
+    def stream_wav(self, filename: str, chunk_size: int = 2048, realtime: bool = False) -> None:
+        """
+        @brief Streams a 16 bit mono WAV file like a microphone.
+
+        @param realtime: Send the audio not faster than it would be spoken.
+        """
+        stream = WavStream(filename, realtime)
+        try:
+            if stream.sample_rate != self.sample_rate:
+                raise ValueError("{} has {} Hz, the session {} Hz".format(filename, stream.sample_rate,
+                                                                          self.sample_rate))
+            while True:
+                data = stream.read(chunk_size)
+                if not data:
+                    break
+                self.send(data)
+        finally:
+            stream.close()
+
+    def finish(self, timeout: float = 30.0) -> bool:
+        """
+        @brief Ends the audio stream and waits for the remaining results and replies.
+
+        @return False if the server did not finish in time.
+        """
+        send_frame(self._sock, END)
+        return self._done.wait(timeout)
+
+    def close(self) -> None:
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._rfile.close()
+        self._sock.close()
+
+    def _read(self) -> None:
+        segment = None
+        try:
+            while True:
+                frame = recv_frame(self._rfile)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind == TTS_AUDIO:
+                    segment.pcm += payload
+                    continue
+                message = json.loads(payload) if payload else {}
+                if kind == RESULT:
+                    self.results.append(message["text"])
+                    if self.on_result:
+                        self.on_result(message["text"], message["final"])
+                elif kind == PARTIAL:
+                    self.partials.append(message["partial"])
+                elif kind == TTS_START:
+                    segment = Segment(message["text"])
+                    segment.sample_rate = message["sample_rate"]
+                    segment.sample_width = message["sample_width"]
+                    segment.channels = message["channels"]
+                elif kind == TTS_END:
+                    self.replies.append(segment)
+                    if self.on_reply:
+                        self.on_reply(segment)
+                elif kind == BYE:
+                    break
+        except (OSError, ValueError) as e:
+            logger.debug("Room {}: connection closed: {}".format(self.room, e))
+        finally:
+            self._done.set()
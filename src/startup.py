@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+from concurrent.futures import Future, as_completed
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Phase:
+    def __init__(self, name: str, func: Callable, args: tuple, after: Iterable[str], deferred: bool):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.after = tuple(after)
+        self.deferred = deferred
+        self.future: Future = Future()
+        self.thread: Optional[threading.Thread] = None
+        self.started = 0.0
+        self.waited = 0.0
+        self.duration = 0.0
+
+
+class Startup:
+    """
+    @brief Runs the initialization phases of the chatbot concurrently, each on its own thread.
+
+    A phase may depend on other phases and waits for their results before it starts working.
+    Deferred phases are started once ready() is called, or as soon as their result is needed.
+    The timings of all phases are kept for a startup report.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.ready_time: Optional[float] = None
+        self._phases: Dict[str, _Phase] = {}
+        self._lock = threading.Lock()
+
+    def run(self, name: str, func: Callable, *args, after: Iterable[str] = ()) -> Future:
+        """
+        @brief Starts a phase right away.
+
+        @param name: Name of the phase, used to get its result.
+        @param func: Callable doing the work, its return value is the result of the phase.
+        @param after: Names of the phases which have to be finished first.
+
+        @return Future of the result.
+        """
+        phase = self._add(name, func, args, after, False)
+        self._start(phase)
+        return phase.future
+
+    def defer(self, name: str, func: Callable, *args, after: Iterable[str] = ()) -> Future:
+        """
+        @brief Adds a phase which is not needed to listen for the wake word.
+        """
+        return self._add(name, func, args, after, True).future
+
+    def result(self, name: str, timeout: Optional[float] = None):
+        """
+        @brief Waits for a phase and returns its result, starting it if it was deferred.
+
+        Raises the exception of the phase if it failed.
+        """
+        phase = self._phases[name]
+        self._start(phase)
+        return phase.future.result(timeout)
+
+    def wait(self, names: Iterable[str], progress: Optional[Callable[[str], None]] = None) -> None:
+        """
+        @brief Waits for phases in the calling thread.
+
+        @param names: The phases to wait for.
+        @param progress: Called with the name of each finished phase, in the calling thread.
+        """
+        futures = {}
+        for name in names:
+            phase = self._phases[name]
+            self._start(phase)
+            futures[phase.future] = name
+
+        for future in as_completed(futures):
+            future.result()
+            if progress:
+                progress(futures[future])
+
+    def ready(self) -> None:
+        """
+        @brief Marks the chatbot as ready to listen and starts the deferred phases.
+        """
+        self.ready_time = time.perf_counter()
+        logger.info("Ready after {:.2f} s".format(self.ready_time - self.start_time))
+        for phase in list(self._phases.values()):
+            self._start(phase)
+
+    def report(self) -> List[dict]:
+        """
+        @brief Timings of the phases in seconds, relative to the creation of the Startup object.
+        """
+        report = []
+        for phase in sorted(self._phases.values(), key=lambda p: p.started or float("inf")):
+            report.append({"phase": phase.name,
+                           "deferred": phase.deferred,
+                           "start": round(phase.started - self.start_time, 3) if phase.started else None,
+                           "waited": round(phase.waited, 3),
+                           "duration": round(phase.duration, 3),
+                           "done": phase.future.done(),
+                           "failed": phase.future.done() and phase.future.exception() is not None})
+        return report
+
+    def log_report(self) -> None:
+        for entry in self.report():
+            logger.info("Startup phase {}".format(entry))
+
+    def _add(self, name: str, func: Callable, args: tuple, after: Iterable[str], deferred: bool) -> _Phase:
+        if name in self._phases:
+            raise ValueError("Phase {} exists already".format(name))
+        phase = _Phase(name, func, args, after, deferred)
+        self._phases[name] = phase
+        return phase
+
+    def _start(self, phase: _Phase) -> None:
+        with self._lock:
+            if phase.thread:
+                return
+            phase.thread = threading.Thread(target=self._execute, args=(phase,), name="startup-" + phase.name,
+                                            daemon=True)
+            phase.started = time.perf_counter()
+        phase.thread.start()
+
+    def _execute(self, phase: _Phase) -> None:
+        try:
+            for name in phase.after:
+                self.result(name)
+            phase.waited = time.perf_counter() - phase.started
+            result = phase.func(*phase.args)
+        except BaseException as e:
+            logger.error("Startup phase {} failed: {}".format(phase.name, e))
+            phase.future.set_exception(e)
+            return
+        finally:
+            phase.duration = time.perf_counter() - phase.started - phase.waited
+
+        logger.debug("Startup phase {} took {:.3f} s".format(phase.name, phase.duration))
+        phase.future.set_result(result)
@@ -1,11 +1,16 @@
+import re
 import sys
 import time
 import json
-import wave
+import queue
+import asyncio
 import logging
-from typing import List, Dict
+import threading
+from typing import List, Dict, Iterable, Iterator, Optional
 import configparser
+import shutil
 import os
+from collections import deque
 
 import pyaudio
 import pyttsx3
@@ -19,6 +24,27 @@ sys.path.append("../3rd_party/pixel_ring/pixel_ring")
 import apa102
 from gpiozero import LED
 
+from capture import AudioRingBuffer, CaptureThread, FedAudio
+from chathistory import ChatHistory
+from ttspipeline import TtsPipeline, EspeakRenderer, Pyttsx3Renderer
+from audioout import AudioOutput
+from audioserver import AudioServer, DlnaPlayer, local_ip
+from dlnahelper import DlnaHelper
+from vad import VadGate
+from resample import Resampler
+from beamformer import Beamformer
+from responsecache import ResponseCache, CacheEntry
+from phrasecache import PhraseCache, CachedRenderer
+from startup import Startup
+from conversation import Conversation
+from metrics import Metrics, MetricsServer
+from logsetup import setup_logging, RateLimitFilter
+from leds import LedAnimator, progress
+from roomserver import RoomServer
+from recognitionpool import RecognitionPool
+from endpointer import Endpointer
+from recorder import SessionRecorder, RecordingStream
+
 
 def resource_path(relative_path: str) -> str:
     try:
@@ -33,7 +59,8 @@ def resource_path(relative_path: str) -> str:
 
 # Constants
 CONFIG_FILE = resource_path("etc/config.ini")
-SAMPLE_RATE_IN = 22050
+# Sample rate of the audio passed to Vosk, the microphone is resampled to it
+SAMPLE_RATE_IN = 16000
 CHUNK_SIZE = 2048
 # CHUNK_SIZE = 1024
 AUDIO_FORMAT = pyaudio.paInt16
@@ -41,19 +68,80 @@ TIMEOUT = 15
 AUDIO_OUT_IDX = 0
 AUDIO_IN_IDX = 2
 
-logging.basicConfig(filename='log.log', encoding='utf-8', level=logging.DEBUG,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+# partial results arrive with every chunk, they are logged at most twice a second
+partial_logger = logging.getLogger(__name__ + ".partial")
+partial_logger.addFilter(RateLimitFilter(0.5))
+
+# Sentence end: punctuation followed by whitespace, but not an ordinal number like "10. November"
+SENTENCE_END = re.compile(r'(?<=[.!?])(?<!\b[0-9]\.)(?<!\b[0-9]{2}\.)\s+|\n+')
+
+
+def split_sentences(tokens: Iterable[str], min_length: int = 20) -> Iterator[str]:
+    """
+    @brief Assembles streamed tokens to sentences and yields each sentence as soon as it is complete.
+
+    @param tokens: Text fragments in the order they are received.
+    @param min_length: Sentences shorter than this are joined with the following one.
+
+    @return Generator of sentences.
+    """
+    pending = ""
+    text = ""
+    for token in tokens:
+        text += token
+        parts = SENTENCE_END.split(text)
+        text = parts.pop()
+        for part in parts:
+            pending = "{} {}".format(pending, part.strip()).strip()
+            if len(pending) >= min_length:
+                yield pending
+                pending = ""
+
+    pending = "{} {}".format(pending, text.strip()).strip()
+    if pending:
+        yield pending
 
 
 class AskAi:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, api_base: Optional[str] = None, history_tokens: int = 1500,
+                 summarize_history: bool = False, cache: Optional[ResponseCache] = None):
+        """
+        @param api_key: The OpenAI API key.
+        @param api_base: Alternative URL of the API.
+        @param history_tokens: Token budget of the conversation history sent with each request.
+        @param summarize_history: Condense messages dropped from the history into a summary.
+        @param cache: Optional cache of the answers to the first question of a conversation.
+        """
         openai.api_key = api_key
-        self.msg_history: List[Dict[str, str]] = []
+        if api_base:
+            openai.api_base = api_base
+        self.msg_history = ChatHistory(history_tokens, self._summarize if summarize_history else None)
+        self.cache = cache
 
     def reset_chat(self):
         self.msg_history.clear()
 
+    def cached_reply(self, prompt: str) -> Optional[CacheEntry]:
+        """
+        @brief Looks up the answer to the prompt in the response cache.
+
+        Only the first question of a conversation is looked up, follow-up questions depend on the history.
+        On a hit, question and answer are added to the history as if they had been asked.
+
+        @param prompt: The transcribed question.
+
+        @return The cache entry, None on a miss or if no cache is used.
+        """
+        if self.cache is None or len(self.msg_history):
+            return None
+
+        entry = self.cache.get(prompt)
+        if entry:
+            self.msg_history.append({"role": "user", "content": f"Fasse dich kurz: {prompt}"})
+            self.msg_history.append({"role": "assistant", "content": entry.answer})
+        return entry
+
     def ask_ai(self, prompt: str) -> str:
         """
         @brief Generates a response from an AI model for the given prompt using the OpenAI API.
@@ -66,29 +154,154 @@ class AskAi:
         user_message = {"role": "user", "content": f"Fasse dich kurz: {prompt}"}
         logger.debug(user_message)
 
+        cacheable = self.cache is not None and not len(self.msg_history)
         self.msg_history.append(user_message)
 
         try:
+            Metrics.shared().inc("api_requests")
             response = openai.ChatCompletion.create(
                 model="gpt-3.5-turbo",
-                messages=self.msg_history,
+                messages=self.msg_history.messages(),
                 temperature=0.3,
                 max_tokens=300
             )
 
             if "error" in response:
+                Metrics.shared().inc("api_errors")
                 return str(response.error.message)
 
+            Metrics.shared().mark("llm_first_token")
             ai_message = response.choices[0].message
             self.msg_history.append(ai_message)
+            if cacheable:
+                self.cache.put(prompt, str(ai_message.content))
 
             return str(ai_message.content)
 
         except openai.OpenAIError as e:
+            Metrics.shared().inc("api_errors")
             return str(e)
 
+    @staticmethod
+    def _summarize(summary: str, messages: List[Dict]) -> str:
+        """
+        @brief Condenses the previous summary and messages dropped from the history into a new summary.
+        """
+        conversation = "\n".join("{}: {}".format(message["role"], message["content"]) for message in messages)
+        response = openai.ChatCompletion.create(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "user",
+                       "content": "Fasse diesen Gesprächsverlauf in höchstens drei Sätzen zusammen:\n"
+                                  f"{summary}\n{conversation}"}],
+            temperature=0.0,
+            max_tokens=150
+        )
+        return str(response.choices[0].message.content)
+
+    def ask_ai_stream(self, prompt: str) -> Iterator[str]:
+        """
+        @brief Generates a response like ask_ai, but streams the reply sentence by sentence.
+
+        The tokens are received on a separate thread, so the reply keeps arriving while
+        the caller is speaking the previous sentence.
+
+        @param prompt: The prompt or question for which the AI should generate a response.
+
+        @return Generator of the sentences of the AI-generated response.
+        """
+        user_message = {"role": "user", "content": f"Fasse dich kurz: {prompt}"}
+        logger.debug(user_message)
+
+        cacheable = self.cache is not None and not len(self.msg_history)
+        self.msg_history.append(user_message)
+        tokens: queue.Queue = queue.Queue()
+        failed = threading.Event()
+
+        def receive():
+            try:
+                Metrics.shared().inc("api_requests")
+                response = openai.ChatCompletion.create(
+                    model="gpt-3.5-turbo",
+                    messages=self.msg_history.messages(),
+                    temperature=0.3,
+                    max_tokens=300,
+                    stream=True
+                )
+
+                for chunk in response:
+                    if "error" in chunk:
+                        Metrics.shared().inc("api_errors")
+                        failed.set()
+                        tokens.put(str(chunk.error.message))
+                        break
+
+                    content = chunk.choices[0].delta.get("content")
+                    if content:
+                        Metrics.shared().mark("llm_first_token")
+                        tokens.put(content)
+
+            except openai.OpenAIError as e:
+                Metrics.shared().inc("api_errors")
+                failed.set()
+                tokens.put(str(e))
+
+            finally:
+                tokens.put(None)
+
+        threading.Thread(target=receive, name="ask-ai-stream", daemon=True).start()
+
+        reply = []
+        complete = False
+        try:
+            for sentence in split_sentences(iter(tokens.get, None)):
+                reply.append(sentence)
+                yield sentence
+            complete = True
+        finally:
+            if reply and not failed.is_set():
+                self.msg_history.append({"role": "assistant", "content": " ".join(reply)})
+                # an interrupted reply is not cached
+                if cacheable and complete:
+                    self.cache.put(prompt, " ".join(reply))
+
+
+class RoomAssistant:
+    """
+    @brief Conversation of a room served by the RoomServer: answers what is said after the trigger phrase.
+
+    Like the local loop, the conversation stays open for further questions until nothing is said for
+    the listen timeout.
+    """
+
+    def __init__(self, ask_ai: AskAi, trigger_phrase: str, listen_timeout: float = TIMEOUT):
+        self.ask_ai = ask_ai
+        self.trigger_phrase = trigger_phrase
+        self.listen_timeout = listen_timeout
+        self.awake_until = 0.0
+
+    def __call__(self, text: str) -> Optional[Iterable[str]]:
+        now = time.time()
+        if self.trigger_phrase in text:
+            self.ask_ai.reset_chat()
+            text = text.split(self.trigger_phrase, 1)[1].strip()
+        elif now > self.awake_until:
+            return None
+        self.awake_until = now + self.listen_timeout
+        if not text:
+            return None
+
+        cached = self.ask_ai.cached_reply(text)
+        if cached:
+            return split_sentences([cached.answer])
+        return self.ask_ai.ask_ai_stream(text)
+
 
 class LedPattern:
+    """
+    @brief The APA102 LED ring of the ReSpeaker HAT, including the power supply of the LEDs.
+
+    Provides set_pixel(), show() and clear_strip() of the driver for a LedAnimator.
+    """
     NUM_LED = 12
 
     def __init__(self):
@@ -97,17 +310,25 @@ class LedPattern:
         self.leds = apa102.APA102(num_led=self.NUM_LED)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
         self.leds.clear_strip()
         self.power.off()
 
+    def set_pixel(self, n, r, g, b):
+        self.leds.set_pixel(n, r, g, b)
+
+    def show(self):
+        self.leds.show()
+
     def show_color(self, r, g, b, m=-1):
         if m == -1:
             for n in range(self.NUM_LED):
                 self.leds.set_pixel(n, r, g, b)
-                self.leds.show()
         else:
             self.leds.set_pixel(m, r, g, b)
-            self.leds.show()
+        self.leds.show()
 
     def clear_strip(self):
         self.leds.clear_strip()
@@ -115,45 +336,115 @@ class LedPattern:
 
 def play_wav(filename, device_index=None):
     """
-    @brief Plays a WAV audio file using the PyAudio library.
+    @brief Plays a WAV audio file using the shared AudioOutput engine.
+
+    The file is decoded only once and played on the already opened output stream.
 
     @param filename: The path to the WAV file that should be played.
     @param device_index:
     """
-    chunk = 1024
+    AudioOutput.shared(device_index).play_file(filename, block=True)
 
-    logger.info("Opening file")
-    wf = wave.open(filename, 'rb')
 
-    logger.info("Creating pyaudio")
-    p = pyaudio.PyAudio()
+def create_recognizer(model, sample_rate: int = SAMPLE_RATE_IN, grammar: Optional[str] = None):
+    """
+    @brief Creates a recognizer of the model, or of a RecognitionPool running it on worker processes.
 
-    device_info = p.get_device_info_by_index(device_index) if device_index else None
+    @param grammar: Optional JSON list of the phrases to recognize.
+    """
+    if isinstance(model, RecognitionPool):
+        return model.recognizer(sample_rate, grammar)
+    if grammar:
+        return KaldiRecognizer(model, sample_rate, grammar)
+    return KaldiRecognizer(model, sample_rate)
 
-    logger.debug("Playing wav file using {}".format(device_info))
 
-    logger.info("Opening stream")
-    stream = p.open(format=p.get_format_from_width(wf.getsampwidth()),
-                    channels=wf.getnchannels(),
-                    rate=wf.getframerate(),
-                    output=True,
-                    output_device_index=device_info["index"] if device_info else None)
+def create_wake_word_recognizer(model: Model, phrases: List[str],
+                                sample_rate: int = SAMPLE_RATE_IN) -> KaldiRecognizer:
+    """
+    @brief Creates a recognizer restricted to the given phrases, cheap enough to run all the time.
 
-    data = wf.readframes(chunk)
-    while data:
-        stream.write(data)
-        data = wf.readframes(chunk)
+    @param model: The loaded Vosk model or a RecognitionPool.
+    @param phrases: The phrases to spot, e.g. the trigger and the quit phrase.
+    @param sample_rate: Sample rate of the audio passed to the recognizer.
 
-    logger.info("Close stream")
-    stream.close()
-    p.terminate()
+    @return The grammar restricted KaldiRecognizer.
+    """
+    grammar = [phrase.lower() for phrase in phrases] + ["[unk]"]
+    recognizer = create_recognizer(model, sample_rate, json.dumps(grammar, ensure_ascii=False))
+    recognizer.SetWords(True)
+    if hasattr(recognizer, "SetPartialWords"):
+        recognizer.SetPartialWords(True)
+    return recognizer
 
 
 class SttHandler:
     CHUNK_SIZE = 2048
+    BUFFER_CHUNKS = 64
 
-    def __init__(self):
+    def __init__(self, use_vad: bool = True, stream=None, chunk_size: Optional[int] = None,
+                 sample_rate: int = SAMPLE_RATE_IN, lossless: bool = False, device_rate: Optional[int] = None,
+                 beamforming: bool = False, endpointer: Optional[Endpointer] = None,
+                 recorder: Optional[SessionRecorder] = None):
+        """
+        @param use_vad: Pass only speech segments to the recognizer while waiting for the trigger phrase.
+        @param stream: Input stream to use instead of the Seeed microphone, e.g. a WavStream or a
+                       RecordingStream.
+        @param chunk_size: Number of frames per chunk, defaults to CHUNK_SIZE.
+        @param sample_rate: Sample rate of the audio passed to the recognizer, i.e. the rate of the model.
+        @param lossless: Let the capture thread wait for the recognition instead of dropping audio,
+                         only sensible for file based streams.
+        @param device_rate: Sample rate to open the microphone with, defaults to its native rate.
+                            For a given stream, the rate of the stream.
+        @param beamforming: Capture all channels of the microphone array and combine them with a beamformer.
+        @param endpointer: Endpointing of speech_to_text, by default after 0.6s of trailing silence.
+        @param recorder: Optional recorder receiving the captured audio at the sample rate of the model.
+        """
         self.logger = logging.getLogger(__name__)
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.sample_rate = sample_rate
+        self.sample_width = pyaudio.get_sample_size(AUDIO_FORMAT)
+        self.vad = VadGate(self.sample_rate, self.chunk_size) if use_vad else None
+        self.endpointer = endpointer or Endpointer(self.sample_rate, no_speech_timeout=TIMEOUT)
+        self.recorder = recorder
+        self.audio = None
+        self.device_rate = device_rate or getattr(stream, "sample_rate", self.sample_rate)
+        self.channels = getattr(stream, "channels", 1)
+
+        if stream is None:
+            stream = self._open_microphone(device_rate, beamforming)
+        self.stream = stream
+
+        self.beamformer = Beamformer(self.device_rate, self.channels) if self.channels > 1 else None
+        self.resampler = Resampler(self.device_rate, self.sample_rate)
+        self.logger.debug("Capturing {} channels at {} Hz, recognizing at {} Hz".format(
+            self.channels, self.device_rate, self.sample_rate))
+        device_chunk_size = self.chunk_size * self.resampler.down // self.resampler.up
+
+        self.chunk_bytes = self.chunk_size * self.sample_width
+        self.buffer = AudioRingBuffer(self.chunk_bytes * self.BUFFER_CHUNKS)
+        self.overflow_count = 0
+        self._replay: deque = deque()
+        self._fed = FedAudio(self.chunk_bytes * self.BUFFER_CHUNKS)
+        self._last_partial = ""
+        self.wake_word_latency = 0.0
+        process = None if self.resampler.passthrough and not self.beamformer and not recorder else self._process
+        self.capture = CaptureThread(self.stream, self.buffer, device_chunk_size, lossless, process)
+        self.capture.start()
+
+    def _process(self, data: bytes) -> bytes:
+        """
+        @brief Processing stage of the capture thread, beamforming and resampling to the model rate.
+        """
+        if self.beamformer:
+            data = self.beamformer.process(data)
+        data = self.resampler.process(data)
+        if self.recorder:
+            # only queued, the recorder writes on its own thread
+            self.recorder.audio(data)
+        return data
+
+    def _open_microphone(self, device_rate: Optional[int], beamforming: bool):
         # init audio in
         self.audio = pyaudio.PyAudio()
         info = self.audio.get_host_api_info_by_index(0)
@@ -173,18 +464,61 @@ class SttHandler:
 
         device_info = self.audio.get_device_info_by_index(device_index)
         self.logger.debug("Recording audio using {}".format(device_info))
-        self.stream = self.audio.open(format=AUDIO_FORMAT,
-                                      channels=1,
-                                      rate=SAMPLE_RATE_IN,
-                                      # rate=int(device_info['defaultSampleRate']), 
-                                      input=True,
-                                      input_device_index=device_info['index'] if device_info else None,
-                                      frames_per_buffer=self.CHUNK_SIZE)
+        self.device_rate = device_rate or int(device_info['defaultSampleRate'])
+        if beamforming:
+            self.channels = int(device_info['maxInputChannels'])
+        return self.audio.open(format=AUDIO_FORMAT,
+                               channels=self.channels,
+                               rate=self.device_rate,
+                               input=True,
+                               input_device_index=device_info['index'] if device_info else None,
+                               frames_per_buffer=self.chunk_size * self.device_rate // self.sample_rate)
 
     def __del__(self):
+        self.capture.stop()
+        self.capture.join(timeout=1)
         self.stream.stop_stream()
         self.stream.close()
-        self.audio.terminate()
+        if self.audio:
+            self.audio.terminate()
+
+    def read_chunk(self) -> bytes:
+        """
+        @brief Reads the next chunk of captured audio, the audio handed over from the wake word first.
+
+        @return chunk_size frames of PCM data, or less if the capture has stopped.
+        """
+        if self._replay:
+            return self._replay.popleft()
+
+        return self.read_captured() or b""
+
+    def read_captured(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        @brief Reads the next chunk from the ring buffer of the capture thread.
+
+        @param timeout: Maximum time in seconds to wait for a full chunk.
+
+        @return Up to chunk_size frames of PCM data, less if the timeout expired, None if the capture has stopped.
+        """
+        data = self.buffer.read(self.chunk_bytes, timeout)
+
+        if self.buffer.overflow_count != self.overflow_count:
+            Metrics.shared().inc("audio_overflows", self.buffer.overflow_count - self.overflow_count)
+            self.overflow_count = self.buffer.overflow_count
+            self.logger.warning("Audio buffer overflow, {}".format(self.buffer.stats()))
+
+        if not data and self.buffer.closed:
+            return None
+        return data
+
+    def take_replay(self) -> List[bytes]:
+        """
+        @brief Removes and returns the audio handed over from the wake word recognizer.
+        """
+        replay = list(self._replay)
+        self._replay.clear()
+        return replay
 
     def detect_trigger(self, recognizer: KaldiRecognizer, trigger_phrase: str) -> bool:
         """
@@ -195,71 +529,179 @@ class SttHandler:
 
         @return True if the trigger phrase is detected, otherwise False.
         """
-        self.logger.debug("detect_trigger")
+        return self.wait_for_wake_word(recognizer, [trigger_phrase]) == trigger_phrase
+
+    def wait_for_wake_word(self, recognizer: KaldiRecognizer, phrases: List[str]) -> Optional[str]:
+        """
+        @brief Waits until one of the given phrases is spoken.
+
+        Meant to be used with a small grammar restricted recognizer, see create_wake_word_recognizer.
+        The audio following the detected phrase is kept and handed to the next speech_to_text call,
+        so words spoken right after the wake word are not lost. The recognizer is reset afterwards.
+
+        @param recognizer: The KaldiRecognizer object used for spotting the phrases.
+        @param phrases: The phrases to detect in the audio stream.
+
+        @return The detected phrase, or None if the audio stream has ended.
+        """
+        self.logger.debug("wait_for_wake_word")
+        if self.vad:
+            self.vad.reset()
+
         while True:
-            frames = []
-            data = self.stream.read(self.CHUNK_SIZE, False)
+            data = self.read_chunk()
 
             if not data or len(data) == 0:
-                return False
+                return None
 
-            if recognizer.AcceptWaveform(data):
+            phrase = self.spot_wake_word(recognizer, data, phrases)
+            if phrase:
+                return phrase
+
+    def spot_wake_word(self, recognizer: KaldiRecognizer, data: bytes, phrases: List[str]) -> Optional[str]:
+        """
+        @brief Passes one chunk of audio to the wake word recognizer, see wait_for_wake_word.
+
+        @param recognizer: The KaldiRecognizer object used for spotting the phrases.
+        @param data: The next chunk of audio.
+        @param phrases: The phrases to detect in the audio stream.
+
+        @return The detected phrase, None if none was detected in this chunk.
+        """
+        chunks = [data]
+        if self.vad:
+            chunks = self.vad.process(data)
+            Metrics.shared().set_gauge("vad_gated_ratio", round(self.vad.gated_fraction, 3))
+        for chunk in chunks:
+            self._fed.append(chunk)
+
+            if recognizer.AcceptWaveform(chunk):
                 result_json = json.loads(recognizer.Result())
                 text = result_json['text']
+                words = result_json.get('result', [])
                 self.logger.debug("Result: '{}'".format(text)) if text else True
 
             else:
                 partial_result_json = json.loads(recognizer.PartialResult())
 
                 text = partial_result_json['partial']
-                self.logger.debug("Partial: '{}'".format(text)) if text else True
+                words = partial_result_json.get('partial_result', [])
+                if text and text != self._last_partial:
+                    self._last_partial = text
+                    partial_logger.debug("Partial: '%s'", text)
+
+            for phrase in phrases:
+                if phrase.lower() in text.lower():
+                    if self.vad:
+                        self.logger.debug("VAD {}".format(self.vad.stats()))
+                    if self.beamformer:
+                        self.logger.debug("Beamformer {}".format(self.beamformer.stats()))
+                    self._hand_off(phrase, words)
+                    recognizer.Reset()
+                    return phrase
+
+        return None
+
+    def _hand_off(self, phrase: str, words: List[dict]) -> None:
+        """
+        @brief Keeps the audio fed to the wake word recognizer after the end of the detected phrase.
+
+        @param phrase: The detected phrase.
+        @param words: Word timings of the recognizer result, if available.
+        """
+        end = self._fed.fed_bytes
+        last_word = phrase.lower().split()[-1]
+        for word in reversed(words):
+            if word.get("word", "").lower() == last_word:
+                end = int(word["end"] * self.sample_rate) * self.sample_width
+                break
+        self.wake_word_latency = (self._fed.fed_bytes - end) / self.sample_width / self.sample_rate
 
-            if trigger_phrase.lower() in text.lower():
-                return True
+        tail = self._fed.take_after(end)
+        self._replay.extend(tail[pos:pos + self.chunk_bytes] for pos in range(0, len(tail), self.chunk_bytes))
+        self.logger.debug("Handing {:.2f}s of audio over to speech_to_text".format(
+            len(tail) / self.sample_width / self.sample_rate))
 
     def speech_to_text(self, recognizer: KaldiRecognizer) -> str:
         """
         @brief Transcribes speech from an audio stream to text using the KaldiRecognizer.
 
+        The utterance ends after the trailing silence detected by the endpointer, or earlier if the
+        recognizer ends it by itself. Returns empty if no speech begins within the no-speech timeout.
+
         @param recognizer: The KaldiRecognizer object used for speech recognition.
-        @param stream: The PyAudio Stream object representing the audio input stream.
 
         @return The transcribed text from the audio stream as a string.
         """
-        duration = time.time()
+        self.endpointer.start()
         while True:
-            data = self.stream.read(self.CHUNK_SIZE, False)
+            data = self.read_chunk()
+            if not data:
+                return str()
+
+            event = self.endpointer.process(data)
             if recognizer.AcceptWaveform(data):
-                result = recognizer.Result()
-                result = json.loads(result)
-                result = result["text"]
-                if not result:
-                    continue
-                return result
-
-            if time.time() - duration > TIMEOUT:
+                result = json.loads(recognizer.Result())["text"]
+                if result:
+                    self.endpointer.end_utterance(early=False)
+                    return result
+            elif event == Endpointer.ENDPOINT:
+                result = json.loads(recognizer.FinalResult())["text"]
+                if result:
+                    self.endpointer.end_utterance(early=True)
+                    return result
+                self.endpointer.discard()
+
+            if event == Endpointer.TIMEOUT:
                 return str()
 
 
-def main() -> None:
+def main(replay: Optional[str] = None, realtime: bool = False) -> None:
     """
     @brief Main function to run the voice-activated chatbot using the Vosk and OpenAI APIs.
 
     Sets up the necessary components, such as the KaldiRecognizer, PyAudio, and the TTS engine.
     Listens for the trigger phrase, then transcribes speech and generates responses using the OpenAI API.
     Return to wait for the trigger phrase, listening and responding until the termination phrase is detected.
-    """
-
-    logger.info("\t\t\t#### Start main ####")
 
-    leds = LedPattern()
-    leds.show_color(1, 0, 0, 1)
+    @param replay: Recording of a session to use instead of the microphone.
+    @param realtime: Replay the recording at the speed it was recorded at instead of as fast as possible.
+    """
 
     config = configparser.ConfigParser()
     config.read(CONFIG_FILE)
 
+    log_file = config.get("logging", "file", fallback="log.log")
+    log_level = config.get("logging", "level", fallback="DEBUG")
+    log_max_bytes = config.getint("logging", "max_bytes", fallback=1024 * 1024)
+    log_backups = config.getint("logging", "backups", fallback=3)
+    setup_logging(log_file, log_level, log_max_bytes, log_backups)
+
+    logger.info(f"{__file__}:{__name__}")
+    logger.info("\t\t\t#### Start main ####")
+
+    led_fps = config.getfloat("leds", "fps", fallback=30.0)
+    led_brightness = config.getint("leds", "brightness", fallback=8)
+    led_ring = LedPattern()
+    leds = LedAnimator(led_ring, LedPattern.NUM_LED, led_fps, led_brightness)
+    leds.start()
+    # startup progress: one step for the start and one per phase waited for
+    phases = ["model", "stt_handler", "audio_out", "wake_recognizer"]
+    leds.play(progress((1, 0, 0), 1 / (len(phases) + 1)))
+
     credentials_path = resource_path(config.get("settings", "credential_path", fallback="etc/credentials.txt"))
     trigger_phrase = config.get("settings", "trigger_phrase", fallback="hey computer")
+    use_vad = config.getboolean("settings", "use_vad", fallback=True)
+    beamforming = config.getboolean("settings", "beamforming", fallback=False)
+    barge_in_vad = config.getboolean("settings", "barge_in_vad", fallback=False)
+    stream_reply = config.getboolean("settings", "stream_reply", fallback=True)
+    history_tokens = config.getint("settings", "history_tokens", fallback=1500)
+    summarize_history = config.getboolean("settings", "summarize_history", fallback=False)
+    tts_renderer = config.get("tts", "renderer", fallback="espeak" if shutil.which("espeak") else "pyttsx3")
+    phrase_cache_path = config.get("tts", "phrase_cache_path", fallback="etc/cache/phrases")
+    phrase_cache_mb = config.getint("tts", "phrase_cache_mb", fallback=32)
+    cache_all_phrases = config.getboolean("tts", "cache_all_phrases", fallback=False)
+    prewarm_phrases = config.get("tts", "prewarm_phrases", fallback="")
     quit_trigger_phrase = config.get("settings", "quit_trigger_phrase", fallback="ende")
     waiting_for_trigger_sound = resource_path(config.get("sound", "waiting_for_trigger_sound",
                                                          fallback="etc/sound/recoListening.wav"))
@@ -267,6 +709,24 @@ def main() -> None:
                                                       fallback="etc/sound/recoSuccess.wav"))
     quit_sound = resource_path(config.get("sound", "quit_sound", fallback="etc/sound/recoSleep.wav"))
     model_path = resource_path(config.get("vosk", "model_path", fallback="etc/model/vosk-model-small-de-0.15"))
+    model_sample_rate = config.getint("vosk", "sample_rate", fallback=SAMPLE_RATE_IN)
+    response_cache_enabled = config.getboolean("cache", "responses", fallback=False)
+    response_cache_path = resource_path(config.get("cache", "response_path", fallback="etc/cache/responses.pkl.gz"))
+    response_cache_ttl = config.getint("cache", "response_ttl", fallback=24 * 3600)
+    response_cache_fuzzy = config.getfloat("cache", "response_fuzzy", fallback=0.0)
+    trailing_silence = config.getfloat("endpointing", "trailing_silence", fallback=0.6)
+    no_speech_timeout = config.getfloat("endpointing", "no_speech_timeout", fallback=TIMEOUT)
+    min_no_speech_timeout = config.getfloat("endpointing", "min_no_speech_timeout", fallback=5.0)
+    adaptive_timeout = config.getboolean("endpointing", "adaptive_timeout", fallback=True)
+    max_utterance = config.getfloat("endpointing", "max_utterance", fallback=30.0)
+    calibrate_every = config.getint("endpointing", "calibrate_every", fallback=10)
+    metrics_port = config.getint("metrics", "port", fallback=9101)
+    metrics_host = config.get("metrics", "host", fallback="127.0.0.1")
+    metrics_trace_path = config.get("metrics", "trace_path", fallback="turns.jsonl")
+    recorder_path = config.get("recorder", "path", raw=True, fallback="")
+    recorder_queue_size = config.getint("recorder", "queue_size", fallback=256)
+    dlna_speaker_ip = config.get("dlna", "speaker_ip", fallback="")
+    dlna_volume = config.getint("dlna", "volume", fallback=25)
     http_proxy = config.get("poxy", "http", fallback="")
     https_proxy = config.get("proxy", "https", fallback="")
 
@@ -278,14 +738,66 @@ def main() -> None:
         config.set("settings", "trigger_phrase", trigger_phrase)
         config.set("settings", "quit_trigger_phrase", quit_trigger_phrase)
         config.set("settings", "credential_path", credentials_path)
+        config.set("settings", "stream_reply", str(stream_reply))
+        config.set("settings", "history_tokens", str(history_tokens))
+        config.set("settings", "summarize_history", str(summarize_history))
+        config.set("settings", "use_vad", str(use_vad))
+        config.set("settings", "beamforming", str(beamforming))
+        config.set("settings", "barge_in_vad", str(barge_in_vad))
 
         config.add_section("sound")
         config.set("sound", "waiting_for_trigger_sound", waiting_for_trigger_sound)
         config.set("sound", "trigger_detect_sound", trigger_detected_sound)
         config.set("sound", "quit_sound", quit_sound)
 
+        config.add_section("tts")
+        config.set("tts", "renderer", tts_renderer)
+        config.set("tts", "phrase_cache_path", phrase_cache_path)
+        config.set("tts", "phrase_cache_mb", str(phrase_cache_mb))
+        config.set("tts", "cache_all_phrases", str(cache_all_phrases))
+        config.set("tts", "prewarm_phrases", prewarm_phrases)
+
         config.add_section("vosk")
         config.set("vosk", "model_path", model_path)
+        config.set("vosk", "sample_rate", str(model_sample_rate))
+
+        config.add_section("endpointing")
+        config.set("endpointing", "trailing_silence", str(trailing_silence))
+        config.set("endpointing", "no_speech_timeout", str(no_speech_timeout))
+        config.set("endpointing", "min_no_speech_timeout", str(min_no_speech_timeout))
+        config.set("endpointing", "adaptive_timeout", str(adaptive_timeout))
+        config.set("endpointing", "max_utterance", str(max_utterance))
+        config.set("endpointing", "calibrate_every", str(calibrate_every))
+
+        config.add_section("cache")
+        config.set("cache", "responses", str(response_cache_enabled))
+        config.set("cache", "response_path", response_cache_path)
+        config.set("cache", "response_ttl", str(response_cache_ttl))
+        config.set("cache", "response_fuzzy", str(response_cache_fuzzy))
+
+        config.add_section("metrics")
+        config.set("metrics", "port", str(metrics_port))
+        config.set("metrics", "host", metrics_host)
+        config.set("metrics", "trace_path", metrics_trace_path)
+
+        config.add_section("recorder")
+        config.set("recorder", "path", recorder_path)
+        config.set("recorder", "queue_size", str(recorder_queue_size))
+
+        config.add_section("dlna")
+        config.set("dlna", "speaker_ip", dlna_speaker_ip)
+        config.set("dlna", "volume", str(dlna_volume))
+
+        config.add_section("leds")
+        config.set("leds", "fps", str(led_fps))
+        config.set("leds", "brightness", str(led_brightness))
+
+        config.add_section("logging")
+        config.set("logging", "file", log_file)
+        config.set("logging", "level", log_level)
+        config.set("logging", "max_bytes", str(log_max_bytes))
+        config.set("logging", "backups", str(log_backups))
+
         config.add_section("proxy")
         config.set("proxy", "http", http_proxy)
         config.set("proxy", "https", https_proxy)
@@ -301,78 +813,188 @@ def main() -> None:
         logger.error(f"Model {model_path} existiert nicht.")
         sys.exit(1)
 
-    leds.show_color(1, 0, 0, 2)
-    model = Model(model_path)
-    ask_ai = AskAi(openai_key)
-
-    leds.show_color(1, 0, 0, 3)
-    stt_handler = SttHandler()
-
-    leds.show_color(1, 0, 0, 4)
-    recognizer = KaldiRecognizer(model, SAMPLE_RATE_IN)
-    tts_engine = pyttsx3.init()
-    voices = tts_engine.getProperty("voices")
-    voice_id = 0
-    for voice in voices:
-        logger.debug("Id: {}, name: {}, complete: {}".format(voice.id, voice.name, voice))
-        if "german-mbrola-5" in voice.name:
-            voice_id = voice.id
-
-    tts_engine.setProperty('rate', 150)
-    tts_engine.setProperty('voice', voice_id)
-
-    leds.show_color(1, 0, 0, 5)
-    play_wav(waiting_for_trigger_sound, AUDIO_OUT_IDX)
-    is_active = True
-
-    logger.info("Entering loop...")
-
-    leds.clear_strip()
+    def init_audio_out() -> AudioOutput:
+        output = AudioOutput.shared(AUDIO_OUT_IDX)
+        for sound in (waiting_for_trigger_sound, trigger_detected_sound, quit_sound):
+            output.load_cue(sound)
+        return output
+
+    def init_renderer():
+        tts_engine = pyttsx3.init()
+        voices = tts_engine.getProperty("voices")
+        voice_id = 0
+        for voice in voices:
+            logger.debug("Id: {}, name: {}, complete: {}".format(voice.id, voice.name, voice))
+            if "german-mbrola-5" in voice.name:
+                voice_id = voice.id
+
+        tts_engine.setProperty('rate', 150)
+        tts_engine.setProperty('voice', voice_id)
+
+        if tts_renderer == "espeak":
+            renderer = EspeakRenderer(voice_id or "de", 150)
+        else:
+            renderer = Pyttsx3Renderer(tts_engine)
+        if phrase_cache_path:
+            # the prewarmed phrases, or all rendered ones, are kept in memory and on disk
+            phrase_cache = PhraseCache(resource_path(phrase_cache_path), phrase_cache_mb * 1024 * 1024)
+            renderer = CachedRenderer(renderer, phrase_cache, voice_id or "de", 150, tts_renderer,
+                                      cache_all_phrases)
+        return renderer
+
+    def init_tts():
+        renderer = startup.result("renderer")
+        if dlna_speaker_ip:
+            audio_server = AudioServer(advertised_host=local_ip(dlna_speaker_ip)).start()
+            player = DlnaPlayer(audio_server, DlnaHelper(dlna_speaker_ip, dlna_volume))
+            return TtsPipeline(renderer, player), player
+
+        output = startup.result("audio_out")
+        return TtsPipeline(renderer, lambda segment: output.play(segment, block=True)), None
+
+    def init_ask_ai() -> AskAi:
+        response_cache = None
+        if response_cache_enabled:
+            response_cache = ResponseCache(response_cache_path, ttl=response_cache_ttl, fuzzy=response_cache_fuzzy)
+        return AskAi(openai_key, history_tokens=history_tokens, summarize_history=summarize_history,
+                     cache=response_cache)
+
+    def prewarm():
+        renderer = startup.result("renderer")
+        if isinstance(renderer, CachedRenderer):
+            renderer.prewarm(prewarm_phrases.splitlines())
+
+    metrics = Metrics.shared()
+    metrics.trace_path = metrics_trace_path or None
+    metrics_server = MetricsServer(metrics, metrics_host, metrics_port).start() if metrics_port else None
+
+    # Only the model, the microphone and the sound output are needed to listen for the wake word.
+    # They are initialized concurrently, everything else is done while waiting for the wake word.
+    startup = Startup()
+    startup.run("model", Model, model_path)
+    endpointer = Endpointer(model_sample_rate, trailing_silence, no_speech_timeout=no_speech_timeout,
+                            min_no_speech_timeout=min_no_speech_timeout, adaptive=adaptive_timeout,
+                            max_utterance=max_utterance, calibrate_every=calibrate_every, metrics=metrics)
+    # the path of a recording is expanded by strftime, e.g. recordings/%Y%m%d-%H%M%S.rec
+    recorder = None
+    if recorder_path and not replay:
+        recorder = SessionRecorder(time.strftime(recorder_path), model_sample_rate, queue_size=recorder_queue_size,
+                                   metrics=metrics)
+        recorder.start()
+    stream = RecordingStream(replay, realtime) if replay else None
+    startup.run("stt_handler", lambda: SttHandler(use_vad, stream=stream, sample_rate=model_sample_rate,
+                                                  lossless=bool(replay) and not realtime, beamforming=beamforming,
+                                                  endpointer=endpointer, recorder=recorder))
+    # PortAudio must not be initialized by two threads at the same time
+    startup.run("audio_out", init_audio_out, after=["stt_handler"])
+    startup.run("wake_recognizer", lambda: create_wake_word_recognizer(startup.result("model"),
+                                                                      [trigger_phrase, quit_trigger_phrase],
+                                                                      model_sample_rate),
+                after=["model"])
+    startup.run("renderer", init_renderer)
+    startup.defer("recognizer", lambda: KaldiRecognizer(startup.result("model"), model_sample_rate),
+                  after=["model"])
+    tts_ready = startup.defer("tts", init_tts, after=["renderer"])
+    startup.defer("ask_ai", init_ask_ai)
+    startup.defer("cues", lambda: startup.result("audio_out").load_cues(resource_path("etc/sound")),
+                  after=["audio_out"])
+    startup.defer("prewarm", prewarm, after=["renderer"])
+
+    done = iter(range(2, len(phases) + 2))
+    startup.wait(phases, lambda name: leds.play(progress((1, 0, 0), next(done) / (len(phases) + 1))))
+    startup.ready()
+    startup.log_report()
+    metrics.set_gauge("startup_ready_seconds", round(startup.ready_time - startup.start_time, 3))
+
+    conversation = Conversation(startup, trigger_phrase, quit_trigger_phrase, leds,
+                                {"waiting": waiting_for_trigger_sound,
+                                 "trigger": trigger_detected_sound,
+                                 "quit": quit_sound},
+                                stream_reply, TIMEOUT, barge_in_vad, endpointer=endpointer, recorder=recorder)
     try:
-        while is_active:
-            if stt_handler.detect_trigger(recognizer, trigger_phrase):
-                leds.show_color(0, 1, 0)
-
-                recognizer.Reset()
-
-                play_wav(trigger_detected_sound, AUDIO_OUT_IDX)
-                logger.info("Trigger detected. Listening...")
-
-                while True:
-                    leds.show_color(1, 1, 0)
-
-                    stt_text = stt_handler.speech_to_text(recognizer)
-
-                    if stt_text:
-                        logger.info(f"> {stt_text}")
+        asyncio.run(conversation.run())
 
-                        if quit_trigger_phrase.lower() in stt_text.lower():
-                            is_active = False
-                            break
-                        elif stt_text.count(" ") > 2:
-                            leds.show_color(1, 0, 0)
-
-                            ai_reply = ask_ai.ask_ai(stt_text)
-                            logger.info("< {}".format(ai_reply.replace("\n", "")))
-                            tts_engine.say(ai_reply)
-                            # tts_engine.save_to_file(ai_reply, 'output_audio.mp3')
-                            tts_engine.runAndWait()
-                    else:
-                        leds.clear_strip()
-
-                        ask_ai.reset_chat()
-                        break
+    finally:
+        startup.log_report()
+        if metrics_server:
+            metrics_server.close()
+        if tts_ready.done() and not tts_ready.exception():
+            tts_ready.result()[0].close()
+        startup.result("audio_out").close()
+        if recorder:
+            recorder.close()
+        leds.close()
+        led_ring.close()
+
+
+def serve() -> None:
+    """
+    @brief Runs the recognition host of several rooms instead of the local loop.
 
-                leds.clear_strip()
-                play_wav(waiting_for_trigger_sound, AUDIO_OUT_IDX)
+    Thin clients stream their microphone to the RoomServer, which recognizes all rooms with one shared
+    model and sends the results and the spoken replies back.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
 
-        logger.info("End.")
-        play_wav(quit_sound, AUDIO_OUT_IDX)
+    credentials_path = resource_path(config.get("settings", "credential_path", fallback="etc/credentials.txt"))
+    trigger_phrase = config.get("settings", "trigger_phrase", fallback="hey computer")
+    history_tokens = config.getint("settings", "history_tokens", fallback=1500)
+    model_path = resource_path(config.get("vosk", "model_path", fallback="etc/model/vosk-model-small-de-0.15"))
+    phrase_cache_path = config.get("tts", "phrase_cache_path", fallback="etc/cache/phrases")
+    phrase_cache_mb = config.getint("tts", "phrase_cache_mb", fallback=32)
+    cache_all_phrases = config.getboolean("tts", "cache_all_phrases", fallback=False)
+    server_host = config.get("server", "host", fallback="0.0.0.0")
+    server_port = config.getint("server", "port", fallback=9200)
+    server_workers = config.getint("server", "workers", fallback=os.cpu_count() or 1)
+    max_sessions = config.getint("server", "max_sessions", fallback=8)
+    max_queue = config.getint("server", "max_queue", fallback=64)
+    processes = config.getint("server", "processes", fallback=0)
+    metrics_port = config.getint("metrics", "port", fallback=9101)
+    metrics_host = config.get("metrics", "host", fallback="127.0.0.1")
 
-    finally:
+    with open(credentials_path, 'r') as json_file:
+        openai_key = json.load(json_file)["openai_api"]
+
+    if processes:
+        # the worker processes share the model loaded before they are forked, and are forked before
+        # the logging starts its thread
+        model = RecognitionPool(lambda: Model(model_path), create_recognizer, processes)
+    setup_logging(config.get("logging", "file", fallback="log.log"),
+                  config.get("logging", "level", fallback="DEBUG"),
+                  config.getint("logging", "max_bytes", fallback=1024 * 1024),
+                  config.getint("logging", "backups", fallback=3))
+    logger.info("\t\t\t#### Start server ####")
+    if not processes:
+        model = Model(model_path)
+    renderer = EspeakRenderer("de", 150)
+    if phrase_cache_path:
+        phrase_cache = PhraseCache(resource_path(phrase_cache_path), phrase_cache_mb * 1024 * 1024)
+        renderer = CachedRenderer(renderer, phrase_cache, "de", 150, "espeak", cache_all_phrases)
+
+    metrics = Metrics.shared()
+    metrics_server = MetricsServer(metrics, metrics_host, metrics_port).start() if metrics_port else None
+    server = RoomServer(lambda sample_rate: create_recognizer(model, sample_rate), server_host, server_port,
+                        server_workers, max_sessions, max_queue,
+                        responder_factory=lambda room: RoomAssistant(AskAi(openai_key, history_tokens=history_tokens),
+                                                                     trigger_phrase),
+                        renderer=renderer, metrics=metrics).start()
+    try:
+        server.join()
+    except KeyboardInterrupt:
         pass
+    finally:
+        server.close()
+        if isinstance(model, RecognitionPool):
+            model.close()
+        if metrics_server:
+            metrics_server.close()
 
 
 if __name__ == "__main__":
-    logger.info(f"{__file__}:{__name__}")
-    main()
+    if "--server" in sys.argv[1:]:
+        serve()
+    elif "--replay" in sys.argv[1:]:
+        main(sys.argv[sys.argv.index("--replay") + 1], "--realtime" in sys.argv[1:])
+    else:
+        main()
@@ -0,0 +1,226 @@
+"""
+Batch transcription of recorded audio with the Vosk model configured in etc/config.ini.
+
+Transcribes all 16 bit mono WAV files of the given directories on a pool of worker processes
+sharing one loaded model and writes one JSON line per file, including word timings. Files already
+in the output are skipped, so an interrupted run continues where it stopped.
+
+Example: python transcribe.py ../etc/corpus --output transcripts.jsonl --processes 4
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import logging
+import argparse
+import configparser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Set, Tuple
+
+from logsetup import LOG_FORMAT
+from recognitionpool import RecognitionPool
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "etc", "config.ini")
+
+
+def wav_data(mapped) -> Tuple[int, int, int, int, int]:
+    """
+    @brief Locates the PCM data of a WAV file.
+
+    @param mapped: Content of the file, e.g. a mmap.
+
+    @return Offset and size of the PCM data, the sample rate, the number of channels and the sample width.
+    """
+    if mapped[:4] != b'RIFF' or mapped[8:12] != b'WAVE':
+        raise ValueError("not a WAV file")
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(mapped):
+        chunk_id, size = struct.unpack_from('<4sI', mapped, offset)
+        offset += 8
+        if chunk_id == b'fmt ':
+            if size < 16 or offset + 16 > len(mapped):
+                raise ValueError("truncated format")
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', mapped, offset)
+            fmt = (audio_format, sample_rate, channels, bits // 8)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("no format before the data")
+            if fmt[0] != 1:
+                raise ValueError("not PCM")
+            # the size of a streamed WAV is unknown
+            return offset, min(size, len(mapped) - offset), fmt[1], fmt[2], fmt[3]
+        offset += size + (size & 1)
+    raise ValueError("no data")
+
+
+def find_files(paths: List[str], recursive: bool = True) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for directory, subdirectories, names in os.walk(path):
+            files += [os.path.join(directory, name) for name in sorted(names) if name.lower().endswith(".wav")]
+            if not recursive:
+                break
+            subdirectories.sort()
+    return files
+
+
+def load_done(output: str) -> Set[str]:
+    """
+    @brief The files already in the output, a line cut off by an interruption is removed.
+
+    Files that failed are not done, they are tried again.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, 'r+b') as out:
+        good = 0
+        for line in out:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                result = json.loads(line)
+                if "error" not in result:
+                    done.add(result["file"])
+            except (ValueError, KeyError):
+                break
+            good += len(line)
+        out.truncate(good)
+    return done
+
+
+def transcribe_file(pool: RecognitionPool, filename: str, chunk_seconds: float = 4.0) -> dict:
+    """
+    @brief Transcribes a WAV file read via mmap in chunks of several seconds.
+
+    @return The result line of the file: the text, the segments with the timings of their words,
+            the duration and the processing time.
+    """
+    start = time.perf_counter()
+    with open(filename, 'rb') as wav_file, mmap.mmap(wav_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        offset, size, sample_rate, channels, sample_width = wav_data(mapped)
+        if channels != 1 or sample_width != 2:
+            raise ValueError("not a 16 bit mono WAV file")
+
+        chunk_bytes = min(pool.slot_bytes, int(chunk_seconds * sample_rate) * 2) & ~1
+        recognizer = pool.recognizer(sample_rate)
+        view = memoryview(mapped)
+        try:
+            recognizer.SetWords(True)
+            segments = []
+            # the chunks are copied from the page cache straight into the shared memory of the pool
+            for position in range(offset, offset + size, chunk_bytes):
+                with view[position:min(position + chunk_bytes, offset + size)] as data:
+                    if recognizer.AcceptWaveform(data):
+                        segments.append(json.loads(recognizer.Result()))
+            segments.append(json.loads(recognizer.FinalResult()))
+        finally:
+            view.release()
+            recognizer.close()
+
+    segments = [segment for segment in segments if segment.get("text")]
+    duration = size / (2 * sample_rate)
+    processing_time = time.perf_counter() - start
+    return {"text": " ".join(segment["text"] for segment in segments),
+            "segments": [{"text": segment["text"],
+                          "start": segment["result"][0]["start"] if segment.get("result") else None,
+                          "end": segment["result"][-1]["end"] if segment.get("result") else None,
+                          "words": segment.get("result", [])} for segment in segments],
+            "duration": round(duration, 3),
+            "processing_time": round(processing_time, 3),
+            "rtf": round(processing_time / max(duration, 1e-6), 4)}
+
+
+def transcribe(pool: RecognitionPool, files: List[str], output: str, root: str = "",
+               chunk_seconds: float = 4.0, streams: int = 0) -> dict:
+    """
+    @brief Transcribes the files not yet in the output and appends their results to it.
+
+    @param root: The names of the files in the output are relative to it.
+    @param streams: Number of files transcribed at the same time, twice the number of processes if 0.
+
+    @return Summary of the run.
+    """
+    done = load_done(output)
+    names = {filename: os.path.relpath(filename, root) if root else filename for filename in files}
+    todo = [filename for filename in files if names[filename] not in done]
+    logger.info("{} files, {} done, {} to transcribe".format(len(files), len(files) - len(todo), len(todo)))
+
+    start = time.perf_counter()
+    audio_time = 0.0
+    failed = 0
+    with open(output, 'a', encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=streams or 2 * pool.processes) as executor:
+        futures = {executor.submit(transcribe_file, pool, filename, chunk_seconds): filename for filename in todo}
+        for n, future in enumerate(as_completed(futures), 1):
+            filename = futures[future]
+            try:
+                result = future.result()
+                audio_time += result["duration"]
+            except (OSError, ValueError, RuntimeError) as e:
+                logger.warning("{}: {}".format(filename, e))
+                result = {"error": str(e)}
+                failed += 1
+            out.write(json.dumps(dict(file=names[filename], **result), ensure_ascii=False) + "\n")
+            out.flush()
+            if n % 10 == 0 or n == len(todo):
+                elapsed = time.perf_counter() - start
+                logger.info("{}/{} files, {:.0f}s of audio, {:.1f}x real time".format(
+                    n, len(todo), audio_time, audio_time / max(elapsed, 1e-6)))
+
+    elapsed = time.perf_counter() - start
+    return {"files": len(todo),
+            "skipped": len(files) - len(todo),
+            "failed": failed,
+            "audio_time": round(audio_time, 2),
+            "wall_time": round(elapsed, 2),
+            "speed": round(audio_time / max(elapsed, 1e-6), 2)}
+
+
+def main() -> None:
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE)
+    default_model = os.path.join(os.path.dirname(CONFIG_FILE), "..",
+                                 config.get("vosk", "model_path", fallback="etc/model/vosk-model-small-de-0.15"))
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="WAV files or directories containing them")
+    parser.add_argument("--output", default="transcripts.jsonl", help="JSONL file the results are appended to")
+    parser.add_argument("--model", default=default_model, help="Path of the Vosk model")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--chunk-seconds", type=float, default=4.0, help="Seconds of audio per chunk")
+    parser.add_argument("--no-recursive", action="store_true", help="Do not descend into subdirectories")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
+    # Vosk is only needed here, the functions above work with any recognizer
+    from vosk import Model, KaldiRecognizer, SetLogLevel
+    SetLogLevel(-1)
+
+    files = find_files(args.paths, not args.no_recursive)
+    if not files:
+        sys.exit("No WAV files in {}".format(", ".join(args.paths)))
+    root = os.path.commonpath([os.path.abspath(path) for path in args.paths])
+    root = root if os.path.isdir(root) else os.path.dirname(root)
+
+    slot_bytes = int(args.chunk_seconds * 48000) * 2
+    pool = RecognitionPool(lambda: Model(args.model), lambda model, sample_rate, grammar: KaldiRecognizer(
+        model, sample_rate), args.processes, slots=4 * args.processes, slot_bytes=slot_bytes)
+    try:
+        summary = transcribe(pool, [os.path.abspath(filename) for filename in files], args.output, root,
+                             args.chunk_seconds)
+    finally:
+        pool.close()
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import io
+import os
+import time
+import wave
+import queue
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from typing import Callable, List, Optional
+
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Segment:
+    """
+    @brief A chunk of text and the PCM audio rendered for it, including the timings of the pipeline stages.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pcm = b""
+        self.sample_rate = 0
+        self.sample_width = 2
+        self.channels = 1
+
+        self.queued_at = time.time()
+        self.synth_started = 0.0
+        self.synth_time = 0.0
+        self.play_delay = 0.0
+        self.play_time = 0.0
+
+    @property
+    def duration(self) -> float:
+        if not self.sample_rate:
+            return 0.0
+        return len(self.pcm) / (self.sample_rate * self.sample_width * self.channels)
+
+    def load_wav(self, data: bytes) -> None:
+        """
+        @brief Sets the PCM data and format of the segment from an in-memory WAV file.
+
+        @param data: Content of a WAV file.
+        """
+        with wave.open(io.BytesIO(data), 'rb') as wf:
+            self.sample_rate = wf.getframerate()
+            self.sample_width = wf.getsampwidth()
+            self.channels = wf.getnchannels()
+            self.pcm = wf.readframes(wf.getnframes())
+
+    def timings(self) -> dict:
+        return {"text": self.text,
+                "synth_time": round(self.synth_time, 3),
+                "play_delay": round(self.play_delay, 3),
+                "play_time": round(self.play_time, 3),
+                "duration": round(self.duration, 3)}
+
+
+class EspeakRenderer:
+    """
+    @brief Renders text with the espeak command line tool into an in-memory WAV, no temporary files needed.
+    """
+
+    def __init__(self, voice: str, rate: int = 150, executable: str = "espeak"):
+        self.voice = voice
+        self.rate = rate
+        self.executable = executable
+
+    def render(self, segment: Segment) -> None:
+        result = subprocess.run([self.executable, "-v", str(self.voice), "-s", str(self.rate), "--stdout",
+                                 segment.text],
+                                capture_output=True, check=True)
+        segment.load_wav(result.stdout)
+
+
+class Pyttsx3Renderer:
+    """
+    @brief Renders text with pyttsx3 using save_to_file.
+
+    The engine must not be used by any other thread while the pipeline is running.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        handle, self.path = tempfile.mkstemp(suffix=".wav")
+        os.close(handle)
+
+    def __del__(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def render(self, segment: Segment) -> None:
+        self.engine.save_to_file(segment.text, self.path)
+        self.engine.runAndWait()
+        with open(self.path, 'rb') as wav_file:
+            segment.load_wav(wav_file.read())
+
+
+class TtsPipeline:
+    """
+    @brief Synthesizes text on a worker thread and plays the rendered segments on a second one.
+
+    While segment N is playing, segment N+1 is already being synthesized.
+    """
+
+    def __init__(self, renderer, player: Callable[[Segment], None], max_segments: int = 4):
+        """
+        @param renderer: Object providing render(segment), filling in the PCM data of the segment.
+        @param player: Callable playing the PCM data of a segment, blocking until playback is finished.
+        @param max_segments: Maximum number of rendered segments waiting for playback.
+        """
+        self.renderer = renderer
+        self.player = player
+        self.history: deque = deque(maxlen=50)
+
+        self._texts: queue.Queue = queue.Queue()
+        self._segments: queue.Queue = queue.Queue(maxsize=max_segments)
+        self._pending = 0
+        self._generation = 0
+        self._cond = threading.Condition()
+
+        self._synth_thread = threading.Thread(target=self._synthesize, name="tts-synth", daemon=True)
+        self._play_thread = threading.Thread(target=self._play, name="tts-play", daemon=True)
+        self._synth_thread.start()
+        self._play_thread.start()
+
+    def say(self, text: str) -> Segment:
+        """
+        @brief Queues text for synthesis and playback, returns immediately.
+
+        @param text: The text to speak.
+
+        @return The queued segment. Its timings are filled in while it passes the pipeline.
+        """
+        segment = Segment(text)
+        with self._cond:
+            self._pending += 1
+            self._texts.put((self._generation, segment))
+        return segment
+
+    def play(self, segment: Segment) -> Segment:
+        """
+        @brief Queues an already rendered segment for playback, in order with the queued texts.
+
+        @param segment: Segment with PCM data, e.g. from a cache.
+
+        @return The queued segment.
+        """
+        segment.queued_at = time.time()
+        with self._cond:
+            self._pending += 1
+            self._texts.put((self._generation, segment))
+        return segment
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        @brief Blocks until all queued segments have been played.
+
+        @return False if the timeout expired.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def is_busy(self) -> bool:
+        return self._pending > 0
+
+    def cancel(self) -> None:
+        """
+        @brief Discards all segments that are not yet playing.
+        """
+        with self._cond:
+            self._generation += 1
+            for pipe in (self._texts, self._segments):
+                closed = False
+                while True:
+                    try:
+                        item = pipe.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        closed = True
+                    else:
+                        self._pending -= 1
+                # the end of the pipeline after close() stays queued
+                if closed:
+                    pipe.put(None)
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        self.cancel()
+        self._texts.put(None)
+
+    def recent_timings(self) -> List[dict]:
+        return [segment.timings() for segment in self.history]
+
+    def _done(self) -> None:
+        with self._cond:
+            self._pending = max(0, self._pending - 1)
+            self._cond.notify_all()
+
+    def _synthesize(self) -> None:
+        while True:
+            item = self._texts.get()
+            if item is None:
+                self._segments.put(None)
+                return
+
+            generation, segment = item
+            start = time.time()
+            segment.synth_started = start
+            try:
+                if not segment.pcm:
+                    self.renderer.render(segment)
+            except Exception as e:
+                logger.error("Synthesis of '{}' failed: {}".format(segment.text, e))
+                Metrics.shared().inc("tts_errors")
+                self._done()
+                continue
+            segment.synth_time = time.time() - start
+
+            if generation != self._generation:
+                self._done()
+                continue
+            self._segments.put((generation, segment))
+
+    def _play(self) -> None:
+        while True:
+            item = self._segments.get()
+            if item is None:
+                return
+
+            generation, segment = item
+            if generation == self._generation:
+                start = time.time()
+                segment.play_delay = start - segment.queued_at
+                try:
+                    self.player(segment)
+                except Exception as e:
+                    logger.error("Playback of '{}' failed: {}".format(segment.text, e))
+                    Metrics.shared().inc("playback_errors")
+                segment.play_time = time.time() - start
+
+                self.history.append(segment)
+                logger.debug("TTS segment {}".format(segment.timings()))
+
+            self._done()
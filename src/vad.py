@@ -0,0 +1,159 @@
+import logging
+from collections import deque
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EnergyVad:
+    """
+    @brief Vectorized voice activity detection based on frame energy and zero-crossing rate.
+
+    A chunk is split into short frames. A frame counts as speech if its RMS is clearly above the
+    adaptive noise floor and its zero-crossing rate is not that of broadband noise.
+    The noise floor adapts during non-speech. Steady noise loud enough to count as speech, e.g. the
+    hum of a fan, would never be adapted to, so "speech" lasting longer than anybody speaks without
+    a pause becomes the new noise floor.
+    """
+
+    def __init__(self, sample_rate: int, frame_ms: int = 10, ratio: float = 3.0, min_rms: float = 150.0,
+                 max_zcr: float = 0.35, min_speech_frames: float = 0.2, max_speech: float = 20.0):
+        """
+        @param sample_rate: Sample rate of the 16 bit mono PCM data.
+        @param frame_ms: Length of an analysis frame in milliseconds.
+        @param ratio: Factor the frame RMS has to exceed the noise floor by.
+        @param min_rms: Absolute RMS a speech frame has to exceed.
+        @param max_zcr: Maximum zero-crossings per sample of a speech frame. White noise has about 0.5, sibilants
+                        above the limit are mostly covered by the hangover of the VadGate.
+        @param min_speech_frames: Fraction of speech frames needed for a chunk to count as speech.
+        @param max_speech: Seconds of continuous speech after which its level is taken as the noise floor.
+        """
+        self.sample_rate = sample_rate
+        self.frame_len = max(1, sample_rate * frame_ms // 1000)
+        self.ratio = ratio
+        self.min_rms = min_rms
+        self.max_zcr = max_zcr
+        self.min_speech_frames = min_speech_frames
+        self.max_speech = max_speech
+
+        self.noise_floor = min_rms
+        self.rms = 0.0
+        self.speech_time = 0.0
+
+    def is_speech(self, data: bytes) -> bool:
+        """
+        @brief Classifies a chunk of 16 bit mono PCM data.
+
+        @param data: Raw PCM bytes.
+
+        @return True if the chunk contains speech.
+        """
+        samples = np.frombuffer(data, dtype=np.int16)
+        num_frames = len(samples) // self.frame_len
+        if num_frames == 0:
+            return False
+
+        frames = samples[:num_frames * self.frame_len].reshape(num_frames, self.frame_len).astype(np.float32)
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        zcr = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+
+        threshold = max(self.noise_floor * self.ratio, self.min_rms)
+        speech_frames = (rms > threshold) & (zcr < self.max_zcr)
+        speech = np.mean(speech_frames) >= self.min_speech_frames
+
+        self.rms = float(np.median(rms))
+        if speech:
+            self.speech_time += len(samples) / self.sample_rate
+            if self.speech_time > self.max_speech:
+                logger.info("{:.0f}s of continuous speech, taking RMS {:.0f} as the noise floor".format(
+                    self.speech_time, self.rms))
+                self.noise_floor = max(self.rms, self.noise_floor)
+                self.speech_time = 0.0
+        else:
+            self.speech_time = 0.0
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * max(self.rms, 1.0)
+
+        return bool(speech)
+
+
+class VadGate:
+    """
+    @brief Passes only speech segments on to the recognizer.
+
+    Chunks preceding the speech onset are kept in a pre-roll buffer and passed together with the first
+    speech chunk, so the beginning of a word is not cut off. After speech ends, the gate stays open for
+    a hangover time so the recognizer sees the trailing silence it needs for endpointing.
+    """
+
+    def __init__(self, sample_rate: int, chunk_size: int, pre_roll: float = 0.3, hangover: float = 0.6, **kwargs):
+        """
+        @param sample_rate: Sample rate of the 16 bit mono PCM data.
+        @param chunk_size: Number of frames per chunk.
+        @param pre_roll: Seconds of audio passed before the speech onset.
+        @param hangover: Seconds of non-speech audio passed after the speech.
+        @param kwargs: Parameters of the EnergyVad.
+        """
+        self.vad = EnergyVad(sample_rate, **kwargs)
+        self.hangover_chunks = max(1, round(hangover * sample_rate / chunk_size))
+        self.pre_roll: deque = deque(maxlen=max(1, round(pre_roll * sample_rate / chunk_size)))
+
+        self.is_open = False
+        self.speech = False
+        self._hangover = 0
+
+        self.total_chunks = 0
+        self.passed_chunks = 0
+
+    @property
+    def gated_fraction(self) -> float:
+        """
+        @brief Fraction of the audio that has been kept away from the recognizer.
+        """
+        if not self.total_chunks:
+            return 0.0
+        return 1.0 - min(self.passed_chunks, self.total_chunks) / self.total_chunks
+
+    def process(self, data: bytes) -> List[bytes]:
+        """
+        @brief Classifies a chunk and returns the chunks to be passed to the recognizer.
+
+        @param data: Raw PCM bytes.
+
+        @return List of chunks, empty while there is no speech.
+        """
+        self.total_chunks += 1
+        self.speech = self.vad.is_speech(data)
+
+        if self.speech:
+            self._hangover = self.hangover_chunks
+            if not self.is_open:
+                self.is_open = True
+                chunks = list(self.pre_roll) + [data]
+                self.pre_roll.clear()
+                self.passed_chunks += len(chunks)
+                return chunks
+
+        elif self.is_open:
+            self._hangover -= 1
+            if self._hangover <= 0:
+                self.is_open = False
+
+        if self.is_open:
+            self.passed_chunks += 1
+            return [data]
+
+        self.pre_roll.append(data)
+        return []
+
+    def reset(self) -> None:
+        self.is_open = False
+        self._hangover = 0
+        self.pre_roll.clear()
+
+    def stats(self) -> dict:
+        return {"total_chunks": self.total_chunks,
+                "passed_chunks": self.passed_chunks,
+                "gated_fraction": round(self.gated_fraction, 3),
+                "noise_floor": round(self.vad.noise_floor, 1)}
@@ -0,0 +1,54 @@
+import time
+import wave
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WavStream:
+    """
+    @brief File backed stand-in for a PyAudio input stream, used to feed recorded audio to SttHandler.
+    """
+
+    def __init__(self, filename: str, realtime: bool = False):
+        """
+        @param filename: Path to a 16 bit mono WAV file.
+        @param realtime: Deliver the audio not faster than a microphone would.
+        """
+        self.wf = wave.open(filename, 'rb')
+        if self.wf.getsampwidth() != 2 or self.wf.getnchannels() != 1:
+            raise ValueError("{} is not a 16 bit mono WAV file".format(filename))
+
+        self.sample_rate = self.wf.getframerate()
+        self.num_frames = self.wf.getnframes()
+        self.duration = self.num_frames / self.sample_rate
+        self.realtime = realtime
+        self.frames_read = 0
+        self._start = None
+
+    @property
+    def position(self) -> float:
+        """
+        @brief Time in seconds of the audio delivered so far.
+        """
+        return self.frames_read / self.sample_rate
+
+    def read(self, num_frames: int, exception_on_overflow: bool = True) -> bytes:
+        if self._start is None:
+            self._start = time.time()
+
+        data = self.wf.readframes(num_frames)
+        self.frames_read += len(data) // 2
+
+        if self.realtime:
+            delay = self._start + self.position - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        return data
+
+    def stop_stream(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.wf.close()
@@ -0,0 +1,98 @@
+"""
+Benchmark of the logging cost in the audio loop.
+
+Logs a partial result for every chunk, like the wake word loop, and measures the time the logging
+call takes per chunk. "before" writes synchronously to a log file like the former basicConfig,
+"after" uses setup_logging with the queue listener and the rate limited partial logger.
+Disk stalls of the SD card are simulated by a handler sleeping every n records.
+
+Example: python bench_logging.py --chunks 2000 --stall-ms 50 --stall-every 100
+"""
+import argparse
+import logging
+import tempfile
+import time
+import sys
+import os
+
+sys.path.append("../src")
+
+from logsetup import setup_logging, RateLimitFilter, LOG_FORMAT
+
+CHUNK_TIME = 2048 / 16000
+
+
+def add_stalls(handler: logging.Handler, stall_ms: float, stall_every: int) -> None:
+    emit = handler.emit
+    count = [0]
+
+    def stalling_emit(record):
+        count[0] += 1
+        if stall_every and count[0] % stall_every == 0:
+            time.sleep(stall_ms / 1000)
+        emit(record)
+
+    handler.emit = stalling_emit
+
+
+def run_loop(log, chunks: int) -> list:
+    durations = []
+    for n in range(chunks):
+        text = "hey comp" if n % 2 else "hey computer"
+        start = time.perf_counter()
+        log(text)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def before(path: str, args) -> list:
+    root = logging.getLogger()
+    handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    add_stalls(handler, args.stall_ms, args.stall_every)
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    logger = logging.getLogger("bench.before")
+    try:
+        return run_loop(lambda text: logger.debug("Partial: '{}'".format(text)), args.chunks)
+    finally:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def after(path: str, args) -> list:
+    listener = setup_logging(path, "DEBUG")
+    for handler in listener.handlers:
+        add_stalls(handler, args.stall_ms, args.stall_every)
+    logger = logging.getLogger("bench.after.partial")
+    logger.addFilter(RateLimitFilter(0.5))
+    try:
+        return run_loop(lambda text: logger.debug("Partial: '%s'", text), args.chunks)
+    finally:
+        listener.stop()
+
+
+def summarize(name: str, durations: list) -> dict:
+    durations = sorted(durations)
+    return {"mode": name,
+            "chunks": len(durations),
+            "mean_us": round(sum(durations) / len(durations) * 1e6, 1),
+            "p99_us": round(durations[int(0.99 * (len(durations) - 1))] * 1e6, 1),
+            "max_ms": round(durations[-1] * 1e3, 2),
+            "chunks_over_budget": sum(1 for duration in durations if duration > CHUNK_TIME / 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000, help="Number of chunks logged")
+    parser.add_argument("--stall-ms", type=float, default=50.0, help="Duration of a simulated disk stall")
+    parser.add_argument("--stall-every", type=int, default=100, help="Records between two stalls, 0 for none")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, mode in (("before", before), ("after", after)):
+            print(summarize(name, mode(os.path.join(directory, name + ".log"), args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark of the capture path resampler.
+
+Measures the CPU time Resampler.process needs per chunk for typical microphone rates
+and chunk sizes, relative to the duration of the chunk.
+
+Example: python bench_resample.py --rate-out 16000 --chunk-size 1024 2048 4096
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+sys.path.append("../src")
+
+from resample import Resampler
+
+
+def bench(rate_in: int, rate_out: int, chunk_size: int, taps: int, seconds: float) -> dict:
+    resampler = Resampler(rate_in, rate_out, taps)
+    rng = np.random.default_rng(0)
+    num_chunks = max(1, int(seconds * rate_in / chunk_size))
+    chunks = [rng.integers(-3000, 3000, chunk_size, dtype=np.int16).tobytes() for _ in range(num_chunks)]
+
+    durations = []
+    for chunk in chunks:
+        start = time.perf_counter()
+        resampler.process(chunk)
+        durations.append(time.perf_counter() - start)
+
+    durations.sort()
+    chunk_time = chunk_size / rate_in
+    return {"rate_in": rate_in,
+            "rate_out": rate_out,
+            "chunk_size": chunk_size,
+            "taps": resampler.taps,
+            "mean_us": round(sum(durations) / len(durations) * 1e6, 1),
+            "p99_us": round(durations[int(0.99 * (len(durations) - 1))] * 1e6, 1),
+            "cpu_load": "{:.2%}".format(sum(durations) / len(durations) / chunk_time)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate-in", type=int, nargs="+", default=[22050, 44100, 48000])
+    parser.add_argument("--rate-out", type=int, default=16000)
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[1024, 2048, 4096])
+    parser.add_argument("--taps", type=int, nargs="+", default=[16])
+    parser.add_argument("--seconds", type=float, default=20.0, help="Audio time per configuration")
+    args = parser.parse_args()
+
+    for rate_in in args.rate_in:
+        for chunk_size in args.chunk_size:
+            for taps in args.taps:
+                print(bench(rate_in, args.rate_out, chunk_size, taps, args.seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Offline benchmark of the STT pipeline.
+
+Feeds a corpus of 16 bit mono WAV files through SttHandler using a WavStream and reports
+real-time factor, per-chunk decode latency, wake word detection latency, WER and peak RSS.
+With --sample-rate, the files are resampled to the given rates on the capture path.
+A reference transcript for <name>.wav is read from <name>.txt if present.
+With --processes, all files are transcribed at the same time on a RecognitionPool of each size,
+reporting the throughput and its scaling with the number of worker processes.
+
+Example: python bench_stt.py ../etc/corpus --chunk-size 1024 2048 4096 --trigger "hey computer"
+         python bench_stt.py ../etc/corpus --processes 1 2 4
+"""
+import argparse
+import configparser
+import json
+import glob
+import os
+import resource
+import sys
+import time
+import threading
+from typing import List
+
+sys.path.append("../src")
+
+import stt
+from wavstream import WavStream
+from recognitionpool import RecognitionPool
+from vosk import Model, KaldiRecognizer, SetLogLevel
+
+
+class TimedRecognizer:
+    """
+    @brief Wraps a KaldiRecognizer and records the duration of every AcceptWaveform call.
+    """
+
+    def __init__(self, recognizer: KaldiRecognizer):
+        self.recognizer = recognizer
+        self.latencies: List[float] = []
+
+    def AcceptWaveform(self, data: bytes) -> bool:
+        start = time.perf_counter()
+        result = self.recognizer.AcceptWaveform(data)
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.recognizer, name)
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """
+    @brief Word level Levenshtein distance divided by the number of reference words.
+    """
+    ref = reference.lower().split()
+    hyp = hypothesis.lower().split()
+    distance = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, distance[0] = distance[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, distance[j] = distance[j], min(distance[j] + 1, distance[j - 1] + 1,
+                                                     previous + (ref_word != hyp_word))
+    return distance[len(hyp)] / max(1, len(ref))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def transcribe_file(model, filename: str, chunk_size: int, sample_rate: int, trigger: str,
+                    use_vad: bool) -> dict:
+    stream = WavStream(filename)
+    sample_rate = sample_rate or stream.sample_rate
+    handler = stt.SttHandler(use_vad, stream=stream, chunk_size=chunk_size, sample_rate=sample_rate,
+                             lossless=True)
+    recognizer = TimedRecognizer(stt.create_recognizer(model, sample_rate))
+    result = {"file": os.path.basename(filename), "chunk_size": chunk_size, "sample_rate": sample_rate,
+              "duration": stream.duration}
+
+    start = time.perf_counter()
+    latencies = []
+    if trigger:
+        wake_recognizer = TimedRecognizer(stt.create_wake_word_recognizer(model, [trigger], sample_rate))
+        result["wake_word"] = handler.wait_for_wake_word(wake_recognizer, [trigger]) == trigger
+        result["wake_word_latency"] = handler.wake_word_latency
+        result["wake_word_position"] = stream.position
+        latencies += wake_recognizer.latencies
+
+    texts = []
+    while handler.capture.is_alive() or len(handler.buffer) or handler._replay:
+        text = handler.speech_to_text(recognizer)
+        if text:
+            texts.append(text)
+    texts.append(json.loads(recognizer.FinalResult())["text"])
+
+    result["processing_time"] = time.perf_counter() - start
+    result["rtf"] = result["processing_time"] / max(stream.duration, 1e-6)
+    result["hypothesis"] = " ".join(text for text in texts if text)
+    latencies += recognizer.latencies
+    result["chunk_latencies"] = latencies
+
+    reference_file = os.path.splitext(filename)[0] + ".txt"
+    if os.path.exists(reference_file):
+        with open(reference_file, 'r', encoding='utf-8') as ref:
+            result["reference"] = ref.readline().strip()
+        result["wer"] = word_error_rate(result["reference"], result["hypothesis"])
+
+    del handler
+    return result
+
+
+def summarize(results: List[dict]) -> dict:
+    latencies = [latency for result in results for latency in result.pop("chunk_latencies")]
+    audio_time = sum(result["duration"] for result in results)
+    wer = [result["wer"] for result in results if "wer" in result]
+    wake = [result["wake_word_latency"] for result in results if result.get("wake_word")]
+    return {"files": len(results),
+            "audio_time": round(audio_time, 2),
+            "rtf": round(sum(result["processing_time"] for result in results) / max(audio_time, 1e-6), 4),
+            "chunk_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "chunk_p90_ms": round(percentile(latencies, 90) * 1000, 2),
+            "chunk_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "wake_word_detected": "{}/{}".format(len(wake), len(results)) if "wake_word" in results[0] else "-",
+            "wake_word_latency_ms": round(sum(wake) / len(wake) * 1000, 1) if wake else None,
+            "wer": round(sum(wer) / len(wer), 4) if wer else None,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def bench_pool(args, files: List[str], processes: int, chunk_size: int) -> dict:
+    """
+    @brief Transcribes all files at the same time on a pool of worker processes.
+    """
+    pool = RecognitionPool(lambda: Model(args.model), stt.create_recognizer, processes)
+    results = [None] * len(files)
+
+    def transcribe(n):
+        results[n] = transcribe_file(pool, files[n], chunk_size, args.sample_rate[0], args.trigger, not args.no_vad)
+
+    try:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=transcribe, args=(n,)) for n in range(len(files))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - start
+    finally:
+        pool.close()
+
+    summary = summarize(results)
+    summary.update({"processes": processes,
+                    "wall_time": round(wall_time, 2),
+                    "throughput": round(summary["audio_time"] / wall_time, 2),
+                    "worker_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)})
+    return summary
+
+
+def main() -> None:
+    config = configparser.ConfigParser()
+    config.read(stt.CONFIG_FILE)
+    default_model = stt.resource_path(config.get("vosk", "model_path",
+                                                 fallback="etc/model/vosk-model-small-de-0.15"))
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", help="Directory containing WAV files and optional .txt references")
+    parser.add_argument("--model", default=default_model, help="Path of the Vosk model")
+    parser.add_argument("--chunk-size", type=int, nargs="+", default=[stt.SttHandler.CHUNK_SIZE])
+    parser.add_argument("--sample-rate", type=int, nargs="+", default=[0],
+                        help="Recognizer sample rates, 0 for the rate of the files")
+    parser.add_argument("--trigger", default="", help="Trigger phrase each file starts with")
+    parser.add_argument("--no-vad", action="store_true", help="Disable the VAD gate")
+    parser.add_argument("--processes", type=int, nargs="+",
+                        help="Sizes of the recognition pools to compare, transcribing all files concurrently")
+    parser.add_argument("--json", help="Write the per-file results to this file")
+    args = parser.parse_args()
+
+    SetLogLevel(-1)
+    files = sorted(glob.glob(os.path.join(args.corpus, "*.wav")))
+    if not files:
+        sys.exit("No WAV files in {}".format(args.corpus))
+
+    if args.processes:
+        baseline = None
+        for processes in args.processes:
+            summary = bench_pool(args, files, processes, args.chunk_size[0])
+            baseline = baseline or summary["throughput"] / processes
+            summary["scaling_per_core"] = round(summary["throughput"] / processes / baseline, 2)
+            print(summary)
+        return
+
+    load_start = time.perf_counter()
+    model = Model(args.model)
+    print("Model loaded in {:.2f}s".format(time.perf_counter() - load_start))
+
+    all_results = []
+    for sample_rate in args.sample_rate:
+        for chunk_size in args.chunk_size:
+            results = [transcribe_file(model, filename, chunk_size, sample_rate, args.trigger, not args.no_vad)
+                       for filename in files]
+            print("sample_rate={}, chunk_size={}: {}".format(sample_rate or "file", chunk_size, summarize(results)))
+            all_results += results
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as out:
+            json.dump(all_results, out, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
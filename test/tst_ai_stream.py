@@ -0,0 +1,115 @@
+import unittest
+import json
+import logging
+import threading
+import time
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append("../src")
+
+import stt
+
+TOKENS = ["Martin ", "Luther ", "lebte ", "von 1483 ", "bis 1546.", " Er ", "wurde ", "am 10. ", "November ",
+          "geboren."]
+TOKEN_DELAY = 0.1
+# the tokens the client needs to complete the first sentence, including the whitespace after it
+FIRST_SENTENCE_TOKENS = 6
+# the client reads the stream in blocks of 512 bytes, each event fills whole blocks so none waits for the next
+EVENT_BYTES = 1024
+
+
+def event(data: str) -> bytes:
+    """
+    @brief A server-sent event padded to EVENT_BYTES by a comment line.
+    """
+    data = "data: {}\n\n".format(data).encode()
+    return b": " + b" " * (EVENT_BYTES - len(data) - 3) + b"\n" + data
+
+
+class FakeCompletionHandler(BaseHTTPRequestHandler):
+    """
+    @brief Minimal stand-in for the OpenAI chat completion endpoint, streaming TOKENS as server-sent events.
+
+    The rest of the reply is only sent once the client has yielded the first sentence, or after a timeout.
+    """
+    requests = []
+    first_sentence = threading.Event()
+    first_sentence_in_time = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        FakeCompletionHandler.requests.append(body)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        for n, token in enumerate(TOKENS):
+            if n == FIRST_SENTENCE_TOKENS:
+                FakeCompletionHandler.first_sentence_in_time = FakeCompletionHandler.first_sentence.wait(5)
+            chunk = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0,
+                     "model": body["model"],
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            self.wfile.write(event(json.dumps(chunk)))
+            self.wfile.flush()
+            time.sleep(TOKEN_DELAY)
+
+        self.wfile.write(event("[DONE]"))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AskAiStreamTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+        FakeCompletionHandler.requests.clear()
+        FakeCompletionHandler.first_sentence.clear()
+        FakeCompletionHandler.first_sentence_in_time = None
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCompletionHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.ask_ai = stt.AskAi("sk-test", "http://127.0.0.1:{}/v1".format(self.server.server_port))
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_split_sentences(self):
+        self.logger.info("\n\n### test_split_sentences ###")
+        sentences = list(stt.split_sentences(list("Ja. Das war am 3. Mai 2023. Danach nicht mehr!\nEnde")))
+        self.assertEqual(["Ja. Das war am 3. Mai 2023.", "Danach nicht mehr! Ende"], sentences)
+
+    def test_stream_sentences(self):
+        self.logger.info("\n\n### test_stream_sentences ###")
+        start = time.time()
+        sentences = []
+        first_sentence_time = None
+        for sentence in self.ask_ai.ask_ai_stream("Wann und wo lebte Martin Luther?"):
+            first_sentence_time = first_sentence_time or time.time() - start
+            FakeCompletionHandler.first_sentence.set()
+            sentences.append(sentence)
+
+        total_time = time.time() - start
+        self.logger.info(f"AI: {sentences}, first sentence after {first_sentence_time:.2f}s of {total_time:.2f}s")
+
+        self.assertEqual(["Martin Luther lebte von 1483 bis 1546.", "Er wurde am 10. November geboren."], sentences)
+        # the first sentence was yielded before the server sent the rest of the reply
+        self.assertTrue(FakeCompletionHandler.first_sentence_in_time)
+        self.assertTrue(FakeCompletionHandler.requests[0]["stream"])
+
+    def test_stream_history(self):
+        self.logger.info("\n\n### test_stream_history ###")
+        FakeCompletionHandler.first_sentence.set()
+        list(self.ask_ai.ask_ai_stream("Wann und wo lebte Martin Luther?"))
+
+        self.assertEqual(2, len(self.ask_ai.msg_history))
+        self.assertEqual("assistant", self.ask_ai.msg_history[1]["role"])
+        self.assertTrue(self.ask_ai.msg_history[1]["content"].endswith("geboren."))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import io
+import logging
+import threading
+import time
+import wave
+import sys
+
+import requests
+
+sys.path.append("../src")
+
+import audioserver
+from ttspipeline import Segment
+
+
+class AudioServerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.server = audioserver.AudioServer("127.0.0.1", max_bytes=100000, advertised_host="127.0.0.1").start()
+
+    def tearDown(self) -> None:
+        self.server.close()
+
+    def test_publish(self):
+        self.logger.info("\n\n### test_publish ###")
+        segment = Segment("Hallo")
+        segment.sample_rate = 16000
+        segment.pcm = bytes(range(256)) * 10
+        url = self.server.publish(segment)
+
+        response = requests.get(url, timeout=2)
+        self.assertEqual(200, response.status_code)
+        with wave.open(io.BytesIO(response.content), 'rb') as wf:
+            self.assertEqual(16000, wf.getframerate())
+            self.assertEqual(segment.pcm, wf.readframes(wf.getnframes()))
+
+    def test_streaming(self):
+        self.logger.info("\n\n### test_streaming ###")
+        clip = self.server.create_clip(16000)
+        clip.append(b"\x01\x00" * 100)
+
+        def synthesize():
+            time.sleep(0.5)
+            clip.append(b"\x02\x00" * 100)
+            clip.finish()
+
+        threading.Thread(target=synthesize, daemon=True).start()
+
+        start = time.time()
+        response = requests.get(self.server.url(clip), stream=True, timeout=2)
+        chunks = response.iter_content(chunk_size=None)
+        first = next(chunks)
+        first_time = time.time() - start
+        data = first + b"".join(chunks)
+
+        self.assertEqual("chunked", response.headers["Transfer-Encoding"])
+        self.assertLess(first_time, 0.4)
+        self.assertEqual(44 + 400, len(data))
+        self.assertEqual(b"\x02\x00" * 100, data[-200:])
+
+    def test_eviction(self):
+        self.logger.info("\n\n### test_eviction ###")
+        segment = Segment("Hallo")
+        segment.sample_rate = 16000
+        segment.pcm = bytes(40000)
+        urls = [self.server.publish(segment) for _ in range(2)]
+        requests.get(urls[0], timeout=2)
+        self.server.publish(segment)
+
+        self.assertLessEqual(self.server.memory(), self.server.max_bytes)
+        self.assertEqual(200, requests.get(urls[0], timeout=2).status_code)
+        self.assertEqual(404, requests.get(urls[1], timeout=2).status_code)
+
+    def test_missing(self):
+        self.assertEqual(404, requests.get("http://127.0.0.1:{}/clips/x.wav".format(self.server.server_port),
+                                           timeout=2).status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
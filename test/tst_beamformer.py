@@ -0,0 +1,68 @@
+import unittest
+import logging
+import sys
+
+import numpy as np
+
+sys.path.append("../src")
+
+from beamformer import Beamformer, SPEED_OF_SOUND
+
+SAMPLE_RATE = 16000
+CHANNELS = 8
+RADIUS = 0.0463
+CHUNK_FRAMES = 1024
+
+
+def record(angle: float, chunks: int = 8) -> bytes:
+    """
+    Noise from the given direction as received by the 6 microphones of the array, as interleaved
+    8 channel PCM with the 2 loopback channels silent.
+    """
+    num_frames = chunks * CHUNK_FRAMES
+    noise = np.random.default_rng(1).normal(0, 3000, num_frames)
+    spectrum = np.fft.rfft(noise)
+    freqs = np.fft.rfftfreq(num_frames, 1.0 / SAMPLE_RATE)
+    frames = np.zeros((num_frames, CHANNELS))
+    for m in range(6):
+        arrival = -RADIUS / SPEED_OF_SOUND * np.cos(np.radians(angle - 60.0 * m))
+        frames[:, m] = np.fft.irfft(spectrum * np.exp(-2j * np.pi * freqs * arrival), n=num_frames)
+    return np.clip(np.rint(frames), -32768, 32767).astype(np.int16).tobytes()
+
+
+class BeamformerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def process(self, beamformer: Beamformer, data: bytes) -> bytes:
+        chunk_bytes = CHUNK_FRAMES * CHANNELS * 2
+        return b"".join(beamformer.process(data[n:n + chunk_bytes]) for n in range(0, len(data), chunk_bytes))
+
+    def test_direction(self):
+        self.logger.info("\n\n### test_direction ###")
+        for angle in (0, 60, 135, 270):
+            beamformer = Beamformer(SAMPLE_RATE, CHANNELS, radius=RADIUS)
+            data = self.process(beamformer, record(angle))
+            self.assertEqual(angle, beamformer.doa)
+            self.assertEqual(len(data), len(record(angle)) // CHANNELS)
+        self.assertLess(beamformer.stats()["cpu_load"], 1.0)
+
+    def test_mic_channels(self):
+        self.logger.info("\n\n### test_mic_channels ###")
+        # the microphones on other channels than the first ones
+        data = np.frombuffer(record(135), dtype=np.int16).reshape(-1, CHANNELS)
+        shifted = np.roll(data, 2, axis=1).tobytes()
+        beamformer = Beamformer(SAMPLE_RATE, CHANNELS, mic_channels=range(2, 8), radius=RADIUS)
+        self.process(beamformer, shifted)
+        self.assertEqual(135, beamformer.doa)
+
+        # not adjacent
+        order = [0, 6, 1, 7, 2, 3, 4, 5]
+        beamformer = Beamformer(SAMPLE_RATE, CHANNELS, mic_channels=[order.index(m) for m in range(6)], radius=RADIUS)
+        self.process(beamformer, data[:, order].tobytes())
+        self.assertEqual(135, beamformer.doa)
+
+
+if __name__ == '__main__':
+    unittest.main()
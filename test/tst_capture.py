@@ -0,0 +1,126 @@
+import unittest
+import threading
+import logging
+import time
+import sys
+
+sys.path.append("../src")
+
+from capture import AudioRingBuffer, FedAudio
+
+SAMPLE_RATE = 16000
+CHUNK_BYTES = 640
+
+
+def chunk(n: int) -> bytes:
+    """
+    20 ms of "audio", every sample being the chunk number.
+    """
+    return n.to_bytes(2, "little") * (CHUNK_BYTES // 2)
+
+
+def position(seconds: float) -> int:
+    return int(seconds * SAMPLE_RATE) * 2
+
+
+class CaptureTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def test_ring_buffer_wraparound(self):
+        self.logger.info("\n\n### test_ring_buffer_wraparound ###")
+        ring = AudioRingBuffer(CHUNK_BYTES * 4)
+        for n in range(3):
+            ring.write(chunk(n))
+        self.assertEqual(chunk(0) + chunk(1), ring.read(CHUNK_BYTES * 2))
+        # the next writes wrap around the end of the buffer
+        ring.write(chunk(3) + chunk(4))
+        self.assertEqual(3 * CHUNK_BYTES, len(ring))
+        self.assertEqual(chunk(2) + chunk(3) + chunk(4), ring.read(CHUNK_BYTES * 3))
+        self.assertEqual(0, ring.stats()["overflow_count"])
+        self.assertEqual(CHUNK_BYTES * 3, ring.high_water_mark)
+
+    def test_ring_buffer_overflow(self):
+        self.logger.info("\n\n### test_ring_buffer_overflow ###")
+        ring = AudioRingBuffer(CHUNK_BYTES * 4)
+        for n in range(6):
+            ring.write(chunk(n))
+        # the oldest audio is dropped
+        self.assertEqual({"fill": CHUNK_BYTES * 4, "capacity": CHUNK_BYTES * 4, "high_water_mark": CHUNK_BYTES * 4,
+                          "overflow_count": 2, "overflow_bytes": CHUNK_BYTES * 2}, ring.stats())
+        self.assertEqual(b"".join(chunk(n) for n in range(2, 6)), ring.read(CHUNK_BYTES * 4))
+
+        # a write larger than the buffer keeps its end
+        ring.write(b"".join(chunk(n) for n in range(10, 16)))
+        self.assertEqual(3, ring.overflow_count)
+        self.assertEqual(b"".join(chunk(n) for n in range(12, 16)), ring.read(CHUNK_BYTES * 4))
+
+        # a read times out with what is there
+        ring.write(chunk(20))
+        self.assertEqual(chunk(20), ring.read(CHUNK_BYTES * 2, timeout=0.05))
+
+    def test_ring_buffer_blocking(self):
+        self.logger.info("\n\n### test_ring_buffer_blocking ###")
+        ring = AudioRingBuffer(CHUNK_BYTES * 4)
+        for n in range(4):
+            ring.write(chunk(n))
+        written = []
+
+        def write(n):
+            ring.write(chunk(n), block=True)
+            written.append(n)
+
+        # a read frees the space a waiting writer needs, nothing is lost
+        writer = threading.Thread(target=write, args=(4,), daemon=True)
+        writer.start()
+        time.sleep(0.1)
+        self.assertEqual([], written)
+        self.assertEqual(chunk(0), ring.read(CHUNK_BYTES))
+        writer.join(1)
+        self.assertEqual([4], written)
+        self.assertEqual(0, ring.overflow_count)
+        self.assertEqual(b"".join(chunk(n) for n in range(1, 5)), ring.read(CHUNK_BYTES * 4))
+
+        # so does clearing the buffer
+        for n in range(4):
+            ring.write(chunk(n))
+        writer = threading.Thread(target=write, args=(5,), daemon=True)
+        writer.start()
+        time.sleep(0.1)
+        self.assertEqual([4], written)
+        ring.clear()
+        writer.join(1)
+        self.assertEqual([4, 5], written)
+        self.assertEqual(chunk(5), ring.read(CHUNK_BYTES))
+
+    def test_fed_audio(self):
+        self.logger.info("\n\n### test_fed_audio ###")
+        fed = FedAudio(CHUNK_BYTES * 64)
+        for n in range(50):
+            fed.append(chunk(n))
+        # the wake word ends at 0.8s, in the middle of nothing but chunk 40
+        self.assertEqual(b"".join(chunk(n) for n in range(40, 50)), fed.take_after(position(0.8)))
+
+        # the word times of the second wake word continue to count from the creation of the recognizer
+        for n in range(50, 150):
+            fed.append(chunk(n))
+        self.assertEqual(position(3.0), fed.fed_bytes)
+        self.assertEqual(b"".join(chunk(n) for n in range(125, 150)), fed.take_after(position(2.5)))
+
+        # a word end between two samples of a chunk
+        for n in range(150, 160):
+            fed.append(chunk(n))
+        self.assertEqual(chunk(158)[CHUNK_BYTES // 2:] + chunk(159), fed.take_after(position(3.17)))
+
+    def test_fed_audio_capacity(self):
+        self.logger.info("\n\n### test_fed_audio_capacity ###")
+        fed = FedAudio(CHUNK_BYTES * 4)
+        for n in range(10):
+            fed.append(chunk(n))
+        # only the most recent audio is kept
+        self.assertEqual(b"".join(chunk(n) for n in range(6, 10)), fed.take_after(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
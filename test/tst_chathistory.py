@@ -0,0 +1,114 @@
+import unittest
+import logging
+import threading
+import time
+import sys
+
+sys.path.append("../src")
+
+from chathistory import ChatHistory, MESSAGE_OVERHEAD
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+class ChatHistoryTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def add_turns(self, history: ChatHistory, turns: int) -> None:
+        for n in range(turns):
+            history.append({"role": "user", "content": "Frage {} eins zwei drei".format(n)})
+            history.append({"role": "assistant", "content": "Antwort {} eins zwei drei".format(n)})
+
+    def test_budget(self):
+        self.logger.info("\n\n### test_budget ###")
+        history = ChatHistory(10 * (5 + MESSAGE_OVERHEAD), count_tokens=count_words)
+        self.add_turns(history, 20)
+
+        self.assertLessEqual(history.tokens, history.max_tokens)
+        self.assertEqual(10, len(history))
+        self.assertEqual("user", history[0]["role"])
+        self.assertEqual("Antwort 19 eins zwei drei", history[-1]["content"])
+        self.assertEqual(sum(count_words(m["content"]) + MESSAGE_OVERHEAD for m in history), history.tokens)
+
+    def test_keeps_latest(self):
+        self.logger.info("\n\n### test_keeps_latest ###")
+        history = ChatHistory(5, count_tokens=count_words)
+        history.append({"role": "user", "content": "eine sehr lange Frage die das Budget sprengt"})
+
+        self.assertEqual(1, len(history.messages()))
+
+    def test_summary(self):
+        self.logger.info("\n\n### test_summary ###")
+        summarized = []
+
+        def summarize(summary, messages):
+            summarized.extend(messages)
+            return "Zusammenfassung"
+
+        history = ChatHistory(6 * (5 + MESSAGE_OVERHEAD), summarize, count_tokens=count_words)
+        self.add_turns(history, 4)
+        time.sleep(0.1)
+
+        messages = history.messages()
+        self.assertEqual("system", messages[0]["role"])
+        self.assertIn("Zusammenfassung", messages[0]["content"])
+        self.assertEqual("Frage 0 eins zwei drei", summarized[0]["content"])
+        self.assertLessEqual(history.tokens, history.max_tokens)
+
+    def test_summary_running(self):
+        self.logger.info("\n\n### test_summary_running ###")
+        release = threading.Event()
+        calls = []
+
+        def summarize(summary, messages):
+            calls.append((summary, [message["content"] for message in messages]))
+            release.wait(2)
+            return "Zusammenfassung {}".format(len(calls))
+
+        history = ChatHistory(4 * (5 + MESSAGE_OVERHEAD), summarize, count_tokens=count_words)
+        self.add_turns(history, 3)
+        # evicted while the first summary is running
+        self.add_turns(history, 1)
+        release.set()
+        time.sleep(0.2)
+
+        self.assertEqual(2, len(calls))
+        self.assertEqual(("", ["Frage 0 eins zwei drei", "Antwort 0 eins zwei drei"]), calls[0])
+        self.assertEqual("Zusammenfassung 1", calls[1][0])
+        self.assertEqual(["Frage 1 eins zwei drei", "Antwort 1 eins zwei drei"], calls[1][1][:2])
+        self.assertIn("Zusammenfassung 2", history.messages()[0]["content"])
+
+    def test_summary_after_clear(self):
+        self.logger.info("\n\n### test_summary_after_clear ###")
+        release = threading.Event()
+
+        def summarize(summary, messages):
+            release.wait(2)
+            return "Zusammenfassung"
+
+        history = ChatHistory(4 * (5 + MESSAGE_OVERHEAD), summarize, count_tokens=count_words)
+        self.add_turns(history, 3)
+        history.clear()
+        release.set()
+        time.sleep(0.2)
+
+        # the summary of the previous conversation does not leak into the next one
+        self.assertEqual("", history.summary)
+        history.append({"role": "user", "content": "Neue Frage"})
+        self.assertEqual([{"role": "user", "content": "Neue Frage"}], history.messages())
+
+    def test_clear(self):
+        history = ChatHistory(count_tokens=count_words)
+        self.add_turns(history, 2)
+        history.clear()
+
+        self.assertEqual([], history.messages())
+        self.assertEqual(0, history.tokens)
+
+
+if __name__ == '__main__':
+    unittest.main()
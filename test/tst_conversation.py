@@ -0,0 +1,289 @@
+import unittest
+import asyncio
+import logging
+import json
+import tempfile
+import time
+import sys
+import os
+
+sys.path.append("../src")
+
+from conversation import Conversation, State
+from startup import Startup
+from metrics import Metrics
+from recorder import SessionRecorder, SessionReader
+from ttspipeline import TtsPipeline, Segment
+
+CHUNK_TIME = 0.02
+CHUNK_BYTES = int(16000 * CHUNK_TIME) * 2
+SILENCE = b""
+
+
+class FakeStt:
+    """
+    Plays a script of "audio" chunks, each chunk being the text spoken in it padded to 20 ms.
+    """
+    sample_rate = 16000
+    sample_width = 2
+    vad = None
+    beamformer = None
+
+    def __init__(self, script):
+        self.script = list(script)
+
+    def read_captured(self, timeout=None):
+        time.sleep(CHUNK_TIME)
+        if not self.script:
+            return None
+        data = self.script.pop(0)
+        return data + b"\0" * (CHUNK_BYTES - len(data))
+
+    def spot_wake_word(self, recognizer, data, phrases):
+        for phrase in phrases:
+            if phrase.encode() in data:
+                return phrase
+        return None
+
+    def take_replay(self):
+        return []
+
+
+class FakeRecognizer:
+    def __init__(self):
+        self.text = ""
+
+    def Reset(self):
+        self.text = ""
+
+    def AcceptWaveform(self, data):
+        self.text = data.strip(b"\0").decode()
+        return bool(self.text)
+
+    def Result(self):
+        return json.dumps({"text": self.text})
+
+    def PartialResult(self):
+        return json.dumps({"partial": ""})
+
+
+class SlowRecognizer(FakeRecognizer):
+    """
+    Never ends an utterance by itself, the text is only returned by FinalResult.
+    """
+
+    def AcceptWaveform(self, data):
+        self.text = data.strip(b"\0").decode() or self.text
+        return False
+
+    def PartialResult(self):
+        return json.dumps({"partial": self.text})
+
+    def FinalResult(self):
+        text, self.text = self.text, ""
+        return json.dumps({"text": text})
+
+
+class FakeAskAi:
+    cache = None
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+        self.questions = []
+        self.resets = 0
+        self.closed = 0
+
+    def cached_reply(self, prompt):
+        return None
+
+    def reset_chat(self):
+        self.resets += 1
+
+    def ask_ai_stream(self, prompt):
+        self.questions.append(prompt)
+        try:
+            for n in range(3):
+                time.sleep(self.delay)
+                yield "Antwort {} auf {}.".format(n, prompt)
+        except GeneratorExit:
+            # the request was cancelled
+            self.closed += 1
+            raise
+
+
+class FakeRenderer:
+    def render(self, segment: Segment) -> None:
+        segment.sample_rate = 16000
+        segment.pcm = bytes(int(segment.sample_rate * 2 * 0.1))
+
+
+class FakeAudioOut:
+    def __init__(self):
+        self.files = []
+        self.played = []
+        self.stops = 0
+
+    def play_file(self, filename, block=False):
+        self.files.append(filename)
+
+    def play(self, segment, block=False):
+        time.sleep(segment.duration)
+        self.played.append(segment.text)
+
+    def stop(self):
+        self.stops += 1
+
+
+class ConversationTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.audio_out = FakeAudioOut()
+        self.tts = TtsPipeline(FakeRenderer(), lambda segment: self.audio_out.play(segment, block=True))
+
+    def tearDown(self) -> None:
+        self.tts.close()
+
+    def converse(self, script, ask_ai, listen_timeout=0.5, recognizer=FakeRecognizer,
+                 recorder=None, barge_in_vad=False) -> Conversation:
+        startup = Startup()
+        startup.run("stt_handler", FakeStt, script)
+        startup.run("wake_recognizer", FakeRecognizer)
+        startup.run("recognizer", recognizer)
+        startup.run("audio_out", lambda: self.audio_out)
+        startup.run("tts", lambda: (self.tts, None))
+        startup.run("ask_ai", lambda: ask_ai)
+
+        self.metrics = Metrics()
+        conversation = Conversation(startup, "hey computer", "ende",
+                                    sounds={"waiting": "waiting", "trigger": "trigger", "quit": "quit"},
+                                    listen_timeout=listen_timeout, barge_in_vad=barge_in_vad, metrics=self.metrics,
+                                    recorder=recorder)
+        asyncio.run(asyncio.wait_for(conversation.run(), 20))
+        self.assertEqual(State.STOPPED, conversation.state)
+        return conversation
+
+    def test_turn(self):
+        self.logger.info("\n\n### test_turn ###")
+        ask_ai = FakeAskAi()
+        script = [SILENCE] * 3 + [b"hey computer", b"wie wird das wetter morgen"] + [SILENCE] * 80
+        conversation = self.converse(script, ask_ai)
+
+        self.assertEqual(["wie wird das wetter morgen"], ask_ai.questions)
+        self.assertEqual(["Antwort {} auf wie wird das wetter morgen.".format(n) for n in range(3)],
+                         self.audio_out.played)
+        self.assertEqual(1, ask_ai.resets)
+        self.assertEqual(["waiting", "trigger", "waiting", "quit"], self.audio_out.files)
+        self.assertEqual(1, len(conversation.turns))
+        self.assertLess(conversation.turns[0].latency, 0.5)
+        self.assertEqual(0, conversation.interruptions)
+
+        self.assertEqual({"wake_words": 1, "turns_total": 1, "listen_timeouts": 1, "no_speech_timeouts": 1,
+                          "endpoints_recognizer": 1}, self.metrics.counters)
+        for span in ("llm_first_sentence", "llm_total", "tts_first_synthesis", "response", "playback"):
+            self.assertEqual(1, self.metrics.histograms["turn_{}_seconds".format(span)].count, span)
+
+    def test_early_endpoint(self):
+        self.logger.info("\n\n### test_early_endpoint ###")
+        ask_ai = FakeAskAi()
+        script = [b"hey computer"] + [b"wie wird das wetter"] * 15 + [SILENCE] * 80
+        conversation = self.converse(script, ask_ai, recognizer=SlowRecognizer)
+
+        # the trailing silence ended the question, the recognizer would not have
+        self.assertEqual(["wie wird das wetter"], ask_ai.questions)
+        self.assertEqual(1, self.metrics.counters["endpoints_early"])
+        # no time saved is claimed before the delay of the recognizer has been measured
+        self.assertNotIn("endpoint_saved_seconds", self.metrics.histograms)
+        self.assertEqual(1, len(conversation.turns))
+
+    def test_record(self):
+        self.logger.info("\n\n### test_record ###")
+        ask_ai = FakeAskAi()
+        script = [b"hey computer"] + [b"wie wird das wetter"] * 15 + [SILENCE] * 80
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "session.rec")
+            recorder = SessionRecorder(path, 16000, metrics=Metrics())
+            recorder.start()
+            self.converse(script, ask_ai, recognizer=SlowRecognizer, recorder=recorder)
+            recorder.close()
+
+            reader = SessionReader(path)
+            events = [(name, value) for _, name, value in reader.events() if name != "state"]
+            states = [value for _, name, value in reader.events() if name == "state"]
+            reader.close()
+
+        self.assertEqual([("wake", "hey computer"), ("partial", "wie wird das wetter"),
+                          ("final", {"text": "wie wird das wetter", "early": True}),
+                          ("llm_request", "wie wird das wetter")], events[:4])
+        replies = ["Antwort {} auf wie wird das wetter.".format(n) for n in range(3)]
+        self.assertEqual(replies, [value["text"] for name, value in events if name == "llm_response"])
+        self.assertEqual(replies, [value for name, value in events if name == "tts_start"])
+        self.assertEqual([("tts_stop", "spoken"), ("timeout", None)], events[-2:])
+        self.assertEqual(["listening", "thinking", "speaking", "listening", "idle", "stopped"], states)
+
+    def test_barge_in(self):
+        self.logger.info("\n\n### test_barge_in ###")
+        ask_ai = FakeAskAi(delay=0.3)
+        script = [b"hey computer", b"erzaehl mir einen langen witz"] + [SILENCE] * 15 + \
+                 [b"hey computer", b"dann eben das wetter morgen"] + [SILENCE] * 80
+        conversation = self.converse(script, ask_ai)
+
+        self.assertEqual(["erzaehl mir einen langen witz", "dann eben das wetter morgen"], ask_ai.questions)
+        self.assertEqual(1, conversation.interruptions)
+        self.assertEqual(2, self.metrics.counters["turns_total"])
+        self.assertGreaterEqual(self.audio_out.stops, 1)
+        self.assertNotIn("Antwort 2 auf erzaehl mir einen langen witz.", self.audio_out.played)
+        self.assertIn("Antwort 2 auf dann eben das wetter morgen.", self.audio_out.played)
+
+    def test_barge_in_vad(self):
+        self.logger.info("\n\n### test_barge_in_vad ###")
+        ask_ai = FakeAskAi(delay=0.3)
+        # loud audio without a phrase, e.g. the user talking over the reply
+        noise = b"A" * CHUNK_BYTES
+        script = [b"hey computer", b"erzaehl mir einen langen witz"] + [SILENCE] * 20 + [noise] * 30 + \
+                 [SILENCE] * 80
+        conversation = self.converse(script, ask_ai, barge_in_vad=True)
+
+        self.assertEqual(["erzaehl mir einen langen witz"], ask_ai.questions)
+        self.assertEqual(1, conversation.interruptions)
+        self.assertNotIn("Antwort 2 auf erzaehl mir einen langen witz.", self.audio_out.played)
+        self.assertEqual(1, self.metrics.counters["listen_timeouts"])
+
+    def test_quit_while_thinking(self):
+        self.logger.info("\n\n### test_quit_while_thinking ###")
+        ask_ai = FakeAskAi(delay=0.3)
+        # nothing is played yet, the quit phrase cancels the request
+        script = [b"hey computer", b"was ist der sinn des lebens", SILENCE, SILENCE, b"ende"] + [SILENCE] * 300
+
+        start = time.time()
+        conversation = self.converse(script, ask_ai, listen_timeout=5.0)
+        self.assertLess(time.time() - start, 2.0)
+        self.assertEqual(["was ist der sinn des lebens"], ask_ai.questions)
+        self.assertEqual(1, conversation.interruptions)
+        self.assertEqual([], self.audio_out.played)
+        self.assertEqual("quit", self.audio_out.files[-1])
+        self.assertEqual(2, self.metrics.counters["wake_words"])
+
+        # the reply being generated is dropped at its next sentence
+        time.sleep(0.5)
+        self.assertEqual(1, ask_ai.closed)
+        self.assertEqual([], self.audio_out.played)
+
+    def test_quit_while_speaking(self):
+        self.logger.info("\n\n### test_quit_while_speaking ###")
+        ask_ai = FakeAskAi(delay=0.02)
+        # the quit phrase while speaking may be part of the reply, only the one in the next question counts
+        script = [b"hey computer", b"was ist der sinn des lebens"] + [SILENCE] * 10 + [b"ende"] + [SILENCE] * 100 + \
+                 [b"ende"] + [SILENCE] * 300
+
+        start = time.time()
+        self.converse(script, ask_ai, listen_timeout=5.0)
+        self.assertLess(time.time() - start, 4.0)
+        self.assertEqual(["Antwort {} auf was ist der sinn des lebens.".format(n) for n in range(3)],
+                         self.audio_out.played)
+        self.assertEqual("quit", self.audio_out.files[-1])
+        self.assertEqual(1, self.metrics.counters["wake_words"])
+
+
+if __name__ == '__main__':
+    unittest.main()
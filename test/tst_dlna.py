@@ -0,0 +1,92 @@
+import unittest
+import logging
+import threading
+import time
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append("../src")
+
+import dlnahelper
+
+ACTION_DELAY = 0.2
+
+
+class FakeRendererHandler(BaseHTTPRequestHandler):
+    """
+    @brief Stand-in for the UPnP control endpoints of a Sonos speaker, recording the received actions.
+    """
+    protocol_version = "HTTP/1.1"
+    actions = []
+    clients = set()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        action = self.headers["SOAPACTION"].strip('"').split("#")[1]
+        FakeRendererHandler.actions.append((self.path, action, body))
+        FakeRendererHandler.clients.add(self.client_address)
+        time.sleep(ACTION_DELAY)
+
+        reply = b"<s:Envelope/>"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DlnaHelperTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+        FakeRendererHandler.actions.clear()
+        FakeRendererHandler.clients.clear()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRendererHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.sonos = dlnahelper.DlnaHelper("127.0.0.1", 10, port=self.server.server_port)
+
+    def tearDown(self) -> None:
+        self.sonos.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_play_uri(self):
+        self.logger.info("\n\n### test_play_uri ###")
+        start = time.time()
+        results = self.sonos.play_uri("http://example.com/reply.wav?a=1&b=2")
+        duration = time.time() - start
+        self.logger.info(results)
+
+        self.assertEqual(["SetAVTransportURI", "SetVolume", "Play"], [result.action for result in results])
+        self.assertTrue(all(result.ok for result in results))
+        # SetAVTransportURI and SetVolume run concurrently
+        self.assertLess(duration, 3 * ACTION_DELAY)
+
+        bodies = {action: body for _, action, body in FakeRendererHandler.actions}
+        self.assertIn("<CurrentURI>http://example.com/reply.wav?a=1&amp;b=2</CurrentURI>",
+                      bodies["SetAVTransportURI"])
+        self.assertIn("<DesiredVolume>10</DesiredVolume>", bodies["SetVolume"])
+
+    def test_keep_alive(self):
+        self.logger.info("\n\n### test_keep_alive ###")
+        for _ in range(3):
+            self.sonos.play_uri("http://example.com/reply.wav")
+
+        self.assertEqual(9, len(FakeRendererHandler.actions))
+        self.assertLessEqual(len(FakeRendererHandler.clients), 2)
+
+    def test_failure(self):
+        self.logger.info("\n\n### test_failure ###")
+        self.sonos.close()
+        self.sonos = dlnahelper.DlnaHelper("127.0.0.1", 10, port=1, timeout=1)
+        results = self.sonos.play_uri("http://example.com/reply.wav")
+
+        self.assertEqual(2, len(results))
+        self.assertFalse(any(result.ok for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
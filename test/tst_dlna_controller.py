@@ -0,0 +1,178 @@
+import unittest
+import asyncio
+import logging
+import socket
+import re
+import threading
+import time
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append("../src")
+
+import dlnacontroller
+
+NUM_SPEAKERS = 4
+ACTION_DELAY = 0.2
+
+DESCRIPTION = """<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+  <device>
+    <deviceType>urn:schemas-upnp-org:device:ZonePlayer:1</deviceType>
+    <friendlyName>Speaker {n}</friendlyName>
+    <UDN>uuid:speaker-{n}</UDN>
+    <deviceList>
+      <device>
+        <deviceType>urn:schemas-upnp-org:device:MediaRenderer:1</deviceType>
+        <serviceList>
+          <service>
+            <serviceType>urn:schemas-upnp-org:service:RenderingControl:1</serviceType>
+            <controlURL>/speaker{n}/RenderingControl/Control</controlURL>
+          </service>
+          <service>
+            <serviceType>urn:schemas-upnp-org:service:AVTransport:1</serviceType>
+            <controlURL>/speaker{n}/AVTransport/Control</controlURL>
+          </service>
+        </serviceList>
+      </device>
+    </deviceList>
+  </device>
+</root>"""
+
+
+class FakeSpeakersHandler(BaseHTTPRequestHandler):
+    """
+    @brief Serves device descriptions and UPnP control endpoints of NUM_SPEAKERS fake speakers.
+    """
+    protocol_version = "HTTP/1.1"
+    actions = []
+    volumes = []
+
+    def _reply(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        n = int(self.path.strip("/").split(".")[0].replace("desc", ""))
+        self._reply(DESCRIPTION.format(n=n).encode())
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        FakeSpeakersHandler.actions.append((self.path, self.headers["SOAPACTION"]))
+        volume = re.search(rb"<DesiredVolume>(\d+)</DesiredVolume>", body)
+        if volume:
+            FakeSpeakersHandler.volumes.append(int(volume.group(1)))
+        time.sleep(ACTION_DELAY)
+        self._reply(b"<s:Envelope/>")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeSsdpResponder(threading.Thread):
+    """
+    @brief Answers M-SEARCH requests on a local UDP port with one response per fake speaker.
+    """
+
+    def __init__(self, http_port: int):
+        super().__init__(daemon=True)
+        self.http_port = http_port
+        self.searches = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address = self.sock.getsockname()
+
+    def run(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except OSError:
+                return
+            if not data.startswith(b"M-SEARCH"):
+                continue
+            self.searches += 1
+            for n in range(NUM_SPEAKERS):
+                response = "\r\n".join(["HTTP/1.1 200 OK",
+                                        "CACHE-CONTROL: max-age=1800",
+                                        "LOCATION: http://127.0.0.1:{}/desc{}.xml".format(self.http_port, n),
+                                        "ST: urn:schemas-upnp-org:device:MediaRenderer:1",
+                                        "USN: uuid:speaker-{}::urn:schemas-upnp-org:device:MediaRenderer:1".format(n),
+                                        "", ""])
+                self.sock.sendto(response.encode(), addr)
+
+
+class DlnaControllerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+        FakeSpeakersHandler.actions.clear()
+        FakeSpeakersHandler.volumes.clear()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSpeakersHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.ssdp = FakeSsdpResponder(self.server.server_port)
+        self.ssdp.start()
+        self.controller = dlnacontroller.DlnaController(volume=15, ssdp_address=self.ssdp.address)
+
+    def tearDown(self) -> None:
+        self.controller.close()
+        self.ssdp.sock.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_discover(self):
+        self.logger.info("\n\n### test_discover ###")
+        renderers = asyncio.run(self.controller.discover(wait=0.3))
+
+        self.assertEqual(["Speaker {}".format(n) for n in range(NUM_SPEAKERS)],
+                         sorted(renderer.name for renderer in renderers))
+        self.assertEqual("/speaker0/AVTransport/Control",
+                         [r for r in renderers if r.name == "Speaker 0"][0].av_transport_path)
+
+        # served from the cache
+        asyncio.run(self.controller.discover(wait=0.3))
+        self.assertEqual(1, self.ssdp.searches)
+
+    def test_play_uri(self):
+        self.logger.info("\n\n### test_play_uri ###")
+        asyncio.run(self.controller.discover(wait=0.3))
+
+        start = time.time()
+        results = asyncio.run(self.controller.play_uri("http://127.0.0.1/reply.wav"))
+        duration = time.time() - start
+        self.logger.info("Played on {} speakers in {:.2f}s".format(len(results), duration))
+
+        self.assertEqual(NUM_SPEAKERS, len(results))
+        for renderer, actions in results.items():
+            self.assertTrue(all(action.ok for action in actions), "{}: {}".format(renderer.name, actions))
+        self.assertEqual(3 * NUM_SPEAKERS, len(FakeSpeakersHandler.actions))
+        # all speakers in parallel: two round trips instead of 2 * NUM_SPEAKERS
+        self.assertLess(duration, 2 * ACTION_DELAY * NUM_SPEAKERS / 2)
+
+    def test_volume(self):
+        self.logger.info("\n\n### test_volume ###")
+        asyncio.run(self.controller.discover(wait=0.3))
+
+        asyncio.run(self.controller.play_uri("http://127.0.0.1/reply.wav", volume=40))
+        self.assertEqual([40] * NUM_SPEAKERS, FakeSpeakersHandler.volumes)
+        # the volume of a call does not stick
+        FakeSpeakersHandler.volumes.clear()
+        asyncio.run(self.controller.play_uri("http://127.0.0.1/reply.wav"))
+        self.assertEqual([15] * NUM_SPEAKERS, FakeSpeakersHandler.volumes)
+
+    def test_timeout(self):
+        self.logger.info("\n\n### test_timeout ###")
+        unreachable = dlnacontroller.Renderer("uuid:gone", "Gone", "10.255.255.1", 1400, "/a", "/r")
+        self.controller.timeout = 0.3
+
+        start = time.time()
+        results = asyncio.run(self.controller.play_uri("http://127.0.0.1/reply.wav", [unreachable]))
+
+        self.assertLess(time.time() - start, 2)
+        self.assertFalse(any(isinstance(r, list) and all(a.ok for a in r) for r in results.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
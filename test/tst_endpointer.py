@@ -0,0 +1,135 @@
+import unittest
+import logging
+import sys
+
+import numpy as np
+
+sys.path.append("../src")
+
+from endpointer import Endpointer
+from metrics import Metrics
+
+SAMPLE_RATE = 16000
+CHUNK_TIME = 0.02
+
+
+def chunks(seconds: float, speech: bool) -> list:
+    n = int(SAMPLE_RATE * CHUNK_TIME)
+    if not speech:
+        return [bytes(2 * n)] * int(round(seconds / CHUNK_TIME))
+    tone = (5000 * np.sin(2 * np.pi * 440 * np.arange(n) / SAMPLE_RATE)).astype(np.int16).tobytes()
+    return [tone] * int(round(seconds / CHUNK_TIME))
+
+
+class EndpointerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.metrics = Metrics()
+        self.endpointer = Endpointer(SAMPLE_RATE, trailing_silence=0.6, no_speech_timeout=3.0,
+                                     min_no_speech_timeout=1.0, metrics=self.metrics)
+        self.endpointer.start()
+
+    def run_until(self, audio: list) -> tuple:
+        """
+        Feeds chunks until an event, returns the event and the seconds of audio fed.
+        """
+        for n, data in enumerate(audio, 1):
+            event = self.endpointer.process(data)
+            if event:
+                return event, round(n * CHUNK_TIME, 2)
+        return None, round(len(audio) * CHUNK_TIME, 2)
+
+    def test_trailing_silence(self):
+        self.logger.info("\n\n### test_trailing_silence ###")
+        event, position = self.run_until(chunks(0.4, False) + chunks(0.5, True) + chunks(2.0, False))
+        self.assertEqual(Endpointer.ENDPOINT, event)
+        self.assertAlmostEqual(0.4 + 0.5 + 0.6, position, 2)
+
+        # the delay of the recognizer has not been measured yet
+        self.assertEqual(0.0, self.endpointer.end_utterance(early=True))
+        self.assertEqual(1, self.metrics.counters["endpoints_early"])
+        self.assertNotIn("endpoint_saved_seconds", self.metrics.histograms)
+
+    def test_calibration(self):
+        self.logger.info("\n\n### test_calibration ###")
+        self.endpointer.calibrate_every = 2
+        event, _ = self.run_until(chunks(0.5, True) + chunks(2.0, False))
+        self.assertEqual(Endpointer.ENDPOINT, event)
+        self.endpointer.end_utterance(early=True)
+
+        # the second utterance is left to the recognizer, which ends it after 1.1s of silence
+        self.assertTrue(self.endpointer.calibrating)
+        event, position = self.run_until(chunks(0.5, True) + chunks(1.1, False))
+        self.assertIsNone(event)
+        self.assertEqual(0.0, self.endpointer.end_utterance(early=False))
+        self.assertAlmostEqual(1.1, self.endpointer.recognizer_delay, 2)
+        self.assertEqual(1, self.metrics.histograms["endpoint_recognizer_delay_seconds"].count)
+
+        # the time saved by the trailing silence is measured against it
+        self.assertFalse(self.endpointer.calibrating)
+        event, position = self.run_until(chunks(0.5, True) + chunks(2.0, False))
+        self.assertEqual(Endpointer.ENDPOINT, event)
+        self.assertAlmostEqual(0.5, self.endpointer.end_utterance(early=True), 2)
+        self.assertEqual(1, self.metrics.histograms["endpoint_saved_seconds"].count)
+
+        # the fourth is left to the recognizer again, which does not end it, but the user does not wait for long
+        self.assertTrue(self.endpointer.calibrating)
+        event, position = self.run_until(chunks(0.5, True) + chunks(5.0, False))
+        self.assertEqual(Endpointer.ENDPOINT, event)
+        self.assertAlmostEqual(0.5 + 3.0, position, 1)
+        self.assertEqual(0.0, self.endpointer.end_utterance(early=True))
+        self.assertEqual(1, self.metrics.histograms["endpoint_saved_seconds"].count)
+
+    def test_no_speech_timeout(self):
+        self.logger.info("\n\n### test_no_speech_timeout ###")
+        # a click is too short to be speech and does not stop the timeout
+        event, position = self.run_until(chunks(1.0, False) + chunks(0.06, True) + chunks(5.0, False))
+        self.assertEqual(Endpointer.TIMEOUT, event)
+        self.assertAlmostEqual(3.02, position, 1)
+        self.assertEqual(1, self.metrics.counters["no_speech_timeouts"])
+
+    def test_adaptive_timeout(self):
+        self.logger.info("\n\n### test_adaptive_timeout ###")
+        for _ in range(3):
+            self.assertEqual(3.0, self.endpointer.timeout)
+            event, _ = self.run_until(chunks(0.2, False) + chunks(0.4, True) + chunks(2.0, False))
+            self.assertEqual(Endpointer.ENDPOINT, event)
+            self.endpointer.end_utterance(early=True)
+
+        # the user has always started speaking within 0.2s
+        self.assertAlmostEqual(1.3, self.endpointer.timeout, 2)
+        event, position = self.run_until(chunks(3.0, False))
+        self.assertEqual(Endpointer.TIMEOUT, event)
+        self.assertAlmostEqual(1.32, position, 2)
+
+    def test_max_utterance(self):
+        self.logger.info("\n\n### test_max_utterance ###")
+        endpointer = Endpointer(SAMPLE_RATE, no_speech_timeout=3.0, max_utterance=5.0, max_speech=60.0,
+                                metrics=self.metrics)
+        endpointer.start()
+        self.endpointer = endpointer
+        # steady noise taken for speech, which never ends
+        event, position = self.run_until(chunks(1.0, False) + chunks(20.0, True))
+        self.assertEqual(Endpointer.TIMEOUT, event)
+        self.assertAlmostEqual(8.02, position, 2)
+        self.assertEqual(1, self.metrics.counters["max_utterance_timeouts"])
+
+    def test_recognizer_endpoint(self):
+        self.logger.info("\n\n### test_recognizer_endpoint ###")
+        self.endpointer.trailing_silence = 0
+        event, _ = self.run_until(chunks(0.5, True) + chunks(0.5, False))
+        self.assertIsNone(event)
+        # the recognizer ended the utterance after 0.5s of silence
+        self.assertEqual(0.0, self.endpointer.end_utterance(early=False))
+        self.assertAlmostEqual(0.5, self.endpointer.recognizer_delay, 2)
+        self.assertEqual(1, self.metrics.counters["endpoints_recognizer"])
+
+        # later measurements are averaged
+        self.run_until(chunks(0.5, True) + chunks(1.0, False))
+        self.endpointer.end_utterance(early=False)
+        self.assertAlmostEqual(0.6, self.endpointer.recognizer_delay, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
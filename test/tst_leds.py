@@ -0,0 +1,88 @@
+import unittest
+import threading
+import logging
+import time
+import sys
+
+sys.path.append("../src")
+
+from leds import LedAnimator, solid, spinner, pulse, direction, progress
+
+
+class FakeApa102:
+    """
+    Records the pixels sent to the strip, like the SPI transfers of the APA102 driver.
+    """
+
+    def __init__(self, num_led=12):
+        self.pixels = [(0, 0, 0)] * num_led
+        self.frames = []
+        self.set_pixel_thread = None
+
+    def set_pixel(self, n, r, g, b):
+        self.set_pixel_thread = threading.current_thread().name
+        self.pixels[n] = (r, g, b)
+
+    def show(self):
+        self.frames.append((time.monotonic(), list(self.pixels)))
+
+    def clear_strip(self):
+        self.pixels = [(0, 0, 0)] * len(self.pixels)
+        self.show()
+
+
+class LedsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.driver = FakeApa102()
+        self.animator = LedAnimator(self.driver, 12, fps=50, max_value=10)
+        self.animator.start()
+
+    def tearDown(self) -> None:
+        self.animator.close()
+
+    def test_static_frame(self):
+        self.logger.info("\n\n### test_static_frame ###")
+        self.animator.play(solid((1, 0.5, 0)))
+        time.sleep(0.3)
+
+        # one show per frame, and an unchanged frame is not sent again
+        self.assertEqual(1, sum(1 for _, pixels in self.driver.frames if pixels == [(10, 5, 0)] * 12))
+        self.assertEqual([(10, 5, 0)] * 12, self.driver.frames[-1][1])
+        self.assertEqual("leds", self.driver.set_pixel_thread)
+        self.assertGreater(self.animator.skipped, 5)
+
+        self.animator.play(progress((1, 0, 0), 0.25))
+        time.sleep(0.05)
+        self.assertEqual([(10, 0, 0)] * 3 + [(0, 0, 0)] * 9, self.driver.frames[-1][1])
+
+    def test_frame_rate(self):
+        self.logger.info("\n\n### test_frame_rate ###")
+        self.animator.play(pulse((0, 0, 1), period=0.2))
+        time.sleep(0.5)
+        self.animator.play(None)
+        time.sleep(0.05)
+
+        times = [at for at, _ in self.driver.frames]
+        self.assertLessEqual(len(times), 0.5 * 50 + 3)
+        self.assertGreater(len(times), 10)
+        self.assertGreaterEqual((times[-2] - times[1]) / (len(times) - 3), 0.018)
+        self.assertEqual([(0, 0, 0)] * 12, self.driver.frames[-1][1])
+
+    def test_animations(self):
+        self.logger.info("\n\n### test_animations ###")
+        frame = spinner((1, 0, 0), period=1.2, tail=2)(0.25, 12)
+        self.assertEqual((1, 0, 0), frame[2])
+        self.assertEqual([0, 0, 0, 0], [pixel[0] for pixel in frame[3:7]])
+        self.assertGreater(frame[1][0], frame[0][0])
+
+        angle = [None]
+        listening = direction((0, 1, 0), lambda: angle[0])
+        self.assertEqual([(0, 0.25, 0)] * 12, listening(0, 12))
+        angle[0] = 90
+        self.assertEqual((0, 1, 0), listening(0, 12)[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import tempfile
+import logging
+import queue
+import time
+import sys
+import os
+
+sys.path.append("../src")
+
+from logsetup import setup_logging, DroppingQueueHandler, RateLimitFilter
+
+
+class LogSetupTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def test_rate_limit(self):
+        self.logger.info("\n\n### test_rate_limit ###")
+        log_filter = RateLimitFilter(0.2)
+        record = lambda text: logging.LogRecord("partial", logging.DEBUG, "", 0, "Partial: '%s'", (text,), None)
+
+        self.assertTrue(log_filter.filter(record("hey")))
+        self.assertFalse(log_filter.filter(record("hey com")))
+        self.assertFalse(log_filter.filter(record("hey comp")))
+        time.sleep(0.25)
+        passed = record("hey computer")
+        self.assertTrue(log_filter.filter(passed))
+        self.assertEqual("Partial: 'hey computer' (2 suppressed)", passed.getMessage())
+
+    def test_dropping_queue(self):
+        self.logger.info("\n\n### test_dropping_queue ###")
+        handler = DroppingQueueHandler(queue.Queue(2))
+        for n in range(5):
+            handler.handle(logging.LogRecord("test", logging.INFO, "", 0, "record %s", (n,), None))
+        self.assertEqual(2, handler.queue.qsize())
+        self.assertEqual(3, handler.dropped)
+
+    def test_rotation(self):
+        self.logger.info("\n\n### test_rotation ###")
+        root = logging.getLogger()
+        handlers, level = root.handlers[:], root.level
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "log.log")
+            listener = setup_logging(filename, "info", max_bytes=1000, backups=2)
+            try:
+                for n in range(100):
+                    logging.getLogger("test").info("record {}".format(n))
+                    logging.getLogger("test").debug("not logged")
+            finally:
+                listener.stop()
+                for handler in root.handlers[:]:
+                    root.removeHandler(handler)
+                for handler in handlers:
+                    root.addHandler(handler)
+                root.setLevel(level)
+
+            self.assertEqual(["log.log", "log.log.1", "log.log.2"], sorted(os.listdir(directory)))
+            with open(filename, encoding="utf-8") as log_file:
+                lines = log_file.read().splitlines()
+            self.assertTrue(lines[-1].endswith("record 99"))
+            self.assertFalse(any("not logged" in line for line in lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
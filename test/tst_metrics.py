@@ -0,0 +1,80 @@
+import unittest
+import urllib.request
+import tempfile
+import logging
+import json
+import time
+import sys
+import os
+
+sys.path.append("../src")
+
+from metrics import Metrics, MetricsServer
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def test_render(self):
+        self.logger.info("\n\n### test_render ###")
+        metrics = Metrics()
+        metrics.inc("api_errors")
+        metrics.inc("audio_overflows", 3)
+        metrics.set_gauge("startup_ready_seconds", 4.2)
+        for seconds in (0.05, 0.3, 20.0):
+            metrics.observe("turn_response_seconds", seconds)
+
+        lines = metrics.render().splitlines()
+        self.logger.info("\n".join(lines))
+        self.assertIn("chatbot_api_errors_total 1", lines)
+        self.assertIn("chatbot_audio_overflows_total 3", lines)
+        self.assertIn("chatbot_startup_ready_seconds 4.2", lines)
+        self.assertIn('chatbot_turn_response_seconds_bucket{le="0.05"} 1', lines)
+        self.assertIn('chatbot_turn_response_seconds_bucket{le="0.5"} 2', lines)
+        self.assertIn('chatbot_turn_response_seconds_bucket{le="16.0"} 2', lines)
+        self.assertIn('chatbot_turn_response_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn("chatbot_turn_response_seconds_count 3", lines)
+
+    def test_turn_trace(self):
+        self.logger.info("\n\n### test_turn_trace ###")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "turns.jsonl")
+            metrics = Metrics(path, max_trace_bytes=500, backups=2)
+            for n in range(10):
+                now = time.time()
+                metrics.begin_turn("frage {}".format(n))
+                metrics.mark("speech_end", now)
+                metrics.mark("final_result", now + 0.4)
+                metrics.mark("llm_request", now + 0.4)
+                metrics.mark("llm_first_token", now + 1.0)
+                metrics.mark("playback_start", now + 1.5)
+                metrics.mark("playback_start", now + 9.0)
+                metrics.end_turn("spoken" if n else "interrupted")
+
+            with open(path) as trace_file:
+                turn = json.loads(trace_file.readlines()[-1])
+            self.assertEqual(10, turn["turn"])
+            self.assertEqual({"endpointing": 0.4, "llm_first_token": 0.6, "response": 1.1,
+                              "response_from_speech_end": 1.5}, turn["spans"])
+            self.assertEqual(["turns.jsonl", "turns.jsonl.1", "turns.jsonl.2"], sorted(os.listdir(directory)))
+            self.assertEqual(9, metrics.histograms["turn_response_seconds"].count)
+            self.assertEqual(10, metrics.counters["turns_total"])
+
+    def test_server(self):
+        self.logger.info("\n\n### test_server ###")
+        metrics = Metrics()
+        metrics.inc("wake_words")
+        server = MetricsServer(metrics, port=0).start()
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(server.server_port)
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertIn("text/plain", response.headers["Content-Type"])
+                self.assertIn("chatbot_wake_words_total 1", response.read().decode())
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
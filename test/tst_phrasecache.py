@@ -0,0 +1,94 @@
+import unittest
+import logging
+import tempfile
+import sys
+import os
+
+sys.path.append("../src")
+
+from phrasecache import PhraseCache, CachedRenderer, phrase_key
+from ttspipeline import Segment
+
+
+class FakeRenderer:
+    def __init__(self):
+        self.rendered = []
+
+    def render(self, segment: Segment) -> None:
+        self.rendered.append(segment.text)
+        segment.pcm = segment.text.encode("utf-8") * 100
+        segment.sample_rate = 22050
+
+
+class PhraseCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_key(self):
+        self.logger.info("\n\n### test_key ###")
+        key = phrase_key("Hallo", "de", 150, "espeak")
+        self.assertEqual(key, phrase_key(" Hallo ", "de", 150, "espeak"))
+        self.assertNotEqual(key, phrase_key("Hallo", "de", 160, "espeak"))
+        self.assertNotEqual(key, phrase_key("Hallo", "de", 150, "pyttsx3"))
+
+    def test_render_once(self):
+        self.logger.info("\n\n### test_render_once ###")
+        fake = FakeRenderer()
+        renderer = CachedRenderer(fake, PhraseCache(self.directory.name), "de", 150, cache_all=True)
+        for _ in range(3):
+            segment = Segment("Das weiß ich nicht.")
+            renderer.render(segment)
+            self.assertEqual(22050, segment.sample_rate)
+        self.assertEqual(["Das weiß ich nicht."], fake.rendered)
+        self.assertEqual(2, renderer.cache.hits)
+
+    def test_disk_tier(self):
+        self.logger.info("\n\n### test_disk_tier ###")
+        fake = FakeRenderer()
+        CachedRenderer(fake, PhraseCache(self.directory.name), "de", 150).prewarm(["Eins.", "Zwei.", ""])
+        self.assertEqual(["Eins.", "Zwei."], fake.rendered)
+
+        cache = PhraseCache(self.directory.name)
+        renderer = CachedRenderer(fake, cache, "de", 150)
+        self.assertEqual(0, renderer.prewarm(["Eins.", "Zwei."]))
+        segment = Segment("Zwei.")
+        renderer.render(segment)
+        self.assertEqual(b"Zwei." * 100, segment.pcm)
+        # mapped, not copied
+        self.assertIsInstance(segment.pcm, memoryview)
+        self.assertEqual(1, cache.disk_hits)
+        self.assertEqual(2, len(fake.rendered))
+
+    def test_prewarmed_only(self):
+        self.logger.info("\n\n### test_prewarmed_only ###")
+        fake = FakeRenderer()
+        cache = PhraseCache(self.directory.name)
+        renderer = CachedRenderer(fake, cache, "de", 150)
+        renderer.prewarm(["Einen Moment."])
+        for text in ["Einen Moment.", "Morgen wird es sonnig.", "Einen Moment.", "Morgen wird es sonnig."]:
+            renderer.render(Segment(text))
+
+        # the sentences of the replies are not written to the SD card
+        self.assertEqual(["Einen Moment.", "Morgen wird es sonnig.", "Morgen wird es sonnig."], fake.rendered)
+        self.assertEqual(1, len(os.listdir(self.directory.name)))
+
+    def test_size_limit(self):
+        self.logger.info("\n\n### test_size_limit ###")
+        cache = PhraseCache(self.directory.name, max_bytes=1500, memory_items=1)
+        renderer = CachedRenderer(FakeRenderer(), cache, "de", 150)
+        renderer.prewarm(["Satz {}.".format(n) for n in range(5)])
+
+        self.assertLessEqual(cache.stats()["disk_bytes"], 1500)
+        self.assertEqual(cache.stats()["disk_bytes"],
+                         sum(entry.stat().st_size for entry in os.scandir(self.directory.name)))
+        self.assertNotIn(phrase_key("Satz 0.", "de", 150, "FakeRenderer"), cache)
+        self.assertIn(phrase_key("Satz 4.", "de", 150, "FakeRenderer"), cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
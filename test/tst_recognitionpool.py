@@ -0,0 +1,144 @@
+import unittest
+import threading
+import logging
+import struct
+import json
+import os
+import sys
+
+sys.path.append("../src")
+
+from recognitionpool import RecognitionPool
+
+CHUNK = 4096
+
+
+class FakeModel:
+    loads = 0
+
+    def __init__(self):
+        FakeModel.loads += 1
+        self.pid = os.getpid()
+
+
+class FakeRecognizer:
+    """
+    Sums the samples of the stream, each chunk containing its number as the first sample.
+    A result is returned every 4 chunks and names the process decoding it and the model's process.
+    """
+
+    def __init__(self, model, sample_rate, grammar=None):
+        self.model = model
+        self.grammar = grammar
+        self.chunks = []
+
+    def AcceptWaveform(self, data):
+        if data == b"fail":
+            raise ValueError("bad chunk")
+        if data == b"crash":
+            # e.g. a segfault in Kaldi
+            os._exit(1)
+        self.chunks.append(struct.unpack_from('<h', data)[0])
+        return len(self.chunks) % 4 == 0
+
+    def Result(self):
+        return json.dumps({"text": " ".join(str(n) for n in self.chunks[-4:]), "pid": os.getpid(),
+                           "model_pid": self.model.pid})
+
+    def PartialResult(self):
+        return json.dumps({"partial": str(self.chunks[-1])})
+
+    def FinalResult(self):
+        return json.dumps({"text": "{} chunks, grammar {}".format(len(self.chunks), self.grammar)})
+
+    def Reset(self):
+        self.chunks = []
+
+
+def chunk(n: int) -> bytes:
+    return struct.pack('<h', n) + bytes(CHUNK - 2)
+
+
+class RecognitionPoolTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        FakeModel.loads = 0
+        self.pool = RecognitionPool(FakeModel, FakeRecognizer, processes=2, slots=4, slot_bytes=CHUNK)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+
+    def test_streams(self):
+        self.logger.info("\n\n### test_streams ###")
+        recognizers = [self.pool.recognizer(16000) for _ in range(4)]
+        self.assertEqual([2, 2], self.pool.stats()["streams"])
+        texts = [[] for _ in recognizers]
+
+        def feed(n):
+            recognizer = recognizers[n]
+            for m in range(40):
+                if recognizer.AcceptWaveform(chunk(100 * n + m)):
+                    texts[n].append(json.loads(recognizer.Result()))
+                else:
+                    self.assertEqual(str(100 * n + m), json.loads(recognizer.PartialResult())["partial"])
+
+        threads = [threading.Thread(target=feed, args=(n,)) for n in range(len(recognizers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # the model is loaded once, in this process
+        self.assertEqual(1, FakeModel.loads)
+        pids = set()
+        for n, results in enumerate(texts):
+            self.assertEqual(10, len(results))
+            self.assertEqual(" ".join(str(100 * n + m) for m in range(36, 40)), results[-1]["text"])
+            self.assertEqual(os.getpid(), results[0]["model_pid"])
+            pids.add(results[0]["pid"])
+        self.assertEqual(2, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(4, self.pool.stats()["free_slots"])
+
+        self.assertEqual("40 chunks, grammar None", json.loads(recognizers[0].FinalResult())["text"])
+        recognizers[0].Reset()
+        self.assertEqual("0 chunks, grammar None", json.loads(recognizers[0].FinalResult())["text"])
+        for recognizer in recognizers:
+            recognizer.close()
+        self.assertEqual([0, 0], self.pool.stats()["streams"])
+
+    def test_grammar_and_errors(self):
+        self.logger.info("\n\n### test_grammar_and_errors ###")
+        recognizer = self.pool.recognizer(16000, '["hey computer", "ende"]')
+        self.assertEqual('0 chunks, grammar ["hey computer", "ende"]', json.loads(recognizer.FinalResult())["text"])
+
+        with self.assertRaises(RuntimeError):
+            recognizer.AcceptWaveform(b"fail")
+        with self.assertRaises(ValueError):
+            recognizer.AcceptWaveform(bytes(CHUNK + 2))
+        # a failed chunk frees its slot
+        self.assertEqual(4, self.pool.stats()["free_slots"])
+        self.assertFalse(recognizer.AcceptWaveform(chunk(1)))
+
+    def test_worker_died(self):
+        self.logger.info("\n\n### test_worker_died ###")
+        recognizer = self.pool.recognizer(16000)
+        self.assertFalse(recognizer.AcceptWaveform(chunk(1)))
+
+        with self.assertRaises(RuntimeError):
+            self.pool.accept(recognizer.stream_id, b"crash").result(5)
+        # the slot of the request is not lost, and the stream fails at once
+        self.assertEqual(4, self.pool.stats()["free_slots"])
+        self.assertEqual(1, self.pool.stats()["dead_workers"])
+        with self.assertRaises(RuntimeError):
+            recognizer.AcceptWaveform(chunk(2))
+
+        # new streams go to the worker still alive
+        other = self.pool.recognizer(16000)
+        self.assertFalse(other.AcceptWaveform(chunk(3)))
+        self.assertEqual("1 chunks, grammar None", json.loads(other.FinalResult())["text"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import tempfile
+import logging
+import time
+import sys
+import os
+
+sys.path.append("../src")
+
+from recorder import SessionRecorder, SessionReader, RecordingStream, AUDIO
+from metrics import Metrics
+
+SAMPLE_RATE = 16000
+CHUNK_BYTES = 640
+
+
+def chunk(n: int) -> bytes:
+    """
+    20 ms of "audio", every sample being the chunk number.
+    """
+    return n.to_bytes(2, "little") * (CHUNK_BYTES // 2)
+
+
+class RecorderTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "sessions", "session.rec")
+        self.metrics = Metrics()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def record(self, chunks: int, close: bool = True) -> SessionRecorder:
+        recorder = SessionRecorder(self.path, SAMPLE_RATE, queue_size=1024, metrics=self.metrics)
+        recorder.start()
+        recorder.event("state", "idle")
+        for n in range(chunks):
+            recorder.audio(chunk(n))
+            if n == 60:
+                recorder.event("wake", "hey computer")
+                recorder.event("final", {"text": "wie wird das wetter", "early": True})
+        if close:
+            recorder.close()
+        return recorder
+
+    def test_roundtrip(self):
+        self.logger.info("\n\n### test_roundtrip ###")
+        recorder = self.record(150)
+        self.assertEqual(0, recorder.dropped)
+        # header, records with 9 bytes overhead each, index and trailer
+        self.assertLess(os.path.getsize(self.path), 150 * CHUNK_BYTES + 153 * 9 + 200)
+
+        reader = SessionReader(self.path)
+        self.assertTrue(reader.complete)
+        self.assertEqual(SAMPLE_RATE, reader.sample_rate)
+        self.assertEqual([0, 16000, 32000], [frame for frame, _ in reader.index])
+        self.assertEqual([("state", "idle"), ("wake", "hey computer"),
+                          ("final", {"text": "wie wird das wetter", "early": True})],
+                         [(name, value) for _, name, value in reader.events()])
+        self.assertEqual(b"".join(chunk(n) for n in range(150)), b"".join(reader.audio()))
+
+        # seeking by the index
+        first = next(content for record_type, _, content in reader.records(start=2.5) if record_type == AUDIO)
+        self.assertEqual(chunk(100), first)
+        self.assertEqual(2.0 * SAMPLE_RATE, reader.seek(2.5)[1])
+        reader.close()
+
+    def test_crash(self):
+        self.logger.info("\n\n### test_crash ###")
+        recorder = self.record(100, close=False)
+        while recorder.written < 103:
+            time.sleep(0.01)
+        recorder._file.flush()
+        # the process dies in the middle of a record
+        with open(self.path, 'rb') as rec:
+            data = rec.read()
+        with open(self.path, 'wb') as rec:
+            rec.write(data[:-100])
+
+        reader = SessionReader(self.path)
+        self.assertFalse(reader.complete)
+        self.assertEqual([0, 16000], [frame for frame, _ in reader.index])
+        self.assertEqual(3, len(reader.events()))
+        self.assertEqual(b"".join(chunk(n) for n in range(99)), b"".join(reader.audio()))
+        reader.close()
+        recorder.close()
+
+    def test_bounded_queue(self):
+        self.logger.info("\n\n### test_bounded_queue ###")
+        recorder = SessionRecorder(self.path, SAMPLE_RATE, queue_size=8, metrics=self.metrics)
+        # the writer has not started yet, the capture must not wait for it
+        start = time.perf_counter()
+        for n in range(20):
+            recorder.audio(chunk(n))
+        self.assertLess(time.perf_counter() - start, 0.1)
+        self.assertEqual(12, recorder.dropped)
+        self.assertEqual(12, self.metrics.counters["recorder_dropped"])
+
+        recorder.start()
+        recorder.close()
+        reader = SessionReader(self.path)
+        self.assertEqual(b"".join(chunk(n) for n in range(8)), b"".join(reader.audio()))
+        reader.close()
+
+    def test_replay(self):
+        self.logger.info("\n\n### test_replay ###")
+        self.record(150)
+        stream = RecordingStream(self.path)
+        self.assertEqual(SAMPLE_RATE, stream.sample_rate)
+        data = []
+        while True:
+            frames = stream.read(1000, False)
+            if not frames:
+                break
+            data.append(frames)
+        stream.close()
+        self.assertEqual(b"".join(chunk(n) for n in range(150)), b"".join(data))
+        self.assertEqual(3.0, stream.position)
+
+        # real time, starting at 2.5s
+        stream = RecordingStream(self.path, realtime=True, start=2.5)
+        start = time.time()
+        self.assertEqual(chunk(125), stream.read(CHUNK_BYTES // 2))
+        while stream.read(2048):
+            pass
+        self.assertAlmostEqual(0.5, time.time() - start, 1)
+        stream.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
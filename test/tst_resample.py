@@ -0,0 +1,67 @@
+import unittest
+import logging
+import sys
+
+import numpy as np
+
+sys.path.append("../src")
+
+from resample import Resampler
+
+RATE_OUT = 16000
+
+
+def tone(rate: int, frequency: float, seconds: float = 1.0) -> bytes:
+    t = np.arange(int(rate * seconds)) / rate
+    return np.rint(10000 * np.sin(2 * np.pi * frequency * t)).astype(np.int16).tobytes()
+
+
+class ResampleTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def resample(self, rate_in: int, data: bytes, chunk_bytes: int = 4096) -> np.ndarray:
+        resampler = Resampler(rate_in, RATE_OUT)
+        return np.frombuffer(b"".join(resampler.process(data[n:n + chunk_bytes])
+                                      for n in range(0, len(data), chunk_bytes)), dtype=np.int16)
+
+    def gain(self, rate_in: int, frequency: float) -> float:
+        """
+        Gain in dB of a tone, measured after the filter has settled.
+        """
+        output = self.resample(rate_in, tone(rate_in, frequency))[RATE_OUT // 4:].astype(np.float64)
+        rms = np.sqrt(np.mean(output * output))
+        return 20 * np.log10(max(rms, 1e-3) / (10000 / np.sqrt(2)))
+
+    def test_passband(self):
+        self.logger.info("\n\n### test_passband ###")
+        # the band of the speech, narrower from a telephone rate
+        for rate_in, frequencies in ((48000, (300, 1000, 3000)), (44100, (300, 1000, 3000)),
+                                     (32000, (300, 1000, 3000)), (8000, (300, 1000, 2500))):
+            for frequency in frequencies:
+                gain = self.gain(rate_in, frequency)
+                self.logger.debug("{} Hz at {} Hz: {:.3f} dB".format(frequency, rate_in, gain))
+                self.assertLess(abs(gain), 0.1)
+
+    def test_alias_rejection(self):
+        self.logger.info("\n\n### test_alias_rejection ###")
+        # tones above the output Nyquist frequency, folding back into the speech band
+        for rate_in in (48000, 44100, 32000):
+            for frequency in (10000, 12000, 15000):
+                gain = self.gain(rate_in, frequency)
+                self.logger.debug("{} Hz at {} Hz: {:.1f} dB".format(frequency, rate_in, gain))
+                self.assertLess(gain, -60)
+
+    def test_chunks(self):
+        self.logger.info("\n\n### test_chunks ###")
+        data = np.random.default_rng(0).integers(-3000, 3000, 44100, dtype=np.int16).tobytes()
+        # the output does not depend on the chunking of the stream
+        whole = self.resample(44100, data, len(data))
+        self.assertEqual(16000, len(whole))
+        self.assertTrue(np.array_equal(whole, self.resample(44100, data, 882)))
+        self.assertTrue(np.array_equal(whole, self.resample(44100, data, 4096)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import logging
+import tempfile
+import time
+import sys
+import os
+
+sys.path.append("../src")
+
+from responsecache import ResponseCache, normalize
+from ttspipeline import Segment
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def test_normalize(self):
+        self.logger.info("\n\n### test_normalize ###")
+        self.assertEqual("wie spät ist es", normalize("Äh, wie spät ist es bitte?"))
+        self.assertEqual(normalize("Erzähl einen Witz!"), normalize("erzähl  einen witz"))
+
+    def test_hit_miss(self):
+        self.logger.info("\n\n### test_hit_miss ###")
+        cache = ResponseCache()
+        self.assertIsNone(cache.get("erzähl einen witz"))
+        cache.put("erzähl einen witz", "Treffen sich zwei Jäger.")
+
+        entry = cache.get("Erzähl mal einen Witz.")
+        self.assertEqual("Treffen sich zwei Jäger.", entry.answer)
+        self.assertEqual({"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}, cache.stats())
+
+    def test_fuzzy(self):
+        self.logger.info("\n\n### test_fuzzy ###")
+        cache = ResponseCache(fuzzy=0.8)
+        cache.put("erzähl mir einen witz", "Treffen sich zwei Jäger.")
+        cache.put("wie wird das wetter morgen", "Sonnig.")
+        self.assertEqual("Treffen sich zwei Jäger.", cache.get("erzähl einen witz").answer)
+        self.assertEqual("Sonnig.", cache.get("wie wird wetter morgen").answer)
+        self.assertIsNone(cache.get("wie wird das essen heute"))
+
+        self.assertIsNone(ResponseCache().get("erzähl einen witz"))
+
+    def test_fuzzy_near_miss(self):
+        self.logger.info("\n\n### test_fuzzy_near_miss ###")
+        cache = ResponseCache(fuzzy=0.8)
+        cache.put("was ist zwei plus zwei", "Vier.")
+        cache.put("erzähl einen witz", "Treffen sich zwei Jäger.")
+        cache.put("wie wird das wetter morgen", "Sonnig.")
+        # similar spelling, but a different question
+        for question in ("was ist zwei plus drei", "was ist drei plus zwei", "erzähl keinen witz",
+                         "wie wird das wetter morgens", "wie wird das wetter"):
+            self.assertIsNone(cache.get(question), question)
+        self.assertEqual(5, cache.misses)
+
+    def test_ttl_and_lru(self):
+        self.logger.info("\n\n### test_ttl_and_lru ###")
+        cache = ResponseCache(max_entries=2, ttl=60)
+        cache.put("frage eins", "eins")
+        cache.put("frage zwei", "zwei")
+        cache.get("frage eins")
+        cache.put("frage drei", "drei")
+        self.assertIsNotNone(cache.get("frage eins"))
+        self.assertIsNone(cache.get("frage zwei"))
+
+        cache.put("frage zwei", "zwei").created = time.time() - 61
+        self.assertIsNone(cache.get("frage zwei"))
+        self.assertEqual(1, len(cache))
+
+    def test_audio_and_persistence(self):
+        self.logger.info("\n\n### test_audio_and_persistence ###")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache", "responses.pkl.gz")
+            cache = ResponseCache(path)
+            cache.put("erzähl einen witz", "Satz eins. Satz zwei.")
+
+            segments = [Segment("Satz eins."), Segment("Satz zwei.")]
+            for segment in segments:
+                segment.pcm, segment.sample_rate = b"\x01\x00" * 100, 22050
+            cache.set_audio("erzähl einen witz", segments[:1])
+            self.assertEqual([], cache.get("erzähl einen witz").audio)
+            cache.set_audio("erzähl einen witz", segments)
+            cache.save()
+
+            loaded = ResponseCache(path).get("erzähl einen witz")
+            self.assertEqual("Satz eins. Satz zwei.", loaded.answer)
+            restored = loaded.segments()
+            self.assertEqual(["Satz eins.", "Satz zwei."], [segment.text for segment in restored])
+            self.assertEqual(segments[0].pcm, restored[0].pcm)
+            self.assertAlmostEqual(segments[0].duration, restored[0].duration)
+
+
+if __name__ == '__main__':
+    unittest.main()
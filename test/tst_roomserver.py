@@ -0,0 +1,158 @@
+import unittest
+import threading
+import tempfile
+import logging
+import struct
+import json
+import time
+import wave
+import sys
+import os
+
+sys.path.append("../src")
+
+from roomserver import RoomServer, RoomClient
+from metrics import Metrics
+
+SAMPLE_RATE = 16000
+
+
+class FakeRecognizer:
+    """
+    Returns a result for every second of audio, the text being the seconds and the first sample of the
+    stream, so the results show whether the chunks of a session stay in order and apart from other sessions.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.frames = 0
+        self.seconds = 0
+        self.first = None
+
+    def AcceptWaveform(self, data):
+        time.sleep(0.002)
+        if self.first is None:
+            self.first = struct.unpack_from('<h', data)[0]
+        self.frames += len(data) // 2
+        if self.frames // self.sample_rate > self.seconds:
+            self.seconds = self.frames // self.sample_rate
+            return True
+        return False
+
+    def Result(self):
+        return json.dumps({"text": "{} sekunde {}".format(self.first, self.seconds)})
+
+    def PartialResult(self):
+        return json.dumps({"partial": "{} teil {}".format(self.first, self.frames // (self.sample_rate // 4))})
+
+    def FinalResult(self):
+        return json.dumps({"text": "{} ende".format(self.first)})
+
+
+class FakeRenderer:
+    def render(self, segment):
+        segment.sample_rate = 8000
+        segment.pcm = bytes(8000 * 2 * len(segment.text) // 20)
+
+
+class RoomServerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.directory = tempfile.TemporaryDirectory()
+        self.metrics = Metrics()
+
+    def tearDown(self) -> None:
+        self.server.close()
+        self.directory.cleanup()
+
+    def start_server(self, **kwargs) -> None:
+        self.server = RoomServer(FakeRecognizer, "127.0.0.1", 0, metrics=self.metrics, **kwargs).start()
+
+    def write_wav(self, name: str, seconds: float, first: int) -> str:
+        filename = os.path.join(self.directory.name, name + ".wav")
+        with wave.open(filename, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(struct.pack('<h', first) + bytes(int(seconds * SAMPLE_RATE) * 2 - 2))
+        return filename
+
+    def test_loopback_rooms(self):
+        self.logger.info("\n\n### test_loopback_rooms ###")
+        self.start_server(workers=2, max_sessions=4, max_queue=4)
+        rooms = ["kueche", "bad", "flur"]
+        clients = [RoomClient("127.0.0.1", self.server.server_port, room, SAMPLE_RATE, partials=True)
+                   for room in rooms]
+        threads = [threading.Thread(target=client.stream_wav, args=(self.write_wav(room, 3.5, n + 1),))
+                   for n, (room, client) in enumerate(zip(rooms, clients))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for client in clients:
+            self.assertTrue(client.finish(10))
+            client.close()
+
+        for n, client in enumerate(clients, 1):
+            self.assertEqual(["{} sekunde 1".format(n), "{} sekunde 2".format(n), "{} sekunde 3".format(n),
+                              "{} ende".format(n)], client.results)
+            self.assertIn("{} teil 1".format(n), client.partials)
+
+        self.assertEqual(3, self.metrics.counters["server_sessions_accepted"])
+        self.assertAlmostEqual(3 * 3.5, self.metrics.counters["server_audio_seconds"], 2)
+        self.assertEqual(0, self.metrics.gauges["server_sessions"])
+        # the queue depth gauges of the sessions are removed with them
+        self.assertEqual([], [name for name in self.metrics.gauges if name.startswith("session_queue_depth")])
+        self.assertEqual({}, self.server.sessions)
+
+    def test_queue_depth(self):
+        self.logger.info("\n\n### test_queue_depth ###")
+        self.start_server(workers=1, max_sessions=2, max_queue=3)
+        client = RoomClient("127.0.0.1", self.server.server_port, "kueche", SAMPLE_RATE)
+        session = self.server.sessions[client.session_id]
+        gauge = 'session_queue_depth{{room="kueche",session="{}"}}'.format(client.session_id)
+        self.assertIn(gauge, self.metrics.render().replace("chatbot_", ""))
+
+        # the client waits while the queue is full, no audio is lost
+        client.stream_wav(self.write_wav("kueche", 2.0, 7), chunk_size=512)
+        self.assertTrue(client.finish(10))
+        client.close()
+        self.assertEqual(3, session.max_depth)
+        self.assertEqual(["7 sekunde 1", "7 sekunde 2", "7 ende"], client.results)
+
+    def test_admission(self):
+        self.logger.info("\n\n### test_admission ###")
+        self.start_server(workers=1, max_sessions=1)
+        first = RoomClient("127.0.0.1", self.server.server_port, "kueche", SAMPLE_RATE)
+        with self.assertRaises(ConnectionRefusedError):
+            RoomClient("127.0.0.1", self.server.server_port, "bad", SAMPLE_RATE)
+        self.assertEqual(1, self.metrics.counters["server_sessions_rejected"])
+
+        first.finish(10)
+        first.close()
+        time.sleep(0.1)
+        second = RoomClient("127.0.0.1", self.server.server_port, "bad", SAMPLE_RATE)
+        second.finish(10)
+        second.close()
+
+    def test_reply(self):
+        self.logger.info("\n\n### test_reply ###")
+        self.start_server(responder_factory=lambda room: lambda text: ["Antwort fuer {}.".format(room),
+                                                                      "Du sagtest {}.".format(text)],
+                          renderer=FakeRenderer())
+        replies = []
+        client = RoomClient("127.0.0.1", self.server.server_port, "kueche", SAMPLE_RATE, on_reply=replies.append)
+        client.stream_wav(self.write_wav("kueche", 1.2, 5))
+        self.assertTrue(client.finish(10))
+        client.close()
+
+        self.assertEqual(["5 sekunde 1", "5 ende"], client.results)
+        self.assertEqual(["Antwort fuer kueche.", "Du sagtest 5 sekunde 1.", "Antwort fuer kueche.",
+                          "Du sagtest 5 ende."], [segment.text for segment in replies])
+        self.assertEqual(8000, replies[0].sample_rate)
+        self.assertEqual(len("Antwort fuer kueche.") * 800, len(replies[0].pcm))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import logging
+import time
+import sys
+
+sys.path.append("../src")
+
+from startup import Startup
+
+
+def slow(result, seconds: float = 0.2):
+    time.sleep(seconds)
+    return result
+
+
+class StartupTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def test_parallel(self):
+        self.logger.info("\n\n### test_parallel ###")
+        startup = Startup()
+        for name in ("model", "microphone", "tts"):
+            startup.run(name, slow, name)
+
+        start = time.perf_counter()
+        finished = []
+        startup.wait(["model", "microphone", "tts"], finished.append)
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual({"model", "microphone", "tts"}, set(finished))
+        self.assertEqual("tts", startup.result("tts"))
+
+    def test_dependencies(self):
+        self.logger.info("\n\n### test_dependencies ###")
+        startup = Startup()
+        startup.run("model", slow, "model")
+        startup.run("recognizer", lambda: startup.result("model") + "-recognizer", after=["model"])
+        self.assertEqual("model-recognizer", startup.result("recognizer"))
+
+        report = {entry["phase"]: entry for entry in startup.report()}
+        self.assertGreaterEqual(report["recognizer"]["waited"], 0.15)
+        self.assertLess(report["recognizer"]["duration"], 0.1)
+
+    def test_deferred(self):
+        self.logger.info("\n\n### test_deferred ###")
+        startup = Startup()
+        calls = []
+        startup.defer("prewarm", calls.append, "prewarm")
+        future = startup.defer("ask_ai", lambda: "ask_ai")
+        time.sleep(0.05)
+        self.assertEqual([], calls)
+        self.assertFalse(future.done())
+
+        self.assertEqual("ask_ai", startup.result("ask_ai"))
+        startup.ready()
+        startup.result("prewarm")
+        self.assertEqual(["prewarm"], calls)
+        self.assertTrue(all(entry["done"] and entry["deferred"] for entry in startup.report()))
+
+    def test_failure(self):
+        self.logger.info("\n\n### test_failure ###")
+        startup = Startup()
+        startup.run("model", lambda: open("/nonexistent/model"))
+        startup.run("recognizer", lambda: "recognizer", after=["model"])
+        with self.assertRaises(OSError):
+            startup.wait(["recognizer"])
+        self.assertTrue(all(entry["failed"] for entry in startup.report()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+import tempfile
+import logging
+import json
+import wave
+import sys
+import os
+
+sys.path.append("../src")
+
+from recognitionpool import RecognitionPool
+from transcribe import transcribe, find_files, load_done
+
+SAMPLE_RATE = 8000
+
+
+class FakeRecognizer:
+    """
+    Returns each chunk as a segment of one word with its timing, the word being the chunk number.
+    """
+
+    def __init__(self, model, sample_rate, grammar=None):
+        self.sample_rate = sample_rate
+        self.frames = 0
+        self.chunks = 0
+        self.words = False
+        self.result = {}
+
+    def SetWords(self, enable):
+        self.words = enable
+
+    def AcceptWaveform(self, data):
+        start = self.frames / self.sample_rate
+        self.frames += len(data) // 2
+        self.chunks += 1
+        word = "wort{}".format(self.chunks)
+        self.result = {"text": word}
+        if self.words:
+            self.result["result"] = [{"word": word, "start": start, "end": self.frames / self.sample_rate,
+                                      "conf": 1.0}]
+        return True
+
+    def Result(self):
+        return json.dumps(self.result)
+
+    def FinalResult(self):
+        return json.dumps({"text": ""})
+
+
+class TranscribeTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, "corpus")
+        os.makedirs(os.path.join(self.root, "kueche"))
+        self.output = os.path.join(self.directory.name, "out.jsonl")
+        self.pool = RecognitionPool(object, FakeRecognizer, processes=2, slots=8, slot_bytes=16000)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        self.directory.cleanup()
+
+    def write_wav(self, name: str, seconds: float) -> str:
+        filename = os.path.join(self.root, name)
+        with wave.open(filename, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(bytes(int(seconds * SAMPLE_RATE) * 2))
+        return filename
+
+    def read_output(self) -> dict:
+        with open(self.output, encoding="utf-8") as out:
+            return {line["file"]: line for line in map(json.loads, out)}
+
+    def test_transcribe(self):
+        self.logger.info("\n\n### test_transcribe ###")
+        self.write_wav("a.wav", 2.5)
+        self.write_wav(os.path.join("kueche", "b.wav"), 0.5)
+        with open(os.path.join(self.root, "c.wav"), 'wb') as broken:
+            broken.write(b"RIFF\0\0\0\0WAVEjunk")
+        # cut off within the format
+        with open(os.path.join(self.root, "d.wav"), 'wb') as truncated:
+            truncated.write(b"RIFF\0\0\0\0WAVEfmt \x10\0\0\0\x01\0\x01\0")
+
+        files = find_files([self.root])
+        summary = transcribe(self.pool, files, self.output, self.root, chunk_seconds=1.0)
+        self.assertEqual({"files": 4, "skipped": 0, "failed": 2, "audio_time": 3.0}, {
+            key: summary[key] for key in ("files", "skipped", "failed", "audio_time")})
+
+        results = self.read_output()
+        self.assertEqual({"a.wav", os.path.join("kueche", "b.wav"), "c.wav", "d.wav"}, set(results))
+        self.assertIn("truncated", results["d.wav"]["error"])
+        a = results["a.wav"]
+        # 2.5s in chunks of 1s
+        self.assertEqual("wort1 wort2 wort3", a["text"])
+        self.assertEqual(2.5, a["duration"])
+        self.assertEqual([(0.0, 1.0), (1.0, 2.0), (2.0, 2.5)],
+                         [(segment["start"], segment["end"]) for segment in a["segments"]])
+        self.assertEqual("wort3", a["segments"][2]["words"][0]["word"])
+        self.assertIn("error", results["c.wav"])
+
+        # the failed file is tried again
+        self.assertEqual({"a.wav", os.path.join("kueche", "b.wav")}, load_done(self.output))
+        self.write_wav("c.wav", 1.0)
+        summary = transcribe(self.pool, files, self.output, self.root, chunk_seconds=1.0)
+        self.assertEqual((2, 2, 1), (summary["files"], summary["skipped"], summary["failed"]))
+        self.assertEqual("wort1", self.read_output()["c.wav"]["text"])
+
+    def test_resume(self):
+        self.logger.info("\n\n### test_resume ###")
+        for name in ("a.wav", "b.wav", "c.wav"):
+            self.write_wav(name, 1.0)
+        files = find_files([self.root])
+        transcribe(self.pool, files, self.output, self.root)
+        self.assertEqual(0, transcribe(self.pool, files, self.output, self.root)["files"])
+
+        # an interrupted run leaves a partial line
+        with open(self.output, 'rb') as out:
+            lines = out.readlines()
+        with open(self.output, 'wb') as out:
+            out.writelines(lines[:2])
+            out.write(lines[2][:20])
+        self.assertEqual(2, len(load_done(self.output)))
+
+        summary = transcribe(self.pool, files, self.output, self.root)
+        self.assertEqual((1, 2), (summary["files"], summary["skipped"]))
+        self.assertEqual({"a.wav", "b.wav", "c.wav"}, set(self.read_output()))
+
+
+if __name__ == '__main__':
+    unittest.main()
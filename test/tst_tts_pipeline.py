@@ -0,0 +1,83 @@
+import unittest
+import logging
+import time
+import sys
+
+sys.path.append("../src")
+
+import ttspipeline
+
+SYNTH_TIME = 0.2
+PLAY_TIME = 0.2
+
+
+class FakeRenderer:
+    def render(self, segment: ttspipeline.Segment) -> None:
+        time.sleep(SYNTH_TIME)
+        segment.sample_rate = 16000
+        segment.pcm = bytes(int(segment.sample_rate * 2 * PLAY_TIME))
+
+
+class FakePlayer:
+    def __init__(self):
+        self.played = []
+
+    def __call__(self, segment: ttspipeline.Segment) -> None:
+        time.sleep(segment.duration)
+        self.played.append(segment.text)
+
+
+class TtsPipelineTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.player = FakePlayer()
+        self.tts = ttspipeline.TtsPipeline(FakeRenderer(), self.player)
+
+    def tearDown(self) -> None:
+        self.tts.close()
+
+    def test_overlap(self):
+        self.logger.info("\n\n### test_overlap ###")
+        start = time.time()
+        for n in range(4):
+            self.tts.say("Satz {}".format(n))
+        self.assertTrue(self.tts.wait(5))
+        total_time = time.time() - start
+
+        self.logger.info(self.tts.recent_timings())
+        self.assertEqual(["Satz 0", "Satz 1", "Satz 2", "Satz 3"], self.player.played)
+        self.assertLess(total_time, 4 * (SYNTH_TIME + PLAY_TIME) - 2 * SYNTH_TIME)
+        for timings in self.tts.recent_timings():
+            self.assertGreaterEqual(timings["synth_time"], SYNTH_TIME)
+            self.assertGreaterEqual(timings["play_time"], PLAY_TIME)
+
+    def test_cancel(self):
+        self.logger.info("\n\n### test_cancel ###")
+        for n in range(4):
+            self.tts.say("Satz {}".format(n))
+        time.sleep(SYNTH_TIME + PLAY_TIME / 2)
+        self.tts.cancel()
+
+        self.assertTrue(self.tts.wait(5))
+        self.assertEqual(["Satz 0"], self.player.played)
+
+    def test_cancel_after_close(self):
+        self.logger.info("\n\n### test_cancel_after_close ###")
+        for n in range(2):
+            self.tts.say("Satz {}".format(n))
+        self.tts.close()
+        # e.g. a barge-in racing the shutdown
+        self.tts.cancel()
+
+        self.assertTrue(self.tts.wait(5))
+        self.assertFalse(self.tts.is_busy())
+        self.tts._synth_thread.join(5)
+        self.tts._play_thread.join(5)
+        self.assertFalse(self.tts._synth_thread.is_alive())
+        self.assertFalse(self.tts._play_thread.is_alive())
+        self.assertEqual([], self.player.played)
+
+
+if __name__ == '__main__':
+    unittest.main()
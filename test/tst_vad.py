@@ -0,0 +1,72 @@
+import unittest
+import logging
+import sys
+
+import numpy as np
+
+sys.path.append("../src")
+
+from vad import EnergyVad, VadGate
+
+SAMPLE_RATE = 16000
+CHUNK_SIZE = 320
+
+
+def tone(seconds: float, rms: float, frequency: float = 150.0) -> list:
+    """
+    Chunks of a sine tone with the given RMS, starting at a random phase.
+    """
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    samples = (rms * np.sqrt(2) * np.sin(2 * np.pi * frequency * t + np.random.uniform(0, 2 * np.pi)))
+    data = samples.astype(np.int16).tobytes()
+    return [data[pos:pos + 2 * CHUNK_SIZE] for pos in range(0, len(data), 2 * CHUNK_SIZE)]
+
+
+def silence(seconds: float) -> list:
+    return [bytes(2 * CHUNK_SIZE)] * int(round(seconds * SAMPLE_RATE / CHUNK_SIZE))
+
+
+class VadTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def test_speech(self):
+        self.logger.info("\n\n### test_speech ###")
+        vad = EnergyVad(SAMPLE_RATE)
+        self.assertFalse(any(vad.is_speech(data) for data in silence(0.5)))
+        self.assertTrue(all(vad.is_speech(data) for data in tone(1.0, 2000, 300)))
+        self.assertFalse(any(vad.is_speech(data) for data in silence(0.5)))
+
+        # broadband noise crosses zero too often
+        noise = np.random.default_rng(0).normal(0, 2000, SAMPLE_RATE // 2).astype(np.int16).tobytes()
+        self.assertFalse(any(vad.is_speech(noise[pos:pos + 2 * CHUNK_SIZE])
+                             for pos in range(0, len(noise), 2 * CHUNK_SIZE)))
+
+    def test_steady_noise(self):
+        self.logger.info("\n\n### test_steady_noise ###")
+        vad = EnergyVad(SAMPLE_RATE, max_speech=2.0)
+        hum = [vad.is_speech(data) for data in tone(10.0, 1000)]
+        # the hum of a fan is taken for speech at first, but not forever
+        self.assertTrue(all(hum[:int(2.0 * SAMPLE_RATE / CHUNK_SIZE)]))
+        self.assertFalse(any(hum[int(2.1 * SAMPLE_RATE / CHUNK_SIZE):]))
+        self.assertGreater(vad.noise_floor, 900)
+
+        # speech above the hum is still detected
+        self.assertTrue(all(vad.is_speech(data) for data in tone(1.0, 5000, 300)))
+
+    def test_gate(self):
+        self.logger.info("\n\n### test_gate ###")
+        gate = VadGate(SAMPLE_RATE, CHUNK_SIZE, pre_roll=0.1, hangover=0.2)
+        passed = [gate.process(data) for data in silence(1.0) + tone(0.5, 2000, 300) + silence(1.0)]
+        onset = int(1.0 * SAMPLE_RATE / CHUNK_SIZE)
+        self.assertEqual([], sum(passed[:onset], []))
+        # the pre-roll is passed with the first speech chunk
+        self.assertEqual(6, len(passed[onset]))
+        # pre-roll, speech and the hangover, closing on its last chunk
+        self.assertEqual(5 + 25 + 9, sum(len(chunks) for chunks in passed))
+        self.assertFalse(gate.is_open)
+
+
+if __name__ == '__main__':
+    unittest.main()